@@ -0,0 +1,19 @@
+from document.tile_grid import TileGrid, TileBuffer, TileSnapshot
+from document.save_worker import SaveWorker
+from document.png_writer import write_png
+from document.image_loader import ImageLoader, read_image_size
+from document.tiled_document import (write_tiled_document, read_tiled_document,
+                                     TiledDocumentReader)
+from document.mip_pyramid import MipPyramid
+
+__all__ = ['TileGrid',
+           'TileBuffer',
+           'TileSnapshot',
+           'SaveWorker',
+           'write_png',
+           'ImageLoader',
+           'read_image_size',
+           'write_tiled_document',
+           'read_tiled_document',
+           'TiledDocumentReader',
+           'MipPyramid']
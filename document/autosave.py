@@ -0,0 +1,362 @@
+import json
+import os
+import pickle
+import queue
+import struct
+import threading
+import uuid
+import zlib
+
+from pathlib import Path
+from typing import Optional, Tuple
+
+import pygame
+
+from document.image_loader import ImageLoader
+from document.tile_grid import TileSnapshot
+from document.tiled_document import (write_tiled_document, read_tiled_document,
+                                     read_tiled_document_size, replace_file)
+from tools.undo_record import UndoRecord, PixelDiffUndoRecord
+
+# Only one of these is needed, to lock files on POSIX or on Windows.
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    import msvcrt
+
+RECOVERY_DIRECTORY = Path.home() / '.pygame_paint' / 'recovery'
+
+# A change log is a header naming the checkpoint it starts from, followed by an entry for
+# each change, a pickled undo record prefixed with its length and a checksum. The log is
+# only ever appended to, so after a crash the entries up to the first incomplete one are
+# the changes that were made.
+CHANGE_LOG_MAGIC = b'PPAINTCL'
+CHANGE_LOG_HEADER_FORMAT = '<8sI'
+CHANGE_LOG_HEADER_SIZE = struct.calcsize(CHANGE_LOG_HEADER_FORMAT)
+CHANGE_ENTRY_FORMAT = '<II'
+CHANGE_ENTRY_SIZE = struct.calcsize(CHANGE_ENTRY_FORMAT)
+
+
+class AutosaveJournal:
+    """
+    The crash recovery files of one canvas. Each change made to the canvas is appended to a
+    change log, as the record that makes it again. The log starts from a checkpoint of the
+    whole canvas kept as a tiled document, and once the changes logged add up to the size of
+    the canvas a new checkpoint is written and a new log started from it.
+
+    Next to them is a small info file with the canvas's title and save path, and a lock file
+    that the app using the journal keeps locked, so a journal can be told apart from one left
+    behind by a crash.
+
+    :param directory: The directory the recovery files are kept in.
+    :param journal_id: The id of existing recovery files, or None to start new ones.
+    """
+    def __init__(self, directory: Path, journal_id: Optional[str] = None):
+        self.directory = directory
+        self.journal_id = journal_id if journal_id is not None else uuid.uuid4().hex
+        self.change_log_path = directory / (self.journal_id + '.changes')
+        self.info_path = directory / (self.journal_id + '.json')
+        self.lock_path = directory / (self.journal_id + '.lock')
+
+        # Only touched from the main thread. The size of the changes logged since the last
+        # checkpoint, or None when a new checkpoint is needed.
+        self.logged_size = None
+        self.info = None
+
+        # set by the autosave worker if a write fails, so the next write is a checkpoint
+        self.write_failed = False
+
+        # only touched by whichever thread is writing the journal
+        self._checkpoint_number = 0
+        self._change_log = None
+        self._lock_file = None
+
+    def needs_checkpoint(self, change_size: int, canvas_size: int) -> bool:
+        # replaying a log longer than the canvas would take longer than reading a checkpoint
+        return (self.logged_size is None or self.write_failed or
+                self.logged_size + change_size > canvas_size)
+
+    def write_checkpoint(self, snapshot: TileSnapshot):
+        """
+        :param snapshot: A snapshot of the canvas, which is copied first.
+        """
+        image = snapshot.copy_all_tiles()
+        if self._lock_file is None:
+            self.lock()
+        checkpoint_number = self._checkpoint_number + 1
+        write_tiled_document(image, self._get_checkpoint_path(checkpoint_number),
+                             snapshot.grid.tile_size)
+
+        # the new checkpoint is only used once a log starting from it has been moved in place
+        if self._change_log is not None:
+            self._change_log.close()
+            self._change_log = None
+        temporary_path = self.change_log_path.with_suffix('.saving.changes')
+        with open(temporary_path, 'wb') as change_log:
+            change_log.write(struct.pack(CHANGE_LOG_HEADER_FORMAT, CHANGE_LOG_MAGIC,
+                                         checkpoint_number))
+            change_log.flush()
+            os.fsync(change_log.fileno())
+        # also makes sure the checkpoint, in the same directory, is there after a crash
+        replace_file(temporary_path, self.change_log_path)
+
+        old_checkpoint_path = self._get_checkpoint_path(self._checkpoint_number)
+        if old_checkpoint_path.exists():
+            old_checkpoint_path.unlink()
+        self._checkpoint_number = checkpoint_number
+        self._change_log = open(self.change_log_path, 'ab')
+
+    def append_change(self, record):
+        """
+        :param record: A pixel diff undo record of the change, or an undo record of the
+                       pixels of the area after it.
+        """
+        if self._change_log is None:
+            raise ValueError('There is no checkpoint to log changes from')
+        # a record can only be pickled with its pixels compressed
+        record.compress(1)
+        record_data = pickle.dumps(record, protocol=pickle.HIGHEST_PROTOCOL)
+        self._change_log.write(struct.pack(CHANGE_ENTRY_FORMAT, len(record_data),
+                                           zlib.crc32(record_data)) + record_data)
+        self._change_log.flush()
+
+    def write_info(self, info):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        temporary_path = self.info_path.with_suffix('.saving.json')
+        with open(temporary_path, 'w') as info_file:
+            json.dump(info, info_file)
+            info_file.flush()
+            os.fsync(info_file.fileno())
+        replace_file(temporary_path, self.info_path)
+
+    def read_info(self):
+        with open(self.info_path) as info_file:
+            return json.load(info_file)
+
+    def read_image(self) -> pygame.Surface:
+        """
+        Replay the logged changes on to the checkpoint they start from.
+
+        :return: The canvas image as it was after the last change that was logged in full.
+        """
+        with open(self.change_log_path, 'rb') as change_log:
+            change_log_data = change_log.read()
+        image = read_tiled_document(self._get_checkpoint_path(
+            self._unpack_change_log_header(change_log_data)))
+        entry_start = CHANGE_LOG_HEADER_SIZE
+        while entry_start + CHANGE_ENTRY_SIZE <= len(change_log_data):
+            record_length, checksum = struct.unpack_from(CHANGE_ENTRY_FORMAT, change_log_data,
+                                                         entry_start)
+            record_start = entry_start + CHANGE_ENTRY_SIZE
+            record_data = change_log_data[record_start:record_start + record_length]
+            if len(record_data) < record_length or zlib.crc32(record_data) != checksum:
+                break  # the app stopped part way through logging this change
+            pickle.loads(record_data).swap(image)
+            entry_start = record_start + record_length
+        return image
+
+    def read_image_size(self) -> Optional[Tuple[int, int]]:
+        try:
+            with open(self.change_log_path, 'rb') as change_log:
+                checkpoint_number = self._unpack_change_log_header(
+                    change_log.read(CHANGE_LOG_HEADER_SIZE))
+        except (OSError, ValueError):
+            return None
+        return read_tiled_document_size(self._get_checkpoint_path(checkpoint_number))
+
+    def lock(self) -> bool:
+        """
+        Lock the journal to this app, until the journal is deleted or the app stops.
+
+        :return: False if another app that is still running has it locked.
+        """
+        self.directory.mkdir(parents=True, exist_ok=True)
+        lock_file = open(self.lock_path, 'a+b')
+        try:
+            if fcntl is not None:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            else:
+                lock_file.seek(0)
+                msvcrt.locking(lock_file.fileno(), msvcrt.LK_NBLCK, 1)
+        except OSError:
+            lock_file.close()
+            return False
+        self._lock_file = lock_file
+        return True
+
+    def delete(self):
+        if self._change_log is not None:
+            self._change_log.close()
+            self._change_log = None
+        for path in ([self.change_log_path, self.info_path] +
+                     list(self.directory.glob(self.journal_id + '.*.ppaint'))):
+            if path.exists():
+                path.unlink()
+        # the lock goes last, so no other app takes the journal for a crashed one part way
+        if self._lock_file is not None:
+            self._lock_file.close()
+            self._lock_file = None
+            self.lock_path.unlink()
+
+    def _get_checkpoint_path(self, checkpoint_number: int) -> Path:
+        return self.directory / '{}.{}.ppaint'.format(self.journal_id, checkpoint_number)
+
+    @staticmethod
+    def _unpack_change_log_header(buffer) -> int:
+        try:
+            magic, checkpoint_number = struct.unpack_from(CHANGE_LOG_HEADER_FORMAT, buffer, 0)
+        except struct.error:
+            raise ValueError('Not a change log')
+        if magic != CHANGE_LOG_MAGIC:
+            raise ValueError('Not a change log')
+        return checkpoint_number
+
+    @staticmethod
+    def find_journals(directory: Path):
+        """
+        Find the journals left behind by apps that are no longer running, and lock them to
+        this app.
+
+        :param directory: The directory the recovery files are kept in.
+
+        :return: The journals left behind in the directory that have both their files.
+        """
+        if not directory.is_dir():
+            return []
+        # files part way through being written have a '.saving' part in their names
+        journals = [AutosaveJournal(directory, info_path.stem)
+                    for info_path in sorted(directory.glob('*.json'))
+                    if '.' not in info_path.stem and info_path.with_suffix('.changes').exists()]
+        return [journal for journal in journals if journal.lock()]
+
+
+class JournalLoader(ImageLoader):
+    """
+    Recovers the image of an autosave journal on a background thread, the same way as an
+    ImageLoader loads an image file.
+
+    :param journal: The journal to recover.
+    :param canvas_window: The canvas window waiting for the image.
+    """
+    def __init__(self, journal: AutosaveJournal, canvas_window):
+        super().__init__(journal.change_log_path, canvas_window)
+        self.journal = journal
+
+    def _load(self):
+        try:
+            return self.journal.read_image(), None
+        except (pickle.UnpicklingError, EOFError, AttributeError) as journal_error:
+            raise ValueError(str(journal_error))
+
+
+class AutosaveWorker(threading.Thread):
+    """
+    Writes autosave journals on a background thread. Jobs are taken from a queue in order, so
+    a checkpoint, the changes logged after it and deleting the files always happen in the
+    order they were asked for.
+    """
+    def __init__(self):
+        super().__init__(daemon=True)
+        self.jobs = queue.Queue()
+
+    def run(self):
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                return
+            journal, write_function, arguments = job
+            try:
+                write_function(*arguments)
+            except (OSError, ValueError, pygame.error):
+                # the journal is started again from a new checkpoint on the next autosave
+                journal.write_failed = True
+
+    def stop(self):
+        self.jobs.put(None)
+        self.join()
+
+
+class Autosaver:
+    """
+    Journals each change made to a canvas as it is made. The records of the changes are
+    taken from the canvas's undo history every frame and passed to an AutosaveWorker to log.
+    Checkpoints are snapshots of the canvas that the worker copies too, so the main thread
+    only copies the tiles of a checkpoint that are about to change before the worker gets to
+    them.
+
+    Journals are deleted again when their canvas window closes, or when the app quits
+    normally, so any left in the recovery directory on start up that aren't locked by
+    another running app are from a crash.
+
+    :param directory: The directory to keep the recovery files in.
+    """
+    def __init__(self, directory: Path = RECOVERY_DIRECTORY):
+        self.directory = directory
+        self.journals = {}
+
+        self.worker = AutosaveWorker()
+        self.worker.start()
+
+    def update(self, canvas_windows):
+        for canvas_window in canvas_windows:
+            self.autosave(canvas_window)
+
+    def autosave(self, canvas_window):
+        canvas_ui = canvas_window.canvas_ui
+        active_tool = canvas_ui.active_tool
+        if canvas_ui.loading or (active_tool is not None and
+                                 active_tool.active_canvas is canvas_ui and
+                                 active_tool.is_busy()):
+            return  # try again next frame rather than journal a half finished change
+
+        changes = canvas_ui.history.take_changes()
+        if not canvas_ui.has_unsaved_changes():
+            # there is nothing to recover, a new journal starts with the next change
+            self.remove_journal(canvas_window)
+            return
+
+        journal = self.journals.get(canvas_window)
+        if journal is None:
+            journal = AutosaveJournal(self.directory)
+            self.journals[canvas_window] = journal
+
+        if changes or journal.logged_size is None:
+            self._log_changes(journal, canvas_ui, changes)
+
+        info = {'title': canvas_window.window_display_title,
+                'save_file_path': (str(canvas_ui.save_file_path)
+                                   if canvas_ui.save_file_path is not None else None)}
+        if info != journal.info:
+            journal.info = info
+            self.worker.jobs.put((journal, journal.write_info, (info,)))
+
+    def _log_changes(self, journal: AutosaveJournal, canvas_ui, changes):
+        change_size = sum(change.size for change in changes)
+        canvas_size = canvas_ui.tiles.size[0] * canvas_ui.tiles.size[1] * 4
+        if journal.needs_checkpoint(change_size, canvas_size):
+            # the checkpoint already has the changes in it
+            journal.write_failed = False
+            journal.logged_size = 0
+            self.worker.jobs.put((journal, journal.write_checkpoint,
+                                  (canvas_ui.take_snapshot(),)))
+        else:
+            journal.logged_size += change_size
+            for change in changes:
+                if not isinstance(change, PixelDiffUndoRecord):
+                    # Other records hold the pixels from before a change, so the pixels from
+                    # after it are copied instead. Changes are taken every frame, so copying
+                    # them once they have all been made still replays them in order.
+                    change = UndoRecord(canvas_ui.get_image(change.rect).subsurface(
+                        change.rect).copy(), change.rect.copy())
+                self.worker.jobs.put((journal, journal.append_change, (change,)))
+
+    def remove_journal(self, canvas_window):
+        journal = self.journals.pop(canvas_window, None)
+        if journal is not None:
+            self.worker.jobs.put((journal, journal.delete, ()))
+
+    def shutdown(self):
+        for canvas_window in list(self.journals):
+            self.remove_journal(canvas_window)
+        self.worker.stop()
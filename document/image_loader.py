@@ -0,0 +1,92 @@
+import struct
+import threading
+
+from pathlib import Path
+from typing import Optional, Tuple
+
+import pygame
+
+from document.tiled_document import (TILED_DOCUMENT_MAGIC, TiledDocumentReader,
+                                     is_tiled_document_path, read_tiled_document_size)
+from ui.event_types import UI_PAINT_IMAGE_LOADED
+
+
+def read_image_size(path: Path) -> Optional[Tuple[int, int]]:
+    """
+    Read the pixel size of an image from its file header, without decoding the image.
+    Understands tiled documents, PNG, GIF, BMP and JPEG files.
+
+    :param path: The path of the image file.
+
+    :return: The (width, height) of the image, or None if it can't be read.
+    """
+    try:
+        with open(path, 'rb') as image_file:
+            header = image_file.read(26)
+            if header[:8] == TILED_DOCUMENT_MAGIC:
+                return read_tiled_document_size(path)
+            if header[:8] == b'\x89PNG\r\n\x1a\n' and header[12:16] == b'IHDR':
+                return struct.unpack('>II', header[16:24])
+            if header[:6] in (b'GIF87a', b'GIF89a'):
+                return struct.unpack('<HH', header[6:10])
+            if header[:2] == b'BM':
+                width, height = struct.unpack('<ii', header[18:26])
+                return width, abs(height)
+            if header[:2] == b'\xff\xd8':
+                return _read_jpeg_size(image_file)
+    except (OSError, struct.error):
+        pass
+    return None
+
+
+def _read_jpeg_size(image_file) -> Optional[Tuple[int, int]]:
+    # walk the segments until a start of frame marker, which holds the size
+    image_file.seek(2)
+    while True:
+        marker = image_file.read(2)
+        if len(marker) < 2 or marker[0] != 0xff:
+            return None
+        segment_length = struct.unpack('>H', image_file.read(2))[0]
+        if 0xc0 <= marker[1] <= 0xcf and marker[1] not in (0xc4, 0xc8, 0xcc):
+            height, width = struct.unpack('>xHH', image_file.read(5))
+            return width, height
+        image_file.seek(segment_length - 2, 1)
+
+
+class ImageLoader(threading.Thread):
+    """
+    Decodes an image file on a background thread so the main loop keeps running. Once
+    finished, successfully or not, a UI_PAINT_IMAGE_LOADED event is posted carrying the canvas
+    window the image is for, the path, and the image or None.
+
+    The image is not converted to the display format here, as that has to happen on the main
+    thread.
+
+    A tiled document isn't read here at all. The event carries an open TiledDocumentReader,
+    or None for other images, and a blank canvas image for the reader to read tiles on to as
+    they are needed. That image is already in the canvas format.
+
+    :param path: The path of the image file to load.
+    :param canvas_window: The canvas window waiting for the image.
+    """
+    def __init__(self, path: Path, canvas_window):
+        super().__init__(daemon=True)
+        self.path = path
+        self.canvas_window = canvas_window
+
+    def run(self):
+        try:
+            image, tiled_document_reader = self._load()
+        except (pygame.error, OSError, ValueError):
+            image, tiled_document_reader = None, None
+        pygame.event.post(pygame.event.Event(UI_PAINT_IMAGE_LOADED,
+                                             {'canvas_window': self.canvas_window,
+                                              'path': self.path,
+                                              'image': image,
+                                              'tiled_document_reader': tiled_document_reader}))
+
+    def _load(self):
+        if is_tiled_document_path(self.path):
+            tiled_document_reader = TiledDocumentReader(self.path)
+            return tiled_document_reader.create_image(), tiled_document_reader
+        return pygame.image.load(str(self.path)), None
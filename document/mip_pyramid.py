@@ -0,0 +1,81 @@
+from typing import List, Optional, Tuple
+
+import pygame
+
+from document.tile_grid import TileGrid
+
+
+class MipPyramid:
+    """
+    Successively halved copies of a canvas image, for showing the canvas zoomed out without
+    scaling the whole image every frame. Level 0 is the image itself and each level after
+    it is half the size of the one before.
+
+    Levels are only built the first time they are asked for. After that, the tiles of the
+    image that are modified are tracked by a 'mip' dirty channel, and just those tiles of the
+    built levels are scaled down again the next time a level is asked for.
+
+    :param image: The full size canvas image.
+    :param tiles: The tile grid of the canvas, that modifications to the image are marked
+                  on. If None, the pyramid has a grid of its own.
+    """
+    def __init__(self, image: pygame.Surface, tiles: Optional[TileGrid] = None):
+        self.image = image
+        self.tiles = tiles if tiles is not None else TileGrid(image.get_size())
+        self._levels: List[pygame.Surface] = [image]
+
+        self.tiles.add_dirty_channel('mip')
+        self.tiles.clear_dirty('mip')
+
+    @staticmethod
+    def get_level_size(size: Tuple[int, int], level: int) -> Tuple[int, int]:
+        return max(1, size[0] >> level), max(1, size[1] >> level)
+
+    @staticmethod
+    def get_level_rect(rect: pygame.Rect, level: int) -> pygame.Rect:
+        """
+        :param rect: An area of the full size image.
+        :param level: The pyramid level.
+
+        :return: The area of the level that covers it, not clipped to the level's size.
+        """
+        step = 1 << level
+        left = rect.left >> level
+        top = rect.top >> level
+        return pygame.Rect(left, top,
+                           ((rect.right + step - 1) >> level) - left,
+                           ((rect.bottom + step - 1) >> level) - top)
+
+    def get_level(self, level: int) -> pygame.Surface:
+        """
+        Get a level of the pyramid, building it or bringing it up to date as needed.
+
+        :param level: The level, 0 is the full size image.
+
+        :return: The level's surface. It belongs to the pyramid and must not be drawn on.
+        """
+        self._update_levels()
+        while len(self._levels) <= level:
+            self._levels.append(pygame.Surface(
+                self.get_level_size(self.image.get_size(), len(self._levels)),
+                flags=pygame.SRCALPHA, depth=32))
+            self._downsample(len(self._levels) - 1, self._levels[-1].get_rect())
+        return self._levels[level]
+
+    def _update_levels(self):
+        dirty_tiles = self.tiles.take_dirty_tiles('mip')
+        # each level is rebuilt from the level above, which is already up to date
+        for level in range(1, len(self._levels)):
+            for tile in dirty_tiles:
+                area = self.get_level_rect(self.tiles.get_tile_rect(tile),
+                                           level).clip(self._levels[level].get_rect())
+                if area.width > 0 and area.height > 0:
+                    self._downsample(level, area)
+
+    def _downsample(self, level: int, area: pygame.Rect):
+        # each pixel of the area is the average of a 2x2 block of the level above it
+        parent = self._levels[level - 1]
+        parent_area = pygame.Rect(area.left * 2, area.top * 2,
+                                  area.width * 2, area.height * 2).clip(parent.get_rect())
+        pygame.transform.smoothscale(parent.subsurface(parent_area), area.size,
+                                     self._levels[level].subsurface(area))
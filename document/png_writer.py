@@ -0,0 +1,148 @@
+import os
+import struct
+import zlib
+
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, Optional
+
+import pygame
+
+# With numpy every row is filtered with whichever of the five PNG filters suits it best,
+# without it rows are written unfiltered.
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+STRIP_HEIGHT = 64
+ADLER_BASE = 65521
+
+
+def write_png(surface: pygame.Surface, path: Path, compression_level: int = 6,
+              progress_callback: Optional[Callable[[float], None]] = None,
+              max_workers: Optional[int] = None):
+    """
+    Save a surface as a 32 bit RGBA PNG. The image is split into horizontal strips that are
+    filtered and deflated in parallel on a thread pool, then joined back into one zlib stream
+    by ending every strip but the last with a sync flush.
+
+    :param surface: The surface to save, nothing else should use it while it is saving.
+    :param path: The path of the file to write.
+    :param compression_level: The zlib compression level, from 0 (none) to 9 (smallest).
+    :param progress_callback: Optionally, called with the fraction of strips written so far.
+    :param max_workers: The most threads to use, defaults to one per CPU.
+    """
+    width, height = surface.get_size()
+    row_length = width * 4
+    pixels = pygame.image.tobytes(surface, 'RGBA')
+
+    strip_tops = range(0, height, STRIP_HEIGHT)
+    if max_workers is None:
+        max_workers = os.cpu_count() or 1
+
+    with open(path, 'wb') as png_file:
+        png_file.write(PNG_SIGNATURE)
+        _write_chunk(png_file, b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 6, 0, 0, 0))
+
+        zlib_header = _get_zlib_header(compression_level)
+        adler = 1
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            strip_futures = [executor.submit(_encode_strip, pixels, row_length, strip_top,
+                                             min(strip_top + STRIP_HEIGHT, height),
+                                             compression_level,
+                                             strip_top + STRIP_HEIGHT >= height)
+                             for strip_top in strip_tops]
+            for strip_index, strip_future in enumerate(strip_futures):
+                compressed_strip, strip_adler, strip_length = strip_future.result()
+                adler = _combine_adler32(adler, strip_adler, strip_length)
+                if strip_index == 0:
+                    compressed_strip = zlib_header + compressed_strip
+                if strip_index == len(strip_futures) - 1:
+                    compressed_strip += struct.pack('>I', adler)
+                _write_chunk(png_file, b'IDAT', compressed_strip)
+                if progress_callback is not None:
+                    progress_callback((strip_index + 1) / len(strip_futures))
+
+        _write_chunk(png_file, b'IEND', b'')
+        png_file.flush()
+        os.fsync(png_file.fileno())
+
+
+def _encode_strip(pixels: bytes, row_length: int, top: int, bottom: int,
+                  compression_level: int, is_last: bool):
+    filtered_strip = _filter_rows(pixels, row_length, top, bottom)
+
+    compressor = zlib.compressobj(compression_level, zlib.DEFLATED, -zlib.MAX_WBITS)
+    compressed_strip = compressor.compress(filtered_strip)
+    compressed_strip += compressor.flush(zlib.Z_FINISH if is_last else zlib.Z_SYNC_FLUSH)
+    return compressed_strip, zlib.adler32(filtered_strip), len(filtered_strip)
+
+
+def _filter_rows(pixels: bytes, row_length: int, top: int, bottom: int) -> bytes:
+    if numpy is None:
+        return b''.join(b'\x00' + pixels[row * row_length:(row + 1) * row_length]
+                        for row in range(top, bottom))
+
+    image_rows = numpy.frombuffer(pixels, dtype=numpy.uint8).reshape(-1, row_length)
+    rows = image_rows[top:bottom].astype(numpy.int16)
+    above = numpy.zeros_like(rows)
+    if top > 0:
+        above[0] = image_rows[top - 1]
+    above[1:] = rows[:-1]
+    left = numpy.zeros_like(rows)
+    left[:, 4:] = rows[:, :-4]
+    above_left = numpy.zeros_like(rows)
+    above_left[:, 4:] = above[:, :-4]
+
+    # Paeth predicts with whichever neighbour is closest to left + above - above left
+    left_distance = numpy.abs(above - above_left)
+    above_distance = numpy.abs(left - above_left)
+    above_left_distance = numpy.abs(left + above - 2 * above_left)
+    paeth = numpy.where((left_distance <= above_distance) &
+                        (left_distance <= above_left_distance), left,
+                        numpy.where(above_distance <= above_left_distance, above, above_left))
+
+    candidates = numpy.stack((rows, rows - left, rows - above,
+                              rows - ((left + above) >> 1), rows - paeth)).astype(numpy.uint8)
+    # the usual heuristic, favour the filter with the smallest sum of signed differences
+    row_scores = numpy.abs(candidates.view(numpy.int8).astype(numpy.int32)).sum(axis=2)
+    row_filters = numpy.argmin(row_scores, axis=0)
+
+    filtered_rows = numpy.empty((bottom - top, row_length + 1), dtype=numpy.uint8)
+    filtered_rows[:, 0] = row_filters
+    filtered_rows[:, 1:] = candidates[row_filters, numpy.arange(bottom - top)]
+    return filtered_rows.tobytes()
+
+
+def _get_zlib_header(compression_level: int) -> bytes:
+    compression_method = 0x78  # deflate with a 32K window
+    if compression_level < 2:
+        level_flag = 0
+    elif compression_level < 6:
+        level_flag = 1
+    elif compression_level == 6:
+        level_flag = 2
+    else:
+        level_flag = 3
+    flags = level_flag << 6
+    flags += 31 - ((compression_method << 8) + flags) % 31
+    return bytes((compression_method, flags))
+
+
+def _combine_adler32(adler_1: int, adler_2: int, length_2: int) -> int:
+    # the same sum as zlib's adler32_combine, which Python doesn't expose
+    remainder = length_2 % ADLER_BASE
+    sum_1 = adler_1 & 0xffff
+    sum_2 = (remainder * sum_1) % ADLER_BASE
+    sum_1 = (sum_1 + (adler_2 & 0xffff) + ADLER_BASE - 1) % ADLER_BASE
+    sum_2 = (sum_2 + (adler_1 >> 16) + (adler_2 >> 16) + ADLER_BASE - remainder) % ADLER_BASE
+    return (sum_2 << 16) | sum_1
+
+
+def _write_chunk(png_file, chunk_type: bytes, data: bytes):
+    png_file.write(struct.pack('>I', len(data)))
+    png_file.write(chunk_type)
+    png_file.write(data)
+    png_file.write(struct.pack('>I', zlib.crc32(data, zlib.crc32(chunk_type))))
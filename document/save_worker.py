@@ -0,0 +1,91 @@
+import threading
+
+from pathlib import Path
+
+import pygame
+
+from document.png_writer import write_png
+from document.tile_grid import TileSnapshot
+from document.tiled_document import (is_tiled_document_path, write_tiled_document,
+                                     update_tiled_document, sync_file, replace_file)
+from ui.event_types import UI_PAINT_SAVE_FINISHED
+
+
+class SaveWorker(threading.Thread):
+    """
+    Saves a snapshot of a canvas image on a background thread so the main loop keeps running.
+    Once finished, successfully or not, a UI_PAINT_SAVE_FINISHED event is posted carrying the
+    worker, the canvas window it was saving, the path and an error message or None.
+
+    Saves are atomic, a whole file is written next to the destination, synced to disk and then
+    moved over it, while a tiled document update only appends to the existing document. If an
+    update fails, the document should be saved again in full. The thread is not a daemon, so
+    quitting part way through a save waits for it to finish.
+
+    :param snapshot: A snapshot of the canvas to save, which the worker finishes copying.
+    :param path: The path to save to, the file format comes from its extension.
+    :param canvas_window: The canvas window being saved.
+    :param saved_tiles: The dirty tiles of the canvas the save covers, by dirty channel, kept
+                        so they can be marked as dirty again if the save fails.
+    :param png_compression_level: The zlib compression level to save PNG files at.
+    :param changed_tiles: When updating the tiled document at the path, the tiles changed
+                          since it was written, which are all the snapshot needs to copy.
+    """
+    def __init__(self, snapshot: TileSnapshot, path: Path, canvas_window,
+                 saved_tiles, png_compression_level: int = 6, changed_tiles=None):
+        super().__init__()
+        self.snapshot = snapshot
+        self.path = path
+        self.canvas_window = canvas_window
+        self.saved_tiles = saved_tiles
+        self.png_compression_level = png_compression_level
+        self.changed_tiles = changed_tiles
+        self.tile_size = canvas_window.canvas_ui.tiles.tile_size
+
+        self.progress = 0.0
+
+    def run(self):
+        # anything unexpected still ends the save as a failure, before the thread reports it
+        error = 'The save stopped unexpectedly'
+        try:
+            self._save()
+            error = None
+        except (pygame.error, OSError, ValueError) as save_error:
+            error = str(save_error)
+        finally:
+            self.progress = 1.0
+            pygame.event.post(pygame.event.Event(UI_PAINT_SAVE_FINISHED,
+                                                 {'save_worker': self,
+                                                  'canvas_window': self.canvas_window,
+                                                  'path': self.path,
+                                                  'error': error}))
+
+    def _save(self):
+        image = self.snapshot.copy_all_tiles()
+        if self.changed_tiles is not None:
+            changed_tile_images = {tile: image.subsurface(self.snapshot.grid.get_tile_rect(tile))
+                                   for tile in self.changed_tiles}
+            update_tiled_document(self.path, changed_tile_images,
+                                  progress_callback=self._set_progress)
+            return
+
+        # keeps the extension, as pygame picks the file format from it
+        temporary_path = self.path.with_name('.' + self.path.stem + '.saving' + self.path.suffix)
+        try:
+            if is_tiled_document_path(self.path):
+                write_tiled_document(image, temporary_path, self.tile_size,
+                                     progress_callback=self._set_progress)
+            elif self.path.suffix.lower() == '.png':
+                write_png(image, temporary_path, self.png_compression_level,
+                          progress_callback=self._set_progress)
+            else:
+                pygame.image.save(image, str(temporary_path))
+                sync_file(temporary_path)
+            replace_file(temporary_path, self.path)
+        except (pygame.error, OSError):
+            if temporary_path.exists():
+                temporary_path.unlink()
+            raise
+
+    def _set_progress(self, progress: float):
+        self.progress = progress
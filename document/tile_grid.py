@@ -0,0 +1,226 @@
+import threading
+
+from typing import Dict, List, Optional, Set, Tuple
+
+import pygame
+
+# Only used to allocate large surfaces quickly, when it is available.
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# the masks of 32 bit pixels laid out in memory as 'BGRA' bytes
+BGRA_MASKS = pygame.image.frombuffer(bytes(4), (1, 1), 'BGRA').get_masks()
+
+
+def create_blank_surface(size: Tuple[int, int],
+                         surface_format: pygame.Surface) -> pygame.Surface:
+    """
+    Make a transparent surface with the same pixel format as another, without holding up
+    other threads for long.
+
+    :param size: The size of the new surface.
+    :param surface_format: A surface with the pixel format to use.
+    """
+    # SDL clears new surfaces while holding the GIL, which stalls the main thread for
+    # canvas sized ones, so where possible the pixels are a cleared numpy array instead.
+    if numpy is not None and surface_format.get_masks() == BGRA_MASKS:
+        pixels = numpy.zeros((size[1], size[0], 4), dtype=numpy.uint8)
+        return pygame.image.frombuffer(pixels, size, 'BGRA')
+    return pygame.Surface(size, surface_format.get_flags(), surface_format)
+
+
+class TileGrid:
+    """
+    Splits a canvas up into fixed size square tiles and keeps track of which of them have
+    been modified. Every part of the app that needs to know about modifications (the display,
+    saving and so on) registers its own dirty channel so each can be cleared independently.
+    """
+    def __init__(self, size: Tuple[int, int], tile_size: int = 256):
+        self.size = size
+        self.tile_size = tile_size
+        self.rect = pygame.Rect((0, 0), size)
+
+        self.columns = max(1, -(-size[0] // tile_size))
+        self.rows = max(1, -(-size[1] // tile_size))
+
+        self._dirty_channels: Dict[str, Set[Tuple[int, int]]] = {}
+
+    def get_tile_rect(self, tile: Tuple[int, int]) -> pygame.Rect:
+        tile_rect = pygame.Rect(tile[0] * self.tile_size, tile[1] * self.tile_size,
+                                self.tile_size, self.tile_size)
+        return tile_rect.clip(self.rect)
+
+    def get_tiles_in_rect(self, rect: pygame.Rect) -> List[Tuple[int, int]]:
+        area = self.rect.clip(rect)
+        if area.width == 0 or area.height == 0:
+            return []
+        first_column = area.left // self.tile_size
+        last_column = (area.right - 1) // self.tile_size
+        first_row = area.top // self.tile_size
+        last_row = (area.bottom - 1) // self.tile_size
+        return [(column, row)
+                for row in range(first_row, last_row + 1)
+                for column in range(first_column, last_column + 1)]
+
+    def get_tiles_bounding_rect(self, tiles) -> Optional[pygame.Rect]:
+        tile_rects = [self.get_tile_rect(tile) for tile in tiles]
+        if not tile_rects:
+            return None
+        return tile_rects[0].unionall(tile_rects[1:])
+
+    def add_dirty_channel(self, channel: str):
+        self._dirty_channels.setdefault(channel, set())
+
+    def mark_dirty(self, rect: pygame.Rect, channel: Optional[str] = None):
+        """
+        :param rect: The modified area of the canvas.
+        :param channel: The only dirty channel to mark, or None to mark all of them.
+        """
+        tiles = self.get_tiles_in_rect(rect)
+        if channel is not None:
+            self._dirty_channels[channel].update(tiles)
+            return
+        for dirty_tiles in self._dirty_channels.values():
+            dirty_tiles.update(tiles)
+
+    def mark_all_dirty(self):
+        self.mark_dirty(self.rect)
+
+    def get_dirty_tiles(self, channel: str) -> Set[Tuple[int, int]]:
+        return self._dirty_channels[channel]
+
+    def take_dirty_tiles(self, channel: str) -> Set[Tuple[int, int]]:
+        """
+        Get the dirty tiles for a channel and clear the channel ready for new modifications.
+
+        :param channel: The name of the dirty channel.
+        """
+        dirty_tiles = self._dirty_channels[channel]
+        self._dirty_channels[channel] = set()
+        return dirty_tiles
+
+    def clear_dirty(self, channel: str):
+        self._dirty_channels[channel] = set()
+
+
+class TileBuffer:
+    """
+    A sparse set of tile surfaces covering a canvas, each one is only allocated the first time
+    it is needed. Used for per stroke scratch data so that the cost of a stroke depends on the
+    area it covers rather than the size of the canvas.
+    """
+    def __init__(self, grid: TileGrid, fill_colour: Optional[pygame.Color] = None):
+        self.grid = grid
+        self.fill_colour = fill_colour
+
+        self.tiles: Dict[Tuple[int, int], pygame.Surface] = {}
+
+    def get_tile(self, tile: Tuple[int, int]) -> pygame.Surface:
+        if tile not in self.tiles:
+            tile_surface = pygame.Surface(self.grid.get_tile_rect(tile).size,
+                                          flags=pygame.SRCALPHA, depth=32)
+            if self.fill_colour is not None:
+                tile_surface.fill(self.fill_colour)
+            self.tiles[tile] = tile_surface
+        return self.tiles[tile]
+
+    def store_from(self, surface: pygame.Surface, rect: pygame.Rect):
+        """
+        Copy the tiles under a rectangle from a canvas sized surface, tiles that have already
+        been stored are left alone so they keep their original pixels.
+
+        :param surface: The canvas sized surface to copy from.
+        :param rect: The area of the canvas that needs to be stored.
+        """
+        for tile in self.grid.get_tiles_in_rect(rect):
+            if tile not in self.tiles:
+                self.get_tile(tile).blit(surface, (0, 0), self.grid.get_tile_rect(tile))
+
+    def stamp(self, image: pygame.Surface, rect: pygame.Rect):
+        for tile in self.grid.get_tiles_in_rect(rect):
+            tile_rect = self.grid.get_tile_rect(tile)
+            self.get_tile(tile).blit(image, (rect.left - tile_rect.left,
+                                             rect.top - tile_rect.top))
+
+    def draw_area(self, destination: pygame.Surface, area: pygame.Rect,
+                  position: Optional[Tuple[int, int]] = None,
+                  fallback: Optional[pygame.Surface] = None):
+        """
+        Blit the stored pixels covering an area of the canvas onto another surface.
+
+        :param destination: The surface to draw on to.
+        :param area: The area of the canvas to draw.
+        :param position: Where to draw the area on the destination, defaults to the area's
+                         own position.
+        :param fallback: A canvas sized surface to take pixels from for tiles that aren't
+                         stored. If None those tiles are skipped.
+        """
+        if position is None:
+            position = area.topleft
+        for tile in self.grid.get_tiles_in_rect(area):
+            tile_rect = self.grid.get_tile_rect(tile)
+            part = tile_rect.clip(area)
+            part_position = (position[0] + part.left - area.left,
+                             position[1] + part.top - area.top)
+            if tile in self.tiles:
+                destination.blit(self.tiles[tile], part_position,
+                                 part.move(-tile_rect.left, -tile_rect.top))
+            elif fallback is not None:
+                destination.blit(fallback, part_position, part)
+
+
+class TileSnapshot:
+    """
+    A copy of a canvas as it was at one moment, made a tile at a time so that the copying can
+    be left to a background thread. Nothing is copied when the snapshot is taken, the canvas
+    copies any tiles it is about to change first and the background thread copies the rest.
+
+    :param grid: The tile grid of the canvas.
+    :param surface: The canvas sized surface to copy.
+    :param tiles: The tiles to copy, or None to copy all of them.
+    """
+    def __init__(self, grid: TileGrid, surface: pygame.Surface,
+                 tiles: Optional[Set[Tuple[int, int]]] = None):
+        self.grid = grid
+        self.surface = surface
+
+        self._copy: Optional[pygame.Surface] = None
+        self._uncopied_tiles = set(grid.get_tiles_in_rect(grid.rect) if tiles is None else tiles)
+        self._lock = threading.Lock()
+
+    def is_complete(self) -> bool:
+        return not self._uncopied_tiles
+
+    def copy_tiles_in_rect(self, rect: pygame.Rect):
+        """
+        Copy the tiles under a rectangle that aren't copied yet, before they are changed.
+
+        :param rect: The area of the canvas about to change.
+        """
+        with self._lock:
+            for tile in self.grid.get_tiles_in_rect(rect):
+                if tile in self._uncopied_tiles:
+                    self._copy_tile(tile)
+
+    def copy_all_tiles(self) -> pygame.Surface:
+        """
+        Copy the rest of the tiles, a tile at a time so the main thread can keep running in
+        between. Meant to be called from a background thread.
+
+        :return: The finished copy, a canvas sized surface that only has the pixels of the
+                 tiles the snapshot was asked for.
+        """
+        while True:
+            with self._lock:
+                if not self._uncopied_tiles:
+                    return self._copy
+                self._copy_tile(next(iter(self._uncopied_tiles)))
+
+    def _copy_tile(self, tile: Tuple[int, int]):
+        if self._copy is None:
+            self._copy = create_blank_surface(self.surface.get_size(), self.surface)
+        tile_rect = self.grid.get_tile_rect(tile)
+        self._copy.blit(self.surface, tile_rect, tile_rect)
+        self._uncopied_tiles.discard(tile)
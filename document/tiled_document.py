@@ -0,0 +1,303 @@
+import mmap
+import os
+import struct
+import zlib
+
+from pathlib import Path
+from typing import Callable, Optional, Tuple
+
+import pygame
+
+from document.tile_grid import TileGrid
+
+# Only used to allocate the canvas of a document without clearing it up front.
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# A tiled document is a header, followed by the canvas stored as raw RGBA tiles and then an
+# index of where each tile is in the file. The header points at the index rather than the
+# index having a fixed position, so that a document can be updated by appending new tiles
+# and a new index and then switching the header over to them. Until that last small write
+# the header still points at the old index and tiles, which are left untouched, so the
+# update is atomic.
+TILED_DOCUMENT_EXTENSION = '.ppaint'
+TILED_DOCUMENT_MAGIC = b'PPAINTTD'
+TILED_DOCUMENT_VERSION = 1
+HEADER_FORMAT = '<8sHHIIQ'
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+INDEX_OFFSET_POSITION = HEADER_SIZE - 8
+INDEX_ENTRY_FORMAT = '<HHQ'
+INDEX_ENTRY_SIZE = struct.calcsize(INDEX_ENTRY_FORMAT)
+# once appended updates would make a document this many times the size of its pixels it is
+# rewritten from scratch instead
+MAX_UPDATED_SIZE_RATIO = 2
+
+
+def is_tiled_document_path(path: Path) -> bool:
+    return path.suffix.lower() == TILED_DOCUMENT_EXTENSION
+
+
+def write_tiled_document(surface: pygame.Surface, path: Path, tile_size: int = 256,
+                         progress_callback: Optional[Callable[[float], None]] = None):
+    """
+    Save a surface as a tiled document.
+
+    :param surface: The surface to save, nothing else should use it while it is saving.
+    :param path: The path of the file to write.
+    :param tile_size: The width and height of the tiles.
+    :param progress_callback: Optionally, called with the fraction of tiles written so far.
+    """
+    grid = TileGrid(surface.get_size(), tile_size)
+    tiles = grid.get_tiles_in_rect(grid.rect)
+    with open(path, 'wb') as document_file:
+        document_file.write(_pack_header(grid, 0))
+        tile_offsets = {}
+        for tile_index, tile in enumerate(tiles):
+            tile_offsets[tile] = document_file.tell()
+            document_file.write(pygame.image.tobytes(surface.subsurface(grid.get_tile_rect(tile)),
+                                                     'RGBA'))
+            if progress_callback is not None:
+                progress_callback((tile_index + 1) / len(tiles))
+        index_offset = document_file.tell()
+        document_file.write(pack_index(tile_offsets))
+        document_file.seek(0)
+        document_file.write(_pack_header(grid, index_offset))
+        document_file.flush()
+        os.fsync(document_file.fileno())
+
+
+def sync_file(path: Path):
+    """
+    Flush a file written by something that does not sync it itself, like pygame, to disk.
+
+    :param path: The path of the file to sync.
+    """
+    with open(path, 'r+b') as written_file:
+        os.fsync(written_file.fileno())
+
+
+def replace_file(temporary_path: Path, path: Path):
+    """
+    Move a file that has been written and synced in full over another one, then sync the
+    directory so the move itself survives a crash. Windows can't open a directory to sync it,
+    but there the move is written through anyway.
+
+    :param temporary_path: The new file, in the same directory as the path.
+    :param path: The path to move it to.
+    """
+    os.replace(temporary_path, path)
+    if os.name != 'nt':
+        directory = os.open(path.parent, os.O_RDONLY)
+        try:
+            os.fsync(directory)
+        finally:
+            os.close(directory)
+
+
+class TiledDocumentReader:
+    """
+    An open tiled document, that reads tiles on to a canvas image as they are needed rather
+    than all at once, so opening a document takes the same time whatever its size. The file
+    stays memory mapped until every tile has been read, or the reader is closed.
+
+    :param path: The path of the file to read.
+    """
+    def __init__(self, path: Path):
+        with open(path, 'rb') as document_file:
+            # the mapping keeps its own handle on the file
+            self._mapped_file = mmap.mmap(document_file.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            self.grid, index_offset = _unpack_header(self._mapped_file)
+            self._tile_offsets = unpack_index(self._mapped_file, index_offset)
+            # checked up front so that reading a tile later on can't fail
+            for tile in self.grid.get_tiles_in_rect(self.grid.rect):
+                if tile not in self._tile_offsets:
+                    raise ValueError('Tiled document is missing a tile')
+                if self._tile_offsets[tile] + self._get_tile_length(tile) > len(self._mapped_file):
+                    raise ValueError('Tiled document is truncated')
+        except ValueError:
+            self._mapped_file.close()
+            raise
+        self._unread_tiles = set(self.grid.get_tiles_in_rect(self.grid.rect))
+
+    def create_image(self) -> pygame.Surface:
+        """
+        :return: A fully transparent canvas image the size of the document, to read the tiles
+                 on to.
+        """
+        if numpy is not None:
+            # The memory of a cleared array is only set aside as it is first used, where SDL
+            # clears the whole of a new surface straight away.
+            pixels = numpy.zeros((self.grid.size[1], self.grid.size[0], 4), dtype=numpy.uint8)
+            return pygame.image.frombuffer(pixels, self.grid.size, 'BGRA')
+        return pygame.Surface(self.grid.size, flags=pygame.SRCALPHA, depth=32)
+
+    def read_tiles(self, image: pygame.Surface, rect: pygame.Rect) -> Optional[pygame.Rect]:
+        """
+        Copy any tiles under an area that haven't been read yet on to the canvas image.
+
+        :param image: The canvas image from create_image().
+        :param rect: The area of the canvas that is needed.
+
+        :return: The area covered by the tiles that were read, or None if there weren't any.
+        """
+        tiles = [tile for tile in self.grid.get_tiles_in_rect(rect) if tile in self._unread_tiles]
+        if not tiles:
+            return None
+        mapped_view = memoryview(self._mapped_file)
+        try:
+            for tile in tiles:
+                tile_offset = self._tile_offsets[tile]
+                tile_view = mapped_view[tile_offset:tile_offset + self._get_tile_length(tile)]
+                tile_rect = self.grid.get_tile_rect(tile)
+                # drawing on a fully transparent surface copies the pixels exactly
+                image.blit(pygame.image.frombuffer(tile_view, tile_rect.size, 'RGBA'),
+                           tile_rect)
+                tile_view.release()
+                self._unread_tiles.discard(tile)
+        finally:
+            mapped_view.release()
+        return self.grid.get_tiles_bounding_rect(tiles)
+
+    def is_finished(self) -> bool:
+        return not self._unread_tiles
+
+    def close(self):
+        self._mapped_file.close()
+
+    def _get_tile_length(self, tile: Tuple[int, int]) -> int:
+        tile_rect = self.grid.get_tile_rect(tile)
+        return tile_rect.width * tile_rect.height * 4
+
+
+def read_tiled_document(path: Path) -> pygame.Surface:
+    """
+    Load the whole of a tiled document in one go.
+
+    :param path: The path of the file to read.
+
+    :return: The canvas image.
+    """
+    reader = TiledDocumentReader(path)
+    try:
+        image = reader.create_image()
+        reader.read_tiles(image, reader.grid.rect)
+    finally:
+        reader.close()
+    return image
+
+
+def can_update_tiled_document(path: Path, grid: TileGrid, tile_count: int) -> bool:
+    """
+    Check whether a tiled document can be brought up to date by appending changed tiles.
+
+    :param path: The path of the document.
+    :param grid: The tile grid of the canvas, the document must have the same layout.
+    :param tile_count: The number of changed tiles to append.
+    """
+    try:
+        with open(path, 'rb') as document_file:
+            document_grid, index_offset = _unpack_header(document_file.read(HEADER_SIZE))
+            # an update keeps the existing index, so it has to be readable
+            document_file.seek(index_offset)
+            unpack_index(document_file.read(), 0)
+        document_size = os.path.getsize(path)
+    except (OSError, ValueError):
+        return False
+    if document_grid.size != grid.size or document_grid.tile_size != grid.tile_size:
+        return False
+    pixels_size = grid.size[0] * grid.size[1] * 4
+    appended_size = (tile_count * grid.tile_size * grid.tile_size * 4 +
+                     len(grid.get_tiles_in_rect(grid.rect)) * INDEX_ENTRY_SIZE)
+    return document_size + appended_size <= pixels_size * MAX_UPDATED_SIZE_RATIO
+
+
+def update_tiled_document(path: Path, tile_images,
+                          progress_callback: Optional[Callable[[float], None]] = None):
+    """
+    Bring a tiled document up to date by appending just the tiles that have changed, along
+    with a new index, then switching the header over to the new index.
+
+    :param path: The path of the document to update.
+    :param tile_images: A dictionary of tile -> the tile's current pixels.
+    :param progress_callback: Optionally, called with the fraction of tiles written so far.
+    """
+    with open(path, 'r+b') as document_file:
+        grid, index_offset = _unpack_header(document_file.read(HEADER_SIZE))
+        document_file.seek(index_offset)
+        tile_offsets = unpack_index(document_file.read(), 0)
+
+        document_file.seek(0, os.SEEK_END)
+        for tile_index, (tile, tile_image) in enumerate(tile_images.items()):
+            tile_offsets[tile] = document_file.tell()
+            document_file.write(pygame.image.tobytes(tile_image, 'RGBA'))
+            if progress_callback is not None:
+                progress_callback((tile_index + 1) / len(tile_images))
+        index_offset = document_file.tell()
+        document_file.write(pack_index(tile_offsets))
+        document_file.flush()
+        os.fsync(document_file.fileno())
+
+        document_file.seek(INDEX_OFFSET_POSITION)
+        document_file.write(struct.pack('<Q', index_offset))
+        document_file.flush()
+        os.fsync(document_file.fileno())
+
+
+def read_tiled_document_size(path: Path) -> Optional[Tuple[int, int]]:
+    try:
+        with open(path, 'rb') as document_file:
+            grid, _ = _unpack_header(document_file.read(HEADER_SIZE))
+        return grid.size
+    except (OSError, ValueError):
+        return None
+
+
+def pack_index(tile_offsets) -> bytes:
+    """
+    :param tile_offsets: A dictionary of tile -> offset of the tile's pixels in the file.
+
+    :return: The index block, ending with a checksum of the entries.
+    """
+    entries = b''.join(struct.pack(INDEX_ENTRY_FORMAT, tile[0], tile[1], offset)
+                       for tile, offset in tile_offsets.items())
+    return struct.pack('<I', len(tile_offsets)) + entries + struct.pack('<I', zlib.crc32(entries))
+
+
+def unpack_index(buffer, index_offset: int):
+    """
+    :param buffer: The contents of the document file.
+    :param index_offset: The position of the index block in the file.
+
+    :return: A dictionary of tile -> offset of the tile's pixels in the file.
+    """
+    try:
+        tile_count = struct.unpack_from('<I', buffer, index_offset)[0]
+        entries_start = index_offset + 4
+        entries_end = entries_start + tile_count * INDEX_ENTRY_SIZE
+        entries = bytes(buffer[entries_start:entries_end])
+        checksum = struct.unpack_from('<I', buffer, entries_end)[0]
+    except struct.error:
+        raise ValueError('Tiled document index is truncated')
+    if zlib.crc32(entries) != checksum:
+        raise ValueError('Tiled document index is corrupt')
+    return {(column, row): offset
+            for column, row, offset in struct.iter_unpack(INDEX_ENTRY_FORMAT, entries)}
+
+
+def _pack_header(grid: TileGrid, index_offset: int) -> bytes:
+    return struct.pack(HEADER_FORMAT, TILED_DOCUMENT_MAGIC, TILED_DOCUMENT_VERSION,
+                       grid.tile_size, grid.size[0], grid.size[1], index_offset)
+
+
+def _unpack_header(buffer) -> Tuple[TileGrid, int]:
+    try:
+        (magic, version, tile_size,
+         width, height, index_offset) = struct.unpack_from(HEADER_FORMAT, buffer, 0)
+    except struct.error:
+        raise ValueError('Not a tiled document')
+    if magic != TILED_DOCUMENT_MAGIC or version != TILED_DOCUMENT_VERSION or tile_size == 0:
+        raise ValueError('Not a tiled document')
+    return TileGrid((width, height), tile_size), index_offset
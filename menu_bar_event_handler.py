@@ -7,9 +7,12 @@ from pygame_gui.windows import UIFileDialog, UIMessageWindow
 from pygame_gui import UI_BUTTON_START_PRESS, UI_WINDOW_MOVED_TO_FRONT, UI_WINDOW_CLOSE
 from pygame_gui import UI_FILE_DIALOG_PATH_PICKED
 
+from document.save_worker import SaveWorker
+from document.tiled_document import is_tiled_document_path, can_update_tiled_document
+from ui.event_types import UI_PAINT_SAVE_FINISHED, UI_PAINT_PNG_COMPRESSION_CHANGED
 from ui.ui_canvas_window import CanvasWindow
 from ui.ui_new_canvas_dialog import UINewCanvasDialog
-from tools.undo_record import UndoRecord
+from ui.ui_png_options_dialog import UIPNGOptionsDialog
 
 
 class MenuBarEventHandler:
@@ -22,10 +25,13 @@ class MenuBarEventHandler:
 
         self.active_canvas_window: Optional[CanvasWindow] = None
 
+        self.png_compression_level = 6
+
     def process_event(self, event):
         if (event.type == UI_WINDOW_MOVED_TO_FRONT
                 and event.ui_object_id == '#canvas_window'):
             self.active_canvas_window = event.ui_element
+            self.active_canvas_window.canvas_ui.history.focus()
         if (event.type == UI_WINDOW_CLOSE
                 and event.ui_object_id == '#canvas_window'
                 and self.active_canvas_window == event.ui_element):
@@ -53,19 +59,8 @@ class MenuBarEventHandler:
                 and event.ui_object_id == 'menu_bar.#file_menu_items.#save'
                 and self.active_canvas_window is not None
                 and self.active_canvas_window.canvas_ui.save_file_path is not None):
-
-            try:
-                print("Saving to: " + str(self.active_canvas_window.canvas_ui.save_file_path))
-                pygame.image.save(self.active_canvas_window.canvas_ui.get_image(),
-                                  str(self.active_canvas_window.canvas_ui.save_file_path))
-            except pygame.error:
-                message_rect = pygame.Rect(0, 0, 250, 160)
-                message_rect.center = self.window_surface.get_rect().center
-                message_window = UIMessageWindow(rect=message_rect,
-                                                 html_message='Unable to save image.',
-                                                 manager=self.ui_manager,
-                                                 window_title='Saving error')
-                message_window.set_blocking(True)
+            self._start_save(self.active_canvas_window,
+                             self.active_canvas_window.canvas_ui.save_file_path)
 
         if (event.type == UI_BUTTON_START_PRESS
                 and event.ui_object_id == 'menu_bar.#file_menu_items.#save_as'
@@ -84,6 +79,17 @@ class MenuBarEventHandler:
                                        object_id='#save_file_dialog')
             save_dialog.set_blocking(True)
 
+        if (event.type == UI_BUTTON_START_PRESS
+                and event.ui_object_id == 'menu_bar.#file_menu_items.#png_options'):
+            png_options_dialog_rect = pygame.Rect(0, 0, 300, 200)
+            png_options_dialog_rect.center = self.window_surface.get_rect().center
+            UIPNGOptionsDialog(rect=png_options_dialog_rect,
+                               manager=self.ui_manager,
+                               compression_level=self.png_compression_level)
+
+        if event.type == UI_PAINT_PNG_COMPRESSION_CHANGED:
+            self.png_compression_level = event.compression_level
+
         if (event.type == UI_BUTTON_START_PRESS
                 and event.ui_object_id == 'menu_bar.#edit_menu_items.#undo'
                 and self.active_canvas_window is not None):
@@ -97,23 +103,49 @@ class MenuBarEventHandler:
         if (event.type == UI_BUTTON_START_PRESS
                 and event.ui_object_id == 'menu_bar.#view_menu_items.#info'
                 and self.active_canvas_window is not None):
-            info_window_rect = pygame.Rect(0, 0, 400, 250)
+            info_window_rect = pygame.Rect(0, 0, 400, 300)
             info_window_rect.center = self.window_surface.get_rect().center
 
             file_name = self.active_canvas_window.window_display_title
-            pixel_size = (str(self.active_canvas_window.canvas_ui.rect.width) +
-                          ' x ' +
-                          str(self.active_canvas_window.canvas_ui.rect.height) +
-                          ' pixels.')
+            image_width, image_height = self.active_canvas_window.canvas_ui.get_image().get_size()
+            pixel_size = str(image_width) + ' x ' + str(image_height) + ' pixels.'
+            zoom = '{:g}%'.format(self.active_canvas_window.canvas_ui.get_zoom() * 100)
+            if self.active_canvas_window.canvas_ui.has_unsaved_changes():
+                unsaved_changes = 'Yes'
+            else:
+                unsaved_changes = 'No'
+            history = self.active_canvas_window.canvas_ui.history
+            undo_memory = ('{:.1f} MB'.format(history.used_bytes / (1024 * 1024)) +
+                           ' (compressed {:.1f}:1)'.format(history.get_compression_ratio()) +
+                           ', {:.1f} MB on disk'.format(history.spilled_bytes / (1024 * 1024)))
+            all_undo_memory = '{:.1f} of {:.1f} MB'.format(
+                history.store.get_used_bytes() / (1024 * 1024),
+                history.store.byte_budget / (1024 * 1024))
 
             UIMessageWindow(rect=info_window_rect,
                             html_message='<br><b>Image Info</b><br>'
                                          '---------------<br><br>'
                                          '<b>File Name: </b>' + file_name + '<br>'
-                                         '<b>Pixel size: ' + pixel_size + '<br>',
+                                         '<b>Pixel size: ' + pixel_size + '<br>'
+                                         '<b>Zoom: </b>' + zoom + '<br>'
+                                         '<b>Unsaved changes: </b>' + unsaved_changes + '<br>'
+                                         '<b>Undo memory: </b>' + undo_memory + '<br>'
+                                         '<b>All undo memory: </b>' + all_undo_memory + '<br>',
                             manager=self.ui_manager,
                             window_title='Image info')
 
+        if (event.type == UI_BUTTON_START_PRESS
+                and event.ui_object_id == 'menu_bar.#view_menu_items.#zoom_in'):
+            self._try_zoom(1)
+
+        if (event.type == UI_BUTTON_START_PRESS
+                and event.ui_object_id == 'menu_bar.#view_menu_items.#zoom_out'):
+            self._try_zoom(-1)
+
+        if (event.type == UI_BUTTON_START_PRESS
+                and event.ui_object_id == 'menu_bar.#view_menu_items.#actual_size'):
+            self._try_zoom(None)
+
         if (event.type == UI_BUTTON_START_PRESS
                 and event.ui_object_id == 'menu_bar.#help_menu_items.#about'):
             about_window_rect = pygame.Rect(0, 0, 400, 250)
@@ -131,20 +163,34 @@ class MenuBarEventHandler:
                 event.ui_object_id == '#save_file_dialog'):
             path = Path(event.text)
             self.last_used_file_path = path.parent
-            try:
-                print("Saving to: " + str(path))
-                pygame.image.save(self.active_canvas_window.canvas_ui.get_image(),
-                                  str(path))
-                self.active_canvas_window.set_display_title(path.name)
-                self.active_canvas_window.canvas_ui.save_file_path = path
-            except pygame.error:
+            if self.active_canvas_window is not None:
+                self._start_save(self.active_canvas_window, path)
+
+        if event.type == UI_PAINT_SAVE_FINISHED:
+            canvas_window = event.canvas_window
+            canvas_window.finish_save()
+            if event.error is None:
+                canvas_window.set_display_title(event.path.name)
+                canvas_window.canvas_ui.save_file_path = event.path
+                if is_tiled_document_path(event.path):
+                    canvas_window.canvas_ui.tiled_document_path = event.path
+            elif event.save_worker.changed_tiles is not None:
+                # the tiled document couldn't be updated, so it is written again in full, which
+                # shows the error if it fails too
+                canvas_window.canvas_ui.restore_unsaved_tiles(event.save_worker.saved_tiles)
+                canvas_window.canvas_ui.tiled_document_path = None
+                self._start_save(canvas_window, event.path)
+            else:
+                canvas_window.canvas_ui.restore_unsaved_tiles(event.save_worker.saved_tiles)
+                path = event.path
                 message_rect = pygame.Rect(0, 0, 250, 160)
                 message_rect.center = self.window_surface.get_rect().center
                 message_window = UIMessageWindow(rect=message_rect,
                                                  html_message='Unable to save image to path: '
                                                               '<br>' + str(path) + '<br><br>'
                                                               'pygame can only save to .bmp, .png,'
-                                                              '.jpg & .tga. TGA is the default '
+                                                              '.jpg & .tga, or the .ppaint tiled '
+                                                              'format. TGA is the default '
                                                               'format.',
                                                  manager=self.ui_manager,
                                                  window_title='Saving error')
@@ -157,30 +203,75 @@ class MenuBarEventHandler:
             else:
                 self._try_undo()
 
+        if event.type == pygame.KEYDOWN and event.mod & pygame.KMOD_CTRL:
+            if event.key in (pygame.K_EQUALS, pygame.K_PLUS, pygame.K_KP_PLUS):
+                self._try_zoom(1)
+            elif event.key in (pygame.K_MINUS, pygame.K_KP_MINUS):
+                self._try_zoom(-1)
+            elif event.key in (pygame.K_0, pygame.K_KP0):
+                self._try_zoom(None)
+
+    def _start_save(self, canvas_window, path):
+        if canvas_window.save_worker is not None or canvas_window.canvas_ui.loading:
+            return
+        print("Saving to: " + str(path))
+        canvas_ui = canvas_window.canvas_ui
+        # The snapshot is copied by the save worker, apart from any tiles that are about to
+        # change before it gets to them.
+        if not is_tiled_document_path(path):
+            canvas_window.start_save(SaveWorker(canvas_ui.take_snapshot(), path, canvas_window,
+                                                canvas_ui.take_unsaved_tiles(),
+                                                self.png_compression_level))
+            return
+
+        changed_tiles = canvas_ui.tiles.get_dirty_tiles('tiled_document')
+        if (path == canvas_ui.tiled_document_path and
+                can_update_tiled_document(path, canvas_ui.tiles, len(changed_tiles))):
+            # Only the tiles changed since the document was last written need saving. Any of
+            # the document still to be read is read in first, so it isn't mapped while the
+            # update is written to it.
+            changed_tiles = set(changed_tiles)
+            canvas_window.start_save(SaveWorker(canvas_ui.take_snapshot(changed_tiles), path,
+                                                canvas_window,
+                                                canvas_ui.take_unsaved_tiles(('save',
+                                                                              'tiled_document')),
+                                                changed_tiles=changed_tiles))
+        else:
+            canvas_window.start_save(SaveWorker(canvas_ui.take_snapshot(), path, canvas_window,
+                                                canvas_ui.take_unsaved_tiles(('save',
+                                                                              'tiled_document'))))
+
+    def _is_active_canvas_busy(self):
+        # a tool part way through changing the canvas has to finish, or be cancelled, first
+        active_tool = self.active_canvas_window.canvas_ui.active_tool
+        return (active_tool is not None and
+                active_tool.active_canvas is self.active_canvas_window.canvas_ui and
+                active_tool.is_busy())
+
+    def _try_zoom(self, zoom_step: Optional[int]):
+        # a step of None goes back to showing the image at its actual size
+        if self.active_canvas_window is None or self._is_active_canvas_busy():
+            return
+        if zoom_step is None:
+            zoom_level = 0
+        else:
+            zoom_level = self.active_canvas_window.canvas_ui.zoom_level + zoom_step
+        self.active_canvas_window.set_zoom_level(zoom_level)
+
     def _try_undo(self):
         if (self.active_canvas_window is not None
-                and self.active_canvas_window.canvas_ui.undo_stack):
-            undo_record = self.active_canvas_window.canvas_ui.undo_stack.pop()
-
-            redo_surf = pygame.Surface(undo_record.rect.size,
-                                       flags=pygame.SRCALPHA)
-            redo_surf.blit(self.active_canvas_window.canvas_ui.get_image(),
-                           (0, 0), undo_record.rect)
-            redo_record = UndoRecord(redo_surf, undo_record.rect.copy())
-            self.active_canvas_window.canvas_ui.redo_stack.append(redo_record)
-            self.active_canvas_window.canvas_ui.get_image().blit(undo_record.image,
-                                                                 undo_record.rect)
+                and self.active_canvas_window.canvas_ui.history.can_undo()
+                and not self._is_active_canvas_busy()):
+            canvas_ui = self.active_canvas_window.canvas_ui
+            undo_rect = canvas_ui.history.get_last_undo().rect
+            canvas_ui.history.undo(canvas_ui.get_image(undo_rect))
+            canvas_ui.invalidate_rect(undo_rect)
 
     def _try_redo(self):
         if (self.active_canvas_window is not None
-                and self.active_canvas_window.canvas_ui.redo_stack):
-            redo_record = self.active_canvas_window.canvas_ui.redo_stack.pop()
-            undo_surf = pygame.Surface(redo_record.rect.size,
-                                       flags=pygame.SRCALPHA)
-            undo_surf.blit(self.active_canvas_window.canvas_ui.get_image(),
-                           (0, 0), redo_record.rect)
-            undo_record = UndoRecord(undo_surf, redo_record.rect.copy())
-            self.active_canvas_window.canvas_ui.undo_stack.append(undo_record)
-
-            self.active_canvas_window.canvas_ui.get_image().blit(redo_record.image,
-                                                                 redo_record.rect)
+                and self.active_canvas_window.canvas_ui.history.can_redo()
+                and not self._is_active_canvas_busy()):
+            canvas_ui = self.active_canvas_window.canvas_ui
+            redo_rect = canvas_ui.history.get_last_redo().rect
+            canvas_ui.history.redo(canvas_ui.get_image(redo_rect))
+            canvas_ui.invalidate_rect(redo_rect)
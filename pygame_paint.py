@@ -1,21 +1,33 @@
+import argparse
+
 from pathlib import Path
 
 import pygame
 import pygame_gui
 
 from pygame_gui import UIManager
-from pygame_gui.windows import UIMessageWindow
+from pygame_gui.windows import UIMessageWindow, UIConfirmationDialog
 
 from ui.ui_canvas_window import CanvasWindow
 from ui.ui_tool_bar_window import ToolBarWindow
 from ui.ui_menu_bar import UIMenuBar
-from ui.event_types import UI_PAINT_CREATE_NEW_CANVAS
+from ui.dirty_rect_renderer import DirtyRectRenderer
+from ui.frame_pacer import FramePacer
+from ui.event_types import UI_PAINT_CREATE_NEW_CANVAS, UI_PAINT_IMAGE_LOADED
+from document.autosave import Autosaver, AutosaveJournal, JournalLoader
+from document.image_loader import ImageLoader, read_image_size
+from document.tiled_document import is_tiled_document_path
+from tools.history_store import HistoryStore
 
 from menu_bar_event_handler import MenuBarEventHandler
 
 
 class PygamePaintApp:
-    def __init__(self):
+    """
+    :param frame_rate_cap: The highest frame rate while painting or otherwise active, or 0
+                           for no cap. The app drops to a few frames a second when idle.
+    """
+    def __init__(self, frame_rate_cap: int = 60):
         pygame.init()
 
         pygame.display.set_caption("Pygame Paint")
@@ -35,7 +47,8 @@ class PygamePaintApp:
                                             '#new': {'display_name': 'New...'},
                                             '#open': {'display_name': 'Open...'},
                                             '#save': {'display_name': 'Save'},
-                                            '#save_as': {'display_name': 'Save As...'}
+                                            '#save_as': {'display_name': 'Save As...'},
+                                            '#png_options': {'display_name': 'PNG Options...'}
                                         }
                                     },
                      '#edit_menu': {'display_name': 'Edit',
@@ -48,6 +61,9 @@ class PygamePaintApp:
                      '#view_menu': {'display_name': 'View',
                                     'items':
                                         {
+                                            '#zoom_in': {'display_name': 'Zoom in'},
+                                            '#zoom_out': {'display_name': 'Zoom out'},
+                                            '#actual_size': {'display_name': 'Actual size'},
                                             '#info': {'display_name': 'Image info'}
                                         }
                                     },
@@ -67,41 +83,94 @@ class PygamePaintApp:
         self.tool_bar_window = ToolBarWindow(pygame.Rect(0, 25, 200, 695),
                                              manager=self.ui_manager)
 
+        # every canvas's undo history shares one memory budget
+        self.history_store = HistoryStore()
+
+        self.canvas_windows = []
+        self.autosaver = Autosaver()
+        self.recovery_dialogs = {}
+        self._offer_recovery()
+
+        self.renderer = DirtyRectRenderer(self.window_surface, self.window_background,
+                                          self.ui_manager)
+
         self.clock = pygame.time.Clock()
+        self.frame_pacer = FramePacer(self.clock, frame_rate_cap)
         self.running = True
 
     def run(self):
+        active = True
         while self.running:
-            time_delta = self.clock.tick(60) / 1000.0
+            time_delta, events = self.frame_pacer.tick(active)
 
-            for event in pygame.event.get():
+            for event in events:
                 if event.type == pygame.QUIT:
                     self.running = False
 
+                self.renderer.process_event(event)
                 self.menu_bar_event_handler.process_event(event)
 
                 if (event.type == pygame_gui.UI_FILE_DIALOG_PATH_PICKED and
                         event.ui_object_id == '#open_file_dialog'):
                     path = Path(event.text)
                     self.menu_bar_event_handler.last_used_file_path = path.parent
-                    try:
-                        loaded_image = pygame.image.load(str(path)).convert_alpha()
+                    window = self._open_image_window(path, path.name)
+                    window.canvas_ui.set_save_file_path(path)
+
+                if (event.type == pygame_gui.UI_CONFIRMATION_DIALOG_CONFIRMED and
+                        event.ui_element in self.recovery_dialogs):
+                    journal, info = self.recovery_dialogs.pop(event.ui_element)
+                    window = self._open_image_window(journal.change_log_path, info['title'],
+                                                     recovered_journal=journal)
+                    if info['save_file_path'] is not None:
+                        window.canvas_ui.set_save_file_path(Path(info['save_file_path']))
 
-                        canvas_window_rect = pygame.Rect(200, 25,
-                                                         min(loaded_image.get_width() + 52,
-                                                             self.window_surface.get_width() - 200),
-                                                         min(loaded_image.get_height() + 82,
-                                                             self.window_surface.get_height() - 25))
+                if (event.type == pygame_gui.UI_WINDOW_CLOSE and
+                        event.ui_element in self.recovery_dialogs):
+                    # recovery was turned down
+                    journal, _ = self.recovery_dialogs.pop(event.ui_element)
+                    journal.delete()
 
-                        window = CanvasWindow(rect=canvas_window_rect,
-                                              manager=self.ui_manager,
-                                              image_file_name=path.name,
-                                              image=loaded_image)
+                if (event.type == pygame_gui.UI_WINDOW_CLOSE and
+                        event.ui_object_id == '#canvas_window'):
+                    self.autosaver.remove_journal(event.ui_element)
+                    if event.ui_element in self.canvas_windows:
+                        self.canvas_windows.remove(event.ui_element)
 
-                        window.canvas_ui.set_active_tool(self.tool_bar_window.get_active_tool())
-                        window.canvas_ui.set_save_file_path(path)
+                if (event.type == UI_PAINT_IMAGE_LOADED and not event.canvas_window.alive() and
+                        event.tiled_document_reader is not None):
+                    event.tiled_document_reader.close()
 
-                    except pygame.error:
+                if event.type == UI_PAINT_IMAGE_LOADED and event.canvas_window.alive():
+                    if event.image is not None:
+                        if event.tiled_document_reader is not None:
+                            # the canvas of a tiled document is created in the canvas format
+                            loaded_image = event.image
+                        else:
+                            loaded_image = event.image.convert_alpha()
+                        canvas_window = event.canvas_window
+                        placeholder_size = canvas_window.canvas_ui.get_image().get_size()
+                        if loaded_image.get_size() != placeholder_size:
+                            # the image header couldn't be read, so resize to fit the image
+                            old_rect = self._get_canvas_window_rect(placeholder_size)
+                            new_rect = self._get_canvas_window_rect(loaded_image.get_size())
+                            canvas_window.set_dimensions(
+                                (canvas_window.rect.width + new_rect.width - old_rect.width,
+                                 canvas_window.rect.height + new_rect.height - old_rect.height))
+                        canvas_window.finish_loading(loaded_image, event.tiled_document_reader)
+                        if canvas_window.recovered_journal is not None:
+                            # everything recovered is unsaved, and will get a new journal, so
+                            # all of it is read in before the old journal is deleted
+                            canvas_window.canvas_ui.get_image()
+                            canvas_window.canvas_ui.tiles.mark_all_dirty()
+                            canvas_window.recovered_journal.delete()
+                            canvas_window.recovered_journal = None
+                        elif is_tiled_document_path(event.path):
+                            canvas_window.canvas_ui.tiled_document_path = event.path
+                    else:
+                        if event.canvas_window.recovered_journal is not None:
+                            event.canvas_window.recovered_journal.delete()
+                        event.canvas_window.kill()
                         message_rect = pygame.Rect(0, 0, 250, 160)
                         message_rect.center = self.window_surface.get_rect().center
                         message_window = UIMessageWindow(rect=message_rect,
@@ -114,29 +183,82 @@ class PygamePaintApp:
 
                     new_canvas = pygame.Surface(event.size, flags=pygame.SRCALPHA, depth=32)
                     new_canvas.fill(event.colour)
-                    canvas_window_rect = pygame.Rect(200, 25,
-                                                     min(new_canvas.get_width() + 52,
-                                                         self.window_surface.get_width() - 200),
-                                                     min(new_canvas.get_height() + 82,
-                                                         self.window_surface.get_height() - 25))
-                    canvas_window = CanvasWindow(rect=canvas_window_rect,
+                    canvas_window = CanvasWindow(rect=self._get_canvas_window_rect(event.size),
                                                  manager=self.ui_manager,
                                                  image_file_name='untitled.png',
-                                                 image=new_canvas)
+                                                 image=new_canvas,
+                                                 history_store=self.history_store)
 
                     canvas_window.canvas_ui.set_active_tool(self.tool_bar_window.get_active_tool())
+                    self.canvas_windows.append(canvas_window)
 
                 self.ui_manager.process_events(event)
 
+            self.renderer.find_pending_changes()
             self.ui_manager.update(time_delta=time_delta)
+            self.autosaver.update(self.canvas_windows)
+
+            active = (self.renderer.draw() or
+                      self.tool_bar_window.get_active_tool().is_busy())
+
+        self.autosaver.shutdown()
+
+    def _open_image_window(self, path, title, recovered_journal=None):
+        # The window opens straight away with a placeholder the size of the image, the
+        # image itself is decoded, or recovered from a journal, in the background.
+        if recovered_journal is not None:
+            image_size = recovered_journal.read_image_size()
+        else:
+            image_size = read_image_size(path)
+        if image_size is None:
+            image_size = (256, 256)
+        placeholder = pygame.Surface(image_size, flags=pygame.SRCALPHA, depth=32)
+        placeholder.fill(pygame.Color(128, 128, 128))
+
+        window = CanvasWindow(rect=self._get_canvas_window_rect(image_size),
+                              manager=self.ui_manager,
+                              image_file_name=title,
+                              image=placeholder,
+                              history_store=self.history_store)
 
-            self.window_surface.blit(self.window_background, (0, 0))
+        window.canvas_ui.set_active_tool(self.tool_bar_window.get_active_tool())
+        if recovered_journal is not None:
+            window.recovered_journal = recovered_journal
+            window.start_loading(JournalLoader(recovered_journal, window))
+        else:
+            window.start_loading(ImageLoader(path, window))
+        self.canvas_windows.append(window)
+        return window
 
-            self.ui_manager.draw_ui(self.window_surface)
+    def _offer_recovery(self):
+        # journals left over from a previous run mean it didn't close properly
+        for journal in AutosaveJournal.find_journals(self.autosaver.directory):
+            try:
+                info = journal.read_info()
+            except (OSError, ValueError):
+                journal.delete()
+                continue
+            dialog_rect = pygame.Rect(0, 0, 300, 200)
+            dialog_rect.center = self.window_surface.get_rect().center
+            dialog = UIConfirmationDialog(rect=dialog_rect,
+                                          action_long_desc='Pygame Paint did not close '
+                                                           'properly. Recover the unsaved '
+                                                           'changes to ' + info['title'] + '?',
+                                          manager=self.ui_manager,
+                                          window_title='Recover image',
+                                          action_short_name='Recover',
+                                          blocking=False)
+            self.recovery_dialogs[dialog] = (journal, info)
 
-            pygame.display.update()
+    def _get_canvas_window_rect(self, image_size):
+        return pygame.Rect(200, 25,
+                           min(image_size[0] + 52, self.window_surface.get_width() - 200),
+                           min(image_size[1] + 82, self.window_surface.get_height() - 25))
 
 
 if __name__ == "__main__":
-    app = PygamePaintApp()
+    parser = argparse.ArgumentParser(description='Pygame Paint')
+    parser.add_argument('--fps', type=int, default=60,
+                        help='frame rate cap while painting, 0 for no cap')
+    app = PygamePaintApp(frame_rate_cap=parser.parse_args().fps)
     app.run()
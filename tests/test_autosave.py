@@ -0,0 +1,149 @@
+import os
+import random
+import tempfile
+import unittest
+
+from pathlib import Path
+
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+
+import pygame
+
+from document.autosave import AutosaveJournal
+from document.tile_grid import TileGrid, TileSnapshot
+from tests.test_undo_record import create_random_image, make_random_change
+from tools import undo_record
+from tools.history_store import HistoryStore
+from tools.undo_history import UndoHistory
+from tools.undo_record import create_undo_record
+
+
+@unittest.skipUnless(undo_record.numpy is not None, 'replaying changes needs numpy')
+class TestAutosaveJournal(unittest.TestCase):
+    def setUp(self):
+        self.random = random.Random(16)
+        self.temporary_directory = tempfile.TemporaryDirectory()
+        self.directory = Path(self.temporary_directory.name)
+
+        self.canvas = create_random_image(self.random, 90, 70)
+        self.history = UndoHistory(HistoryStore())
+        self.history.take_changes()
+        self.journal = AutosaveJournal(self.directory)
+        self._write_checkpoint(self.journal)
+
+    def tearDown(self):
+        self.history.close()
+        self.journal.delete()
+        self.temporary_directory.cleanup()
+
+    def _write_checkpoint(self, journal):
+        journal.write_checkpoint(TileSnapshot(TileGrid(self.canvas.get_size(), 32),
+                                              self.canvas))
+
+    def _make_change(self):
+        before = self.canvas.copy()
+        rect = make_random_change(self.random, self.canvas)
+        self.history.add_record(create_undo_record(before.subsurface(rect).copy(),
+                                                   self.canvas, rect))
+        return before
+
+    def _refill(self, before):
+        # a fill redone at a new threshold replaces the undo record of the first one
+        rect = self.history.get_last_undo().rect
+        self.canvas.fill(pygame.Color(0, 0, 0, 0), rect)
+        self.canvas.blit(before, rect, rect)
+        make_random_change(self.random, self.canvas.subsurface(rect))
+        self.history.replace_last_undo(create_undo_record(before.subsurface(rect).copy(),
+                                                          self.canvas, rect))
+
+    def _log_changes(self):
+        for change in self.history.take_changes():
+            self.journal.append_change(change)
+
+    def _assert_images_equal(self, image, expected_image):
+        self.assertEqual(pygame.image.tobytes(image, 'RGBA'),
+                         pygame.image.tobytes(expected_image, 'RGBA'))
+
+    def test_replay(self):
+        for _ in range(5):
+            self._make_change()
+        self._log_changes()
+        self._assert_images_equal(self.journal.read_image(), self.canvas)
+        self.assertEqual(self.journal.read_image_size(), self.canvas.get_size())
+
+    def test_replay_undo_redo_refill(self):
+        for _ in range(4):
+            self._make_change()
+        self.history.undo(self.canvas)
+        self.history.undo(self.canvas)
+        self.history.redo(self.canvas)
+        self._log_changes()
+        self._assert_images_equal(self.journal.read_image(), self.canvas)
+
+        before = self._make_change()
+        self._refill(before)
+        self._refill(before)
+        self._log_changes()
+        self._assert_images_equal(self.journal.read_image(), self.canvas)
+
+        # a fill taken off the canvas again without being undone
+        rect = self.history.get_last_undo().rect
+        self.canvas.fill(pygame.Color(0, 0, 0, 0), rect)
+        self.canvas.blit(before, rect, rect)
+        self.history.remove_last_undo()
+        self._log_changes()
+        self._assert_images_equal(self.journal.read_image(), self.canvas)
+
+    def test_replay_from_new_checkpoint(self):
+        self._make_change()
+        self._log_changes()
+        self._write_checkpoint(self.journal)
+        self._make_change()
+        self._log_changes()
+        self._assert_images_equal(self.journal.read_image(), self.canvas)
+        self.assertEqual(len(list(self.directory.glob('*.ppaint'))), 1)
+
+    def test_bad_last_entry(self):
+        for _ in range(3):
+            self._make_change()
+        self._log_changes()
+        image_before_last_change = self.canvas.copy()
+        self._make_change()
+        self._log_changes()
+
+        change_log_data = self.journal.change_log_path.read_bytes()
+        corrupt_data = bytearray(change_log_data)
+        corrupt_data[-1] ^= 1
+        for name, bad_change_log_data in (('truncated', change_log_data[:-1]),
+                                          ('truncated entry header', change_log_data[:-200]),
+                                          ('corrupt', bytes(corrupt_data))):
+            with self.subTest(name=name):
+                self.journal.change_log_path.write_bytes(bad_change_log_data)
+                self._assert_images_equal(self.journal.read_image(),
+                                          image_before_last_change)
+
+    def test_find_journals(self):
+        self.journal.write_info({'title': 'locked', 'save_file_path': None})
+        crashed_journal = AutosaveJournal(self.directory)
+        crashed_journal.write_info({'title': 'crashed', 'save_file_path': None})
+        self._write_checkpoint(crashed_journal)
+        # the files of an app that stopped without deleting them
+        crashed_journal._change_log.close()
+        crashed_journal._lock_file.close()
+        # and files part way through being written
+        (self.directory / 'partial.saving.json').write_text('{}')
+
+        found_journals = AutosaveJournal.find_journals(self.directory)
+        self.assertEqual([journal.journal_id for journal in found_journals],
+                         [crashed_journal.journal_id])
+        self.assertEqual(found_journals[0].read_info()['title'], 'crashed')
+        self._assert_images_equal(found_journals[0].read_image(), self.canvas)
+        # the journal is now locked to this app
+        self.assertEqual(AutosaveJournal.find_journals(self.directory), [])
+
+        found_journals[0].delete()
+        self.assertFalse(list(self.directory.glob(crashed_journal.journal_id + '.*')))
+
+
+if __name__ == '__main__':
+    unittest.main()
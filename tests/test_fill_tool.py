@@ -0,0 +1,70 @@
+import os
+import time
+import unittest
+
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+
+import pygame
+import pygame_gui
+
+from tools import flood_fill
+from tools.fill_tool import FillTool
+from tools.history_store import HistoryStore
+from ui.ui_editable_canvas import EditableCanvas
+
+
+@unittest.skipUnless(flood_fill.is_available(), 'the threshold refill needs numpy')
+class TestFillUndo(unittest.TestCase):
+    def setUp(self):
+        pygame.init()
+        pygame.display.set_mode((400, 300))
+        self.ui_manager = pygame_gui.UIManager((400, 300))
+
+        # a grey ramp, so the size of the fill depends on the threshold
+        image = pygame.Surface((300, 200), flags=pygame.SRCALPHA, depth=32)
+        for x in range(image.get_width()):
+            grey = x * 255 // image.get_width()
+            pygame.draw.line(image, pygame.Color(grey, grey, grey), (x, 0),
+                             (x, image.get_height() - 1))
+        self.original_pixels = pygame.image.tobytes(image, 'RGBA')
+
+        self.canvas = EditableCanvas(pygame.Rect(0, 0, 300, 200), image, self.ui_manager,
+                                     HistoryStore())
+        self.fill_tool = FillTool(pygame.Color(255, 0, 0), 255, 0.1)
+        self.fill_tool.active_canvas = self.canvas
+
+    def tearDown(self):
+        self.canvas.kill()
+        pygame.quit()
+
+    def _finish_fill(self):
+        deadline = time.perf_counter() + 10.0
+        while self.fill_tool.is_busy():
+            self.assertLess(time.perf_counter(), deadline)
+            self.fill_tool.update(0.016, self.canvas.get_image(), self.canvas.rect.topleft,
+                                  self.canvas)
+            time.sleep(0.001)
+
+    def _get_pixels(self):
+        return pygame.image.tobytes(self.canvas.get_image(), 'RGBA')
+
+    def test_undo_after_lowering_threshold(self):
+        click = pygame.event.Event(pygame.MOUSEBUTTONDOWN, button=1, pos=(150, 100))
+        self.assertTrue(self.fill_tool.process_canvas_event(click, self.canvas, (150, 100)))
+        self._finish_fill()
+        first_fill_pixels = self._get_pixels()
+        self.assertNotEqual(first_fill_pixels, self.original_pixels)
+
+        # lowering the threshold shrinks the fill inside the area already filled
+        self.fill_tool.set_option('threshold', 0.01)
+        self._finish_fill()
+        self.assertNotEqual(self._get_pixels(), first_fill_pixels)
+        self.assertEqual(len(self.canvas.history.undo_records), 1)
+
+        undo_record = self.canvas.history.pop_undo()
+        undo_record.swap(self.canvas.get_image())
+        self.assertEqual(self._get_pixels(), self.original_pixels)
+
+
+if __name__ == '__main__':
+    unittest.main()
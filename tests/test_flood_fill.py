@@ -0,0 +1,112 @@
+import os
+import random
+import unittest
+
+from collections import deque
+
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+
+import pygame
+
+from tools import flood_fill
+from tools.fill_tool import FillTool
+
+
+def breadth_first_fill(surface, position, threshold):
+    # the plain pixel by pixel fill that the run based one must match
+    width, height = surface.get_size()
+    start_colour = surface.get_at(position)
+    filled = [[False] * width for _ in range(height)]
+
+    def is_inside(x, y):
+        return FillTool.calc_cheap_distance_between_colours(surface.get_at((x, y)),
+                                                            start_colour) < threshold
+
+    if not is_inside(*position):
+        return filled
+    filled[position[1]][position[0]] = True
+    open_pixels = deque([position])
+    while open_pixels:
+        x, y = open_pixels.popleft()
+        for next_x, next_y in ((x + 1, y), (x - 1, y), (x, y + 1), (x, y - 1)):
+            if (0 <= next_x < width and 0 <= next_y < height and
+                    not filled[next_y][next_x] and is_inside(next_x, next_y)):
+                filled[next_y][next_x] = True
+                open_pixels.append((next_x, next_y))
+    return filled
+
+
+@unittest.skipUnless(flood_fill.is_available(), 'the run based fill needs numpy')
+class TestFloodFill(unittest.TestCase):
+    THRESHOLDS = (0.0, 0.05, 0.3, 1.0)
+
+    def setUp(self):
+        self.random = random.Random(4)
+
+    def _create_random_image(self, width, height):
+        colours = [pygame.Color(self.random.randrange(256), self.random.randrange(256),
+                                self.random.randrange(256))
+                   for _ in range(self.random.randint(1, 4))]
+        image = pygame.Surface((width, height), flags=pygame.SRCALPHA, depth=32)
+        for y in range(height):
+            for x in range(width):
+                # mostly the first colour, so there are big areas to fill around the others
+                if self.random.random() < 0.5:
+                    image.set_at((x, y), self.random.choice(colours))
+                else:
+                    image.set_at((x, y), colours[0])
+        return image
+
+    def _create_random_position(self, image):
+        width, height = image.get_size()
+        if self.random.random() < 0.5:
+            # on the border
+            if self.random.random() < 0.5:
+                return self.random.randrange(width), self.random.choice((0, height - 1))
+            return self.random.choice((0, width - 1)), self.random.randrange(height)
+        return self.random.randrange(width), self.random.randrange(height)
+
+    def _assert_mask_equal(self, mask, expected_filled):
+        self.assertEqual(mask.tolist(), expected_filled)
+
+    def test_matches_breadth_first_fill(self):
+        for _ in range(60):
+            image = self._create_random_image(self.random.randint(1, 40),
+                                              self.random.randint(1, 40))
+            position = self._create_random_position(image)
+            for threshold in self.THRESHOLDS:
+                with self.subTest(size=image.get_size(), position=position,
+                                  threshold=threshold):
+                    self._assert_mask_equal(
+                        flood_fill.calc_fill_mask(image, position, threshold * 195075),
+                        breadth_first_fill(image, position, threshold * 195075))
+
+    def test_single_pixel(self):
+        image = pygame.Surface((1, 1), flags=pygame.SRCALPHA, depth=32)
+        image.fill(pygame.Color(40, 80, 120))
+        self.assertFalse(flood_fill.calc_fill_mask(image, (0, 0), 0).any())
+        self.assertTrue(flood_fill.calc_fill_mask(image, (0, 0), 195075).all())
+
+        fill_map = flood_fill.FillMap(image, (0, 0))
+        self.assertIsNone(fill_map.get_fill_bounds(0))
+        self.assertEqual(fill_map.get_fill_bounds(195075), pygame.Rect(0, 0, 1, 1))
+
+    def test_refills_match_breadth_first_fill(self):
+        # a fill map is refilled at thresholds above, below and between earlier ones
+        for _ in range(30):
+            image = self._create_random_image(self.random.randint(1, 40),
+                                              self.random.randint(1, 40))
+            position = self._create_random_position(image)
+            fill_map = flood_fill.FillMap(image, position)
+            for _ in range(8):
+                threshold = self.random.choice(
+                    self.THRESHOLDS + (self.random.random(), self.random.random()))
+                with self.subTest(size=image.get_size(), position=position,
+                                  threshold=threshold):
+                    self._assert_mask_equal(
+                        fill_map.get_mask(threshold * 195075),
+                        breadth_first_fill(image, position, threshold * 195075))
+
+
+if __name__ == '__main__':
+    unittest.main()
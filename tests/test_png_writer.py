@@ -0,0 +1,135 @@
+import os
+import random
+import tempfile
+import unittest
+import zlib
+
+from pathlib import Path
+
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+
+import pygame
+
+from document import png_writer
+
+
+def unfilter_rows(filtered: bytes, row_length: int, previous_row: bytes) -> bytes:
+    # the PNG decoder's side of the filters, one byte at a time
+    rows = []
+    above = list(previous_row)
+    for row_start in range(0, len(filtered), row_length + 1):
+        row_filter = filtered[row_start]
+        row = []
+        for index, value in enumerate(filtered[row_start + 1:row_start + 1 + row_length]):
+            left = row[index - 4] if index >= 4 else 0
+            above_left = above[index - 4] if index >= 4 else 0
+            if row_filter == 0:
+                prediction = 0
+            elif row_filter == 1:
+                prediction = left
+            elif row_filter == 2:
+                prediction = above[index]
+            elif row_filter == 3:
+                prediction = (left + above[index]) // 2
+            else:
+                estimate = left + above[index] - above_left
+                left_distance = abs(estimate - left)
+                above_distance = abs(estimate - above[index])
+                above_left_distance = abs(estimate - above_left)
+                if left_distance <= above_distance and left_distance <= above_left_distance:
+                    prediction = left
+                elif above_distance <= above_left_distance:
+                    prediction = above[index]
+                else:
+                    prediction = above_left
+            row.append((value + prediction) % 256)
+        rows.append(bytes(row))
+        above = row
+    return b''.join(rows)
+
+
+class TestPNGWriter(unittest.TestCase):
+    SIZES = ((1, 1), (3, 1), (1, 70), (37, 63), (65, 64), (333, 65), (17, 130))
+
+    def setUp(self):
+        self.random = random.Random(12)
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def _create_random_image(self, width, height):
+        image = pygame.Surface((width, height), flags=pygame.SRCALPHA, depth=32)
+        # smooth gradients with noise on top, so every filter gets picked for some rows
+        for y in range(height):
+            for x in range(width):
+                noise = self.random.randrange(8)
+                image.set_at((x, y), pygame.Color((x * 5 + noise) % 256, (y * 3) % 256,
+                                                  (x * y + noise) % 256,
+                                                  self.random.choice((0, 128, 255))))
+        return image
+
+    def test_round_trip(self):
+        for width, height in self.SIZES:
+            image = self._create_random_image(width, height)
+            for compression_level in (0, 1, 6, 9):
+                with self.subTest(size=(width, height), compression_level=compression_level):
+                    path = Path(self.directory.name) / 'image.png'
+                    png_writer.write_png(image, path, compression_level, max_workers=2)
+                    loaded_image = pygame.image.load(str(path))
+                    self.assertEqual(loaded_image.get_size(), (width, height))
+                    self.assertEqual(pygame.image.tobytes(loaded_image, 'RGBA'),
+                                     pygame.image.tobytes(image, 'RGBA'))
+
+    def test_progress(self):
+        progress = []
+        png_writer.write_png(self._create_random_image(5, 200),
+                             Path(self.directory.name) / 'image.png',
+                             progress_callback=progress.append)
+        self.assertEqual(len(progress), 4)
+        self.assertEqual(progress[-1], 1.0)
+
+    def test_filter_rows(self):
+        for width, height in self.SIZES:
+            pixels = pygame.image.tobytes(self._create_random_image(width, height), 'RGBA')
+            row_length = width * 4
+            for top in range(0, height, png_writer.STRIP_HEIGHT):
+                bottom = min(top + png_writer.STRIP_HEIGHT, height)
+                with self.subTest(size=(width, height), top=top):
+                    filtered = png_writer._filter_rows(pixels, row_length, top, bottom)
+                    self.assertEqual(len(filtered), (row_length + 1) * (bottom - top))
+                    previous_row = (pixels[(top - 1) * row_length:top * row_length]
+                                    if top > 0 else bytes(row_length))
+                    self.assertEqual(unfilter_rows(filtered, row_length, previous_row),
+                                     pixels[top * row_length:bottom * row_length])
+
+    def test_filter_rows_without_numpy(self):
+        pixels = pygame.image.tobytes(self._create_random_image(7, 9), 'RGBA')
+        numpy = png_writer.numpy
+        png_writer.numpy = None
+        try:
+            filtered = png_writer._filter_rows(pixels, 28, 2, 9)
+        finally:
+            png_writer.numpy = numpy
+        self.assertEqual(filtered, b''.join(b'\x00' + pixels[row * 28:(row + 1) * 28]
+                                            for row in range(2, 9)))
+
+    def test_zlib_header(self):
+        for compression_level in range(10):
+            with self.subTest(compression_level=compression_level):
+                zlib_header = png_writer._get_zlib_header(compression_level)
+                self.assertEqual(zlib_header, zlib.compress(b'pixels', compression_level)[:2])
+                self.assertEqual(int.from_bytes(zlib_header, 'big') % 31, 0)
+
+    def test_combine_adler32(self):
+        for _ in range(50):
+            data_1 = self.random.randbytes(self.random.choice((0, 1, 100, 70000)))
+            data_2 = self.random.randbytes(self.random.choice((0, 1, 100, 70000)))
+            with self.subTest(length_1=len(data_1), length_2=len(data_2)):
+                self.assertEqual(png_writer._combine_adler32(zlib.adler32(data_1),
+                                                             zlib.adler32(data_2), len(data_2)),
+                                 zlib.adler32(data_1 + data_2))
+
+
+if __name__ == '__main__':
+    unittest.main()
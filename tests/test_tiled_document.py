@@ -0,0 +1,162 @@
+import os
+import random
+import tempfile
+import unittest
+
+from pathlib import Path
+
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+
+import pygame
+
+from document import tiled_document
+from document.tile_grid import TileGrid
+from document.tiled_document import (write_tiled_document, read_tiled_document,
+                                     TiledDocumentReader)
+
+
+class TestTiledDocument(unittest.TestCase):
+    def setUp(self):
+        self.random = random.Random(8)
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = Path(self.directory.name) / 'image.ppaint'
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def _create_random_image(self, width, height):
+        image = pygame.Surface((width, height), flags=pygame.SRCALPHA, depth=32)
+        for y in range(height):
+            for x in range(width):
+                # fully transparent pixels still keep their colour
+                image.set_at((x, y), pygame.Color(self.random.randrange(256),
+                                                  self.random.randrange(256),
+                                                  self.random.randrange(256),
+                                                  self.random.choice((0, 1, 128, 255))))
+        return image
+
+    def _assert_images_equal(self, image, expected_image):
+        self.assertEqual(image.get_size(), expected_image.get_size())
+        self.assertEqual(pygame.image.tobytes(image, 'RGBA'),
+                         pygame.image.tobytes(expected_image, 'RGBA'))
+
+    def test_round_trip(self):
+        for size, tile_size in (((1, 1), 256), ((5, 3), 2), ((40, 33), 16), ((16, 16), 16)):
+            with self.subTest(size=size, tile_size=tile_size):
+                image = self._create_random_image(*size)
+                write_tiled_document(image, self.path, tile_size)
+                self._assert_images_equal(read_tiled_document(self.path), image)
+                self.assertEqual(tiled_document.read_tiled_document_size(self.path), size)
+
+    def test_read_tiles_as_needed(self):
+        image = self._create_random_image(40, 33)
+        write_tiled_document(image, self.path, 16)
+        reader = TiledDocumentReader(self.path)
+        try:
+            read_image = reader.create_image()
+            self.assertEqual(reader.read_tiles(read_image, pygame.Rect(20, 20, 1, 1)),
+                             pygame.Rect(16, 16, 16, 16))
+            self.assertIsNone(reader.read_tiles(read_image, pygame.Rect(17, 17, 10, 10)))
+            self.assertFalse(reader.is_finished())
+            self.assertEqual(read_image.get_at((20, 20)), image.get_at((20, 20)))
+            self.assertEqual(read_image.get_at((0, 0)), pygame.Color(0, 0, 0, 0))
+
+            reader.read_tiles(read_image, reader.grid.rect)
+            self.assertTrue(reader.is_finished())
+            self._assert_images_equal(read_image, image)
+        finally:
+            reader.close()
+
+    def test_progress(self):
+        progress = []
+        write_tiled_document(self._create_random_image(10, 10), self.path, 4,
+                             progress_callback=progress.append)
+        self.assertEqual(len(progress), 9)
+        self.assertEqual(progress[-1], 1.0)
+
+    def test_rejects_bad_documents(self):
+        write_tiled_document(self._create_random_image(40, 33), self.path, 16)
+        document_data = self.path.read_bytes()
+        bad_documents = {'not a document': b'PNG' + document_data[3:],
+                         'empty': b'',
+                         'truncated tiles': document_data[:tiled_document.HEADER_SIZE + 100],
+                         'truncated index': document_data[:-2]}
+        index_entries_start = len(document_data) - 4 - 9 * tiled_document.INDEX_ENTRY_SIZE
+        corrupt_data = bytearray(document_data)
+        corrupt_data[index_entries_start] ^= 1
+        bad_documents['corrupt index'] = bytes(corrupt_data)
+
+        for name, bad_document_data in bad_documents.items():
+            with self.subTest(name=name):
+                self.path.write_bytes(bad_document_data)
+                with self.assertRaises(ValueError):
+                    read_tiled_document(self.path)
+
+    def _update_random_tiles(self, image, grid, tile_count):
+        tiles = self.random.sample(grid.get_tiles_in_rect(grid.rect), tile_count)
+        for tile in tiles:
+            tile_rect = grid.get_tile_rect(tile)
+            image.blit(self._create_random_image(*tile_rect.size), tile_rect)
+        tiled_document.update_tiled_document(
+            self.path, {tile: image.subsurface(grid.get_tile_rect(tile)) for tile in tiles})
+        return tiles
+
+    def test_update(self):
+        image = self._create_random_image(40, 33)
+        write_tiled_document(image, self.path, 16)
+        grid = TileGrid(image.get_size(), 16)
+        for tile_count in (1, 2, 1):
+            with self.subTest(tile_count=tile_count):
+                document_size = self.path.stat().st_size
+                self.assertTrue(tiled_document.can_update_tiled_document(self.path, grid,
+                                                                         tile_count))
+                tiles = self._update_random_tiles(image, grid, tile_count)
+                self._assert_images_equal(read_tiled_document(self.path), image)
+                # only the tiles and a new index are appended
+                tiles_size = sum(grid.get_tile_rect(tile).width * grid.get_tile_rect(tile).height
+                                 for tile in tiles) * 4
+                index_size = 4 + 9 * tiled_document.INDEX_ENTRY_SIZE + 4
+                self.assertEqual(self.path.stat().st_size,
+                                 document_size + tiles_size + index_size)
+
+    def test_update_keeps_old_tiles(self):
+        # until the header is switched over the document still reads as it was
+        image = self._create_random_image(40, 33)
+        old_image = image.copy()
+        write_tiled_document(image, self.path, 16)
+        old_header = self.path.read_bytes()[:tiled_document.HEADER_SIZE]
+        self._update_random_tiles(image, TileGrid(image.get_size(), 16), 4)
+
+        document_data = self.path.read_bytes()
+        self.assertNotEqual(document_data[:tiled_document.HEADER_SIZE], old_header)
+        self.path.write_bytes(old_header + document_data[tiled_document.HEADER_SIZE:])
+        self._assert_images_equal(read_tiled_document(self.path), old_image)
+
+    def test_update_checks_index(self):
+        image = self._create_random_image(40, 33)
+        write_tiled_document(image, self.path, 16)
+        grid = TileGrid(image.get_size(), 16)
+        corrupt_data = bytearray(self.path.read_bytes())
+        corrupt_data[-1] ^= 1
+        self.path.write_bytes(bytes(corrupt_data))
+        self.assertFalse(tiled_document.can_update_tiled_document(self.path, grid, 1))
+        with self.assertRaises(ValueError):
+            tiled_document.update_tiled_document(self.path, {})
+
+    def test_can_update(self):
+        image = self._create_random_image(40, 33)
+        write_tiled_document(image, self.path, 16)
+        grid = TileGrid(image.get_size(), 16)
+        self.assertTrue(tiled_document.can_update_tiled_document(self.path, grid, 1))
+        self.assertFalse(tiled_document.can_update_tiled_document(
+            self.path, TileGrid((41, 33), 16), 1))
+        self.assertFalse(tiled_document.can_update_tiled_document(
+            self.path, TileGrid((40, 33), 8), 1))
+        self.assertFalse(tiled_document.can_update_tiled_document(
+            Path(self.directory.name) / 'missing.ppaint', grid, 1))
+        # documents that would grow too far are written again instead
+        self.assertFalse(tiled_document.can_update_tiled_document(self.path, grid, 9))
+
+
+if __name__ == '__main__':
+    unittest.main()
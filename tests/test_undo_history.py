@@ -0,0 +1,144 @@
+import os
+import random
+import unittest
+
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+
+import pygame
+
+from tests.test_undo_record import create_random_image, make_random_change
+from tools.history_store import HistoryStore
+from tools.undo_history import UndoHistory, SpilledRecord
+from tools.undo_record import create_undo_record
+
+
+class TestUndoHistory(unittest.TestCase):
+    def setUp(self):
+        self.random = random.Random(10)
+
+    def _make_changes(self, history, canvas, change_count):
+        # the canvas as it was before each change, and after the last one
+        images = [canvas.copy()]
+        for _ in range(change_count):
+            before = canvas.copy()
+            rect = make_random_change(self.random, canvas)
+            history.add_record(create_undo_record(before.subsurface(rect).copy(), canvas,
+                                                  rect))
+            images.append(canvas.copy())
+        return images
+
+    def _assert_images_equal(self, image, expected_image):
+        self.assertEqual(pygame.image.tobytes(image, 'RGBA'),
+                         pygame.image.tobytes(expected_image, 'RGBA'))
+
+    def test_undo_redo(self):
+        history = UndoHistory(HistoryStore())
+        canvas = create_random_image(self.random, 80, 70)
+        images = self._make_changes(history, canvas, 10)
+        for image in reversed(images[:-1]):
+            history.undo(canvas)
+            self._assert_images_equal(canvas, image)
+        self.assertFalse(history.can_undo())
+        for image in images[1:]:
+            history.redo(canvas)
+            self._assert_images_equal(canvas, image)
+        self.assertFalse(history.can_redo())
+        history.close()
+
+    def test_spill(self):
+        # a tiny budget moves all but the latest undo record out to the spill file
+        store = HistoryStore(byte_budget=1)
+        history = UndoHistory(store)
+        canvas = create_random_image(self.random, 80, 70)
+        images = self._make_changes(history, canvas, 10)
+        self.assertTrue(all(isinstance(record, SpilledRecord)
+                            for record in list(history.undo_records)[:-1]))
+        self.assertNotIsInstance(history.get_last_undo(), SpilledRecord)
+        self.assertEqual(store.get_used_bytes(), history.get_last_undo().size)
+        self.assertGreater(history.spilled_bytes, 0)
+
+        for image in reversed(images[:-1]):
+            history.undo(canvas)
+            self._assert_images_equal(canvas, image)
+        # redo records are spilled too
+        self.assertTrue(all(isinstance(record, SpilledRecord)
+                            for record in history.redo_records))
+        for image in images[1:]:
+            history.redo(canvas)
+            self._assert_images_equal(canvas, image)
+        self.assertEqual(history.used_bytes + history.spilled_bytes,
+                         sum(record.size for record in history.undo_records))
+        history.close()
+
+    def _assert_spill_file_packed(self, history):
+        # the spilled records and the free gaps between them cover the file exactly
+        spilled_space = sorted((record.offset, record.length)
+                               for record in list(history.undo_records) +
+                               list(history.redo_records)
+                               if isinstance(record, SpilledRecord))
+        position = 0
+        for offset, length in sorted(spilled_space + history._free_spill_space):
+            self.assertEqual(offset, position)
+            position += length
+        self.assertEqual(position, history.spill_file_size)
+
+    def test_spill_file_space_reused(self):
+        history = UndoHistory(HistoryStore(byte_budget=1))
+        canvas = create_random_image(self.random, 80, 70)
+        images = self._make_changes(history, canvas, 10)
+        largest_spill_file_size = history.spill_file_size
+        for _ in range(5):
+            for _ in range(self.random.randint(1, 10)):
+                if history.can_undo():
+                    history.undo(canvas)
+                self._assert_spill_file_packed(history)
+            for _ in range(self.random.randint(1, 10)):
+                if history.can_redo():
+                    history.redo(canvas)
+                self._assert_spill_file_packed(history)
+        while history.can_redo():
+            history.redo(canvas)
+        self._assert_images_equal(canvas, images[-1])
+        # undo and redo only ever move the same records in and out of the file
+        self.assertLessEqual(history.spill_file_size, largest_spill_file_size * 2)
+
+        # once nothing is left in the file it is emptied
+        while history.can_undo():
+            history.undo(canvas)
+        self._make_changes(history, canvas, 1)
+        self.assertEqual(history.spill_file_size, 0)
+        self.assertEqual(history._spill_file.seek(0, 2), 0)
+        history.close()
+
+    def test_spill_least_recently_focused(self):
+        store = HistoryStore()
+        histories = [UndoHistory(store), UndoHistory(store)]
+        canvases = [create_random_image(self.random, 80, 70) for _ in histories]
+        for history, canvas in zip(histories, canvases):
+            self._make_changes(history, canvas, 4)
+        histories[0].focus()
+
+        # the latest undo record of the other history stays in memory
+        store.byte_budget = histories[0].used_bytes + histories[1].get_last_undo().size
+        store.enforce_budget()
+        self.assertEqual(histories[0].spilled_bytes, 0)
+        self.assertGreater(histories[1].spilled_bytes, 0)
+        for history in histories:
+            history.close()
+        self.assertEqual(store.histories, [])
+
+    def test_take_changes(self):
+        history = UndoHistory(HistoryStore())
+        canvas = create_random_image(self.random, 40, 40)
+        self.assertEqual(history.take_changes(), [])
+        self._make_changes(history, canvas, 2)
+        history.undo(canvas)
+        history.redo(canvas)
+        changes = history.take_changes()
+        self.assertEqual(len(changes), 4)
+        self.assertEqual(history.take_changes(), [])
+        history.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
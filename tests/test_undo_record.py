@@ -0,0 +1,118 @@
+import os
+import random
+import unittest
+
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+
+import pygame
+
+from tools import undo_record
+from tools.undo_record import UndoRecord, PixelDiffUndoRecord
+
+
+def create_random_image(random_source, width, height):
+    image = pygame.Surface((width, height), flags=pygame.SRCALPHA, depth=32)
+    for y in range(height):
+        for x in range(width):
+            image.set_at((x, y), pygame.Color(random_source.randrange(256),
+                                              random_source.randrange(256),
+                                              random_source.randrange(256),
+                                              random_source.choice((0, 128, 255))))
+    return image
+
+
+def make_random_change(random_source, surface):
+    width, height = surface.get_size()
+    rect = pygame.Rect(random_source.randrange(width), random_source.randrange(height),
+                       random_source.randint(1, width), random_source.randint(1, height))
+    rect = rect.clip(surface.get_rect())
+    # a few scattered pixels, and sometimes a solid block as well, which can change nothing
+    for _ in range(random_source.randrange(20)):
+        surface.set_at((random_source.randrange(rect.left, rect.right),
+                        random_source.randrange(rect.top, rect.bottom)),
+                       pygame.Color(random_source.randrange(256), 0, 0,
+                                    random_source.choice((0, 255))))
+    if random_source.random() < 0.5:
+        surface.fill(pygame.Color(0, random_source.randrange(256), 0, 255),
+                     rect.inflate(-rect.width // 2, -rect.height // 2))
+    return rect
+
+
+class TestUndoRecord(unittest.TestCase):
+    def setUp(self):
+        self.random = random.Random(9)
+
+    def _assert_images_equal(self, image, expected_image):
+        self.assertEqual(pygame.image.tobytes(image, 'RGBA'),
+                         pygame.image.tobytes(expected_image, 'RGBA'))
+
+    def test_undo_record(self):
+        canvas = create_random_image(self.random, 30, 20)
+        before = canvas.copy()
+        rect = make_random_change(self.random, canvas)
+        after = canvas.copy()
+        record = UndoRecord(before.subsurface(rect).copy(), rect.copy())
+        record.compress(1)
+
+        redo_record = record.swap(canvas)
+        self._assert_images_equal(canvas, before)
+        redo_record.swap(canvas)
+        self._assert_images_equal(canvas, after)
+
+    @unittest.skipUnless(undo_record.numpy is not None, 'pixel diff records need numpy')
+    def test_pixel_diff_undo_record(self):
+        for _ in range(40):
+            # bigger than a block, so some records have more than one
+            canvas = create_random_image(self.random, self.random.randint(1, 150),
+                                         self.random.randint(1, 150))
+            before = canvas.copy()
+            rect = make_random_change(self.random, canvas)
+            after = canvas.copy()
+            record = PixelDiffUndoRecord(before.subsurface(rect).copy(), canvas, rect)
+            for compression_level in (None, 1):
+                with self.subTest(size=canvas.get_size(), rect=rect,
+                                  compression_level=compression_level):
+                    if compression_level is not None:
+                        record.compress(compression_level)
+                    self.assertIs(record.swap(canvas), record)
+                    self._assert_images_equal(canvas, before)
+                    record.swap(canvas)
+                    self._assert_images_equal(canvas, after)
+
+    @unittest.skipUnless(undo_record.numpy is not None, 'pixel diff records need numpy')
+    def test_pixel_diff_records_changed_pixels(self):
+        canvas = pygame.Surface((200, 100), flags=pygame.SRCALPHA, depth=32)
+        canvas.fill(pygame.Color(10, 20, 30, 255))
+        rect = canvas.get_rect()
+        before = canvas.copy()
+        self.assertEqual(PixelDiffUndoRecord(before, canvas, rect).size, 0)
+
+        # only the alpha changes, in one block
+        canvas.set_at((70, 10), pygame.Color(10, 20, 30, 0))
+        record = PixelDiffUndoRecord(before, canvas, rect)
+        block_area = PixelDiffUndoRecord.BLOCK_SIZE * PixelDiffUndoRecord.BLOCK_SIZE
+        self.assertEqual(record.size, block_area // 8 + 4)
+        self.assertLess(record.size, record.raw_size)
+        record.swap(canvas)
+        self._assert_images_equal(canvas, before)
+
+    @unittest.skipUnless(undo_record.numpy is not None, 'pixel diff records need numpy')
+    def test_pixel_diff_after_area(self):
+        canvas = create_random_image(self.random, 40, 40)
+        rect = pygame.Rect(5, 7, 20, 11)
+        before = canvas.subsurface(rect).copy()
+        make_random_change(self.random, canvas.subsurface(rect))
+        after = canvas.copy()
+        # the pixels after the change are taken from a surface that only covers the area
+        after_area_surface = pygame.Surface((30, 20), flags=pygame.SRCALPHA, depth=32)
+        after_area_surface.blit(canvas, (3, 2), rect)
+        record = PixelDiffUndoRecord(before, after_area_surface, rect,
+                                     after_area=pygame.Rect(3, 2, rect.width, rect.height))
+        record.swap(canvas)
+        self._assert_images_equal(canvas.subsurface(rect), before)
+        record.swap(canvas)
+        self._assert_images_equal(canvas, after)
+
+
+if __name__ == '__main__':
+    unittest.main()
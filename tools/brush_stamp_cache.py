@@ -0,0 +1,109 @@
+from collections import OrderedDict
+from typing import Tuple
+
+import pygame
+
+
+def render_brush_stamp(brush_size: int, aa_amount: int,
+                       offset: Tuple[float, float] = (0.0, 0.0)) -> pygame.Surface:
+    """
+    Render a round, antialiased brush stamp. The circle is drawn supersampled and scaled
+    down, which is too slow to do every time a brush option changes.
+
+    The stamp is a white alpha mask, brushes are coloured in when the stroke is composited
+    by multiplying with the brush colour.
+
+    :param brush_size: The diameter of the brush in pixels.
+    :param aa_amount: How many times larger to draw the circle before scaling it down.
+    :param offset: How far to shift the circle from the centre of the stamp, in fractions
+                   of a pixel.
+
+    :return: The stamp, a little larger than the brush to leave room for its soft edge.
+    """
+    padding = 8
+    stamp = pygame.Surface((brush_size + padding, brush_size + padding),
+                           flags=pygame.SRCALPHA,
+                           depth=32)
+
+    aa_brush_size = brush_size * aa_amount
+    aa_padding = padding * aa_amount
+    aa_surface = pygame.Surface((aa_brush_size + aa_padding,
+                                 aa_brush_size + aa_padding),
+                                flags=pygame.SRCALPHA, depth=32)
+    aa_surface.fill(pygame.Color(255, 255, 255, 0))
+    aa_center = (int((aa_brush_size + aa_padding) / 2) + round(offset[0] * aa_amount),
+                 int((aa_brush_size + aa_padding) / 2) + round(offset[1] * aa_amount))
+    pygame.draw.circle(aa_surface,
+                       pygame.Color(255, 255, 255, 85),
+                       aa_center,
+                       int(aa_brush_size / 2) + int(aa_amount * 0.5))
+    pygame.draw.circle(aa_surface,
+                       pygame.Color(255, 255, 255, 175),
+                       aa_center,
+                       int(aa_brush_size / 2))
+    pygame.draw.circle(aa_surface,
+                       pygame.Color(255, 255, 255, 255),
+                       aa_center,
+                       int(aa_brush_size / 2) - int(aa_amount * 0.5))
+    pygame.transform.smoothscale(aa_surface,
+                                 (brush_size + padding, brush_size + padding),
+                                 stamp)
+    return stamp
+
+
+class BrushStampCache:
+    """
+    Keeps rendered brush stamps so that going back to a brush size used recently, or
+    switching back to the brush tool, doesn't render the stamp again. One cache is shared by
+    every brush tool, and the least recently used stamps are dropped once the cache goes
+    over its memory budget.
+
+    Stamps handed out by the cache are shared, so they must not be drawn on.
+
+    :param byte_budget: The most memory, in bytes, the cached stamps may use.
+    """
+    DEFAULT_BYTE_BUDGET = 16 * 1024 * 1024
+
+    def __init__(self, byte_budget: int = DEFAULT_BYTE_BUDGET):
+        self.byte_budget = byte_budget
+        self.used_bytes = 0
+
+        # ordered from the least to the most recently used
+        self._stamps = OrderedDict()
+
+    def get_stamp(self, brush_size: int, aa_amount: int,
+                  offset: Tuple[float, float] = (0.0, 0.0)) -> pygame.Surface:
+        """
+        Get a brush stamp, rendering it if it isn't in the cache.
+
+        :param brush_size: The diameter of the brush in pixels.
+        :param aa_amount: The supersampling used to antialias the brush.
+        :param offset: The sub-pixel offset of the brush within the stamp.
+
+        :return: The stamp.
+        """
+        key = (brush_size, aa_amount, offset)
+        stamp = self._stamps.get(key)
+        if stamp is not None:
+            self._stamps.move_to_end(key)
+            return stamp
+
+        stamp = render_brush_stamp(brush_size, aa_amount, offset)
+        self._stamps[key] = stamp
+        self.used_bytes += self._get_stamp_bytes(stamp)
+        self._enforce_budget()
+        return stamp
+
+    def clear(self):
+        self._stamps.clear()
+        self.used_bytes = 0
+
+    def _enforce_budget(self):
+        # the newest stamp is always kept, however large it is
+        while self.used_bytes > self.byte_budget and len(self._stamps) > 1:
+            _, stamp = self._stamps.popitem(last=False)
+            self.used_bytes -= self._get_stamp_bytes(stamp)
+
+    @staticmethod
+    def _get_stamp_bytes(stamp: pygame.Surface) -> int:
+        return stamp.get_pitch() * stamp.get_height()
@@ -1,34 +1,53 @@
+import math
+
+from typing import Optional
+
 import pygame
 
-from tools.undo_record import UndoRecord
+from document.tile_grid import TileBuffer
+from tools.brush_stamp_cache import BrushStampCache
+from tools.undo_record import create_undo_record
 
 
 class BrushTool:
-
-    def __init__(self, palette_colour, opacity, brush_size):
+    """
+    :param stamp_cache: The cache of brush stamps to share with other brush tools. If None
+                        the tool gets a cache of its own.
+    """
+    def __init__(self, palette_colour, opacity, brush_size, brush_spacing=10,
+                 stamp_cache: Optional[BrushStampCache] = None):
         self.option_data = {'palette_colour': pygame.Color(palette_colour.r,
                                                            palette_colour.g,
                                                            palette_colour.b, 255),
                             'opacity': opacity,
-                            'brush_size': brush_size}
+                            'brush_size': brush_size,
+                            'brush_spacing': brush_spacing}
 
         self.brush_aa_amount = 4
+        # dabs are placed to the nearest 1/subpixel_steps of a pixel
+        self.subpixel_steps = 4
         self.center_position = (0, 0)
         self.start_painting = False
         self.painting = False
         self.painted_area = None
-        self.relative_painted_area = None
-        self.new_rects_to_blit = []
+        self.stamped_area = None
+        self.stamp_rect = None
+        self.distance_to_next_stamp = 0.0
 
-        self.temp_painting_surface = None
-        self.pre_painting_surface = None
-        self.opacity_surface = None
+        # every mouse position reported since the last update, so fast strokes follow the
+        # mouse exactly rather than joining up one position a frame
+        self.motion_positions = []
 
+        self.stroke_tiles = None
+        self.stroke_colour = None
+        self.pre_painting_tiles = None
+
+        self.stamp_cache = stamp_cache if stamp_cache is not None else BrushStampCache()
         self.image = None
 
         self.active_canvas = None
 
-        self._redraw_brush()
+        self._update_stamp()
 
     def process_canvas_event(self, event, canvas, mouse_pos):
         consumed_event = False
@@ -44,207 +63,150 @@ class BrushTool:
 
     def process_event(self, event):
         consumed_event = False
+        if event.type == pygame.MOUSEMOTION and (self.painting or self.start_painting):
+            self.motion_positions.append(event.pos)
+
         if event.type == pygame.MOUSEBUTTONUP and event.button == 1:
             if self.painting:
+                if self.active_canvas is not None:
+                    # finish off the stroke up to where it was let go
+                    self.motion_positions.append(event.pos)
+                    self._paint_stroke(self.active_canvas.get_image(
+                        self.active_canvas.get_visible_canvas_rect()), self.active_canvas)
                 self.painting = False
 
-                if self.active_canvas is not None:
-                    undo_surf = pygame.Surface(self.relative_painted_area.size,
+                if self.active_canvas is not None and self.painted_area is not None:
+                    undo_surf = pygame.Surface(self.painted_area.size,
                                                flags=pygame.SRCALPHA)
-                    undo_surf.blit(self.pre_painting_surface,
-                                   (0, 0), self.relative_painted_area)
-                    self.active_canvas.undo_stack.append(UndoRecord(undo_surf,
-                                                                    self.relative_painted_area))
-                    self.active_canvas.redo_stack.clear()
-                    if len(self.active_canvas.undo_stack) > 25:
-                        self.active_canvas.undo_stack.pop(0)
-
-                self.temp_painting_surface = None
-                self.opacity_surface = None
-                self.pre_painting_surface = None
+                    canvas_surface = self.active_canvas.get_image(self.painted_area)
+                    self.pre_painting_tiles.draw_area(undo_surf, self.painted_area, (0, 0),
+                                                      fallback=canvas_surface)
+                    self.active_canvas.history.add_record(
+                        create_undo_record(undo_surf, canvas_surface, self.painted_area))
+
+                self.stroke_tiles = None
+                self.stroke_colour = None
+                self.pre_painting_tiles = None
                 self.painted_area = None
-                self.relative_painted_area = None
 
         return consumed_event
 
+    def is_busy(self):
+        return self.painting
+
     def update(self, time_delta, canvas_surface, canvas_position, canvas):
         new_position = pygame.mouse.get_pos()
 
         if self.start_painting:
             self.start_painting = False
-            self.center_position = new_position
-            self.pre_painting_surface = canvas_surface.copy()
-
-            self.painted_area = pygame.Rect((0, 0), self.image.get_size())
-            self.painted_area.center = new_position
-
-            self.new_rects_to_blit.append(self.painted_area.copy())
+            self.center_position = canvas.screen_to_canvas(new_position)
+
+            # The stroke is accumulated into tiles that are only allocated once a dab
+            # lands on them, and the original canvas pixels are backed up a tile at a
+            # time just before they are first painted over.
+            self.pre_painting_tiles = TileBuffer(canvas.tiles)
+            # The stroke buffer only collects the coverage of the white brush stamps, the
+            # colour is multiplied in when compositing. A stroke keeps the colour it was
+            # started with.
+            self.stroke_tiles = TileBuffer(canvas.tiles,
+                                           fill_colour=pygame.Color(255, 255, 255, 0))
+            self.stroke_colour = pygame.Color(self.option_data['palette_colour'].r,
+                                              self.option_data['palette_colour'].g,
+                                              self.option_data['palette_colour'].b,
+                                              self.option_data['opacity'])
+            self.painted_area = None
+
+            self._stamp(self.center_position[0], self.center_position[1], canvas)
+            self.distance_to_next_stamp = self._get_stamp_spacing()
+            self.motion_positions = []
             self.painting = True
 
         if self.painting:
-            # use line algorithm to generate series of points between the two
-            # turn the points into rects and store them
-
-            point_set = BrushTool._plot_line(self.center_position, new_position)
-            point_set.add(new_position)
-            if len(point_set) > 0:
-                if self.center_position in point_set:
-                    point_set.remove(self.center_position)
-                for point in point_set:
-                    if canvas.hover_point(point[0], point[1]):
-                        new_rect = pygame.Rect((0, 0), self.image.get_size())
-                        new_rect.center = point
-                        self.new_rects_to_blit.append(new_rect)
-
-                new_painted_area_rect = self.painted_area.unionall(self.new_rects_to_blit)
-            else:
-                new_painted_area_rect = self.painted_area
-
-            new_temp_painting_surface = pygame.Surface(new_painted_area_rect.size,
-                                                       flags=pygame.SRCALPHA,
-                                                       depth=32)
-            new_temp_painting_surface.fill(pygame.Color(self.option_data['palette_colour'].r,
-                                                        self.option_data['palette_colour'].g,
-                                                        self.option_data['palette_colour'].b,
-                                                        0))
-            if self.temp_painting_surface is not None:
-                new_temp_painting_surface.blit(self.temp_painting_surface,
-                                               (self.painted_area.left - new_painted_area_rect.left,
-                                                self.painted_area.top - new_painted_area_rect.top))
-
-            self.painted_area = new_painted_area_rect
-            self.temp_painting_surface = new_temp_painting_surface
-
-            self.opacity_surface = pygame.Surface(self.painted_area.size,
-                                                  flags=pygame.SRCALPHA,
-                                                  depth=32)
-            self.opacity_surface.fill(pygame.Color(255, 255, 255, self.option_data['opacity']))
-
-            for blit_rect in self.new_rects_to_blit:
-                blit_rect.left -= self.painted_area.left
-                blit_rect.top -= self.painted_area.top
-                self.temp_painting_surface.blit(self.image, blit_rect)
-
-            self.new_rects_to_blit = []
-
-            canvas_surface.blit(self.pre_painting_surface, (0, 0))
-            pre_blend = self.temp_painting_surface.copy()
-            pre_blend.blit(self.opacity_surface, (0, 0),
-                           special_flags=pygame.BLEND_RGBA_MULT)
-
-            self.relative_painted_area = self.painted_area.copy()
-            self.relative_painted_area.topleft = (self.painted_area.left - canvas_position[0],
-                                                  self.painted_area.top - canvas_position[1])
-
-            canvas_surface.blit(pre_blend, self.relative_painted_area)
-            canvas.set_image(canvas_surface)
-
-        self.center_position = new_position
+            self.motion_positions.append(new_position)
+            self._paint_stroke(canvas_surface, canvas)
 
     def set_option(self, option_id, value):
         if option_id in self.option_data:
             self.option_data[option_id] = value
-            self._redraw_brush()
-
-    def _redraw_brush(self):
-        padding = 8
-        self.image = pygame.Surface((self.option_data['brush_size']+padding,
-                                     self.option_data['brush_size']+padding),
-                                    flags=pygame.SRCALPHA,
-                                    depth=32)
-
-        aa_brush_size = self.option_data['brush_size'] * self.brush_aa_amount
-        aa_padding = padding * self.brush_aa_amount
-        aa_surface = pygame.Surface((aa_brush_size+aa_padding,
-                                     aa_brush_size+aa_padding),
-                                    flags=pygame.SRCALPHA, depth=32)
-        aa_surface.fill(pygame.Color(self.option_data['palette_colour'].r,
-                                     self.option_data['palette_colour'].g,
-                                     self.option_data['palette_colour'].b, 0))
-        pygame.draw.circle(aa_surface,
-                           pygame.Color(self.option_data['palette_colour'].r,
-                                        self.option_data['palette_colour'].g,
-                                        self.option_data['palette_colour'].b, 85),
-                           (int((aa_brush_size + aa_padding) / 2),
-                            int((aa_brush_size + aa_padding) / 2)),
-                           int(aa_brush_size / 2) + int(self.brush_aa_amount * 0.5))
-        pygame.draw.circle(aa_surface,
-                           pygame.Color(self.option_data['palette_colour'].r,
-                                        self.option_data['palette_colour'].g,
-                                        self.option_data['palette_colour'].b, 175),
-                           (int((aa_brush_size + aa_padding) / 2),
-                            int((aa_brush_size + aa_padding) / 2)),
-                           int(aa_brush_size / 2))
-        pygame.draw.circle(aa_surface,
-                           pygame.Color(self.option_data['palette_colour'].r,
-                                        self.option_data['palette_colour'].g,
-                                        self.option_data['palette_colour'].b, 255),
-                           (int((aa_brush_size + aa_padding) / 2),
-                            int((aa_brush_size + aa_padding) / 2)),
-                           int(aa_brush_size / 2) - int(self.brush_aa_amount * 0.5))
-        pygame.transform.smoothscale(aa_surface,
-                                     (self.option_data['brush_size']+padding,
-                                      self.option_data['brush_size']+padding),
-                                     self.image)
-
-    @staticmethod
-    def _plot_line(point_1, point_2):
-        x0 = point_1[0]
-        x1 = point_2[0]
-        y0 = point_1[1]
-        y1 = point_2[1]
-        if abs(y1 - y0) < abs(x1 - x0):
-            if x0 > x1:
-                plot_points = BrushTool._plot_line_low(x1, y1, x0, y0)
-            else:
-                plot_points = BrushTool._plot_line_low(x0, y0, x1, y1)
+            if option_id == 'brush_size':
+                self._update_stamp()
+
+    def _update_stamp(self):
+        self.image = self.stamp_cache.get_stamp(self.option_data['brush_size'],
+                                                self.brush_aa_amount)
+        self.stamp_rect = self.image.get_rect()
+
+    def _paint_stroke(self, canvas_surface, canvas):
+        # Walk along every mouse position since the last update placing a stamp each time
+        # the stroke has travelled the brush spacing, then composite all of the new stamps
+        # onto the canvas in one go. The stroke is worked out on the canvas image, so the
+        # brush size and spacing don't change with the zoom.
+        spacing = self._get_stamp_spacing()
+        x, y = self.center_position
+        for screen_position in self.motion_positions:
+            position = canvas.screen_to_canvas(screen_position)
+            delta_x = position[0] - x
+            delta_y = position[1] - y
+            distance = math.hypot(delta_x, delta_y)
+            if distance == 0.0:
+                continue
+            travelled = self.distance_to_next_stamp
+            while travelled <= distance:
+                fraction = travelled / distance
+                self._stamp(x + delta_x * fraction, y + delta_y * fraction, canvas)
+                travelled += spacing
+            self.distance_to_next_stamp = travelled - distance
+            x, y = position
+        self.center_position = (x, y)
+        self.motion_positions = []
+
+        if self.stamped_area is not None:
+            changed_rect = self.stamped_area.clip(canvas_surface.get_rect())
+            self.stamped_area = None
+
+            if changed_rect.width > 0 and changed_rect.height > 0:
+                # dabs at the edge of the view can reach past it
+                canvas.get_image(changed_rect)
+                self.pre_painting_tiles.store_from(canvas_surface, changed_rect)
+                self._composite_stroke(canvas_surface, changed_rect)
+                if self.painted_area is None:
+                    self.painted_area = changed_rect
+                else:
+                    self.painted_area = self.painted_area.union(changed_rect)
+                canvas.invalidate_rect(changed_rect)
+
+    def _stamp(self, canvas_x, canvas_y, canvas):
+        screen_x, screen_y = canvas.canvas_to_screen((canvas_x, canvas_y))
+        if not canvas.hover_point(screen_x, screen_y):
+            return
+        # Dabs between pixels use the stamp rendered at the nearest sub-pixel offset,
+        # which keeps slow and diagonal strokes with small brushes smooth.
+        steps = self.subpixel_steps
+        pixel_x, offset_x = divmod(math.floor(canvas_x * steps + 0.5), steps)
+        pixel_y, offset_y = divmod(math.floor(canvas_y * steps + 0.5), steps)
+        stamp = self.image
+        if offset_x != 0 or offset_y != 0:
+            stamp = self.stamp_cache.get_stamp(self.option_data['brush_size'],
+                                               self.brush_aa_amount,
+                                               (offset_x / steps, offset_y / steps))
+
+        # one rect is reused for every stamp so long strokes don't allocate one per dab
+        self.stamp_rect.center = (pixel_x, pixel_y)
+        self.stroke_tiles.stamp(stamp, self.stamp_rect)
+        if self.stamped_area is None:
+            self.stamped_area = self.stamp_rect.copy()
         else:
-            if y0 > y1:
-                plot_points = BrushTool._plot_line_high(x1, y1, x0, y0)
-            else:
-                plot_points = BrushTool._plot_line_high(x0, y0, x1, y1)
-        return plot_points
-
-    @staticmethod
-    def _plot_line_low(x0, y0, x1, y1):
-        dx = x1 - x0
-        dy = y1 - y0
-        yi = 1
-        if dy < 0:
-            yi = -1
-            dy = -dy
-
-        d = 2 * dy - dx
-        y = y0
-
-        plot_points = set()
-        for x in range(x0, x1):
-            plot_points.add((x, y))
-            if d > 0:
-                y = y + yi
-                d = d - 2 * dx
-            d = d + 2 * dy
-
-        return plot_points
-
-    @staticmethod
-    def _plot_line_high(x0, y0, x1, y1):
-        dx = x1 - x0
-        dy = y1 - y0
-        xi = 1
-        if dx < 0:
-            xi = -1
-            dx = -dx
-        d = 2 * dx - dy
-        x = x0
-
-        plot_points = set()
-        for y in range(y0, y1):
-            plot_points.add((x, y))
-            if d > 0:
-                x = x + xi
-                d = d - 2 * dy
-
-            d = d + 2 * dx
-
-        return plot_points
+            self.stamped_area.union_ip(self.stamp_rect)
+
+    def _get_stamp_spacing(self):
+        return max(1.0, self.option_data['brush_size'] *
+                   self.option_data['brush_spacing'] / 100.0)
+
+    def _composite_stroke(self, canvas_surface, area):
+        # rebuild just this area of the canvas from the pixels under the stroke
+        # and the accumulated stroke buffer, coloured in with the stroke colour
+        self.pre_painting_tiles.draw_area(canvas_surface, area)
+        pre_blend = pygame.Surface(area.size, flags=pygame.SRCALPHA, depth=32)
+        self.stroke_tiles.draw_area(pre_blend, area, (0, 0))
+        pre_blend.fill(self.stroke_colour, special_flags=pygame.BLEND_RGBA_MULT)
+        canvas_surface.blit(pre_blend, area)
@@ -1,3 +1,5 @@
+import math
+
 import pygame
 
 from ui.event_types import UI_PAINT_COLOUR_DROPPER_CHANGED
@@ -30,12 +32,16 @@ class DropperTool:
     def process_event(self, event):
         return False
 
+    def is_busy(self):
+        return self.time_to_grab_colour
+
     def update(self, time_delta, canvas_surface, canvas_position, canvas):
 
         if self.time_to_grab_colour:
             self.time_to_grab_colour = False
-            self.start_dropper_position = (self.start_dropper_position[0] - canvas_position[0],
-                                           self.start_dropper_position[1] - canvas_position[1])
+            canvas_point = canvas.screen_to_canvas(self.start_dropper_position)
+            self.start_dropper_position = (math.floor(canvas_point[0]),
+                                           math.floor(canvas_point[1]))
 
             new_colour = canvas_surface.get_at(self.start_dropper_position)
 
@@ -1,6 +1,13 @@
+import math
+import queue
+import time
+
 import pygame
 
-from tools.undo_record import UndoRecord
+from document.tile_grid import TileBuffer
+from tools import flood_fill
+from tools.fill_worker import FillWorker
+from tools.undo_record import create_undo_record
 
 
 class FillTool:
@@ -24,10 +31,20 @@ class FillTool:
 
         self.temp_painting_surface = None
         self.pre_painting_surface = None
+        self.pre_painting_tiles = None
         self.opacity_surface = None
 
         self.pre_painting_surf_blank_int_col = None
 
+        self.fill_map = None
+        self.fill_snapshot = None
+        self.fill_colour = None
+        self.filled_threshold = None
+        self.fill_undo_record = None
+        self.fill_worker = None
+        self.fill_area = None
+        self.band_time_budget = 0.008
+
         self.active_canvas = None
 
         self.clock = pygame.time.Clock()
@@ -38,54 +55,92 @@ class FillTool:
             mouse_x = mouse_pos[0]
             mouse_y = mouse_pos[1]
 
-            if canvas.hover_point(mouse_x, mouse_y) and not self.filling:
+            if (canvas.hover_point(mouse_x, mouse_y) and not self.filling
+                    and self.fill_worker is None):
                 self.start_filling = True
+                self.start_fill_position = mouse_pos
                 consumed_event = True
 
-                undo_surf = canvas.get_image().copy()
-
-                canvas.undo_stack.append(UndoRecord(undo_surf, undo_surf.get_rect()))
-                canvas.redo_stack.clear()
-                if len(canvas.undo_stack) > 25:
-                    canvas.undo_stack.pop(0)
-
         return consumed_event
 
     def process_event(self, event):
-        return False
+        consumed_event = False
+        if (event.type == pygame.KEYDOWN and event.key == pygame.K_ESCAPE
+                and self.fill_worker is not None):
+            self._cancel_fill(self.active_canvas.get_image(), self.active_canvas)
+            consumed_event = True
+        return consumed_event
+
+    def is_busy(self):
+        return self.start_filling or self.filling or self.fill_worker is not None
 
     def update(self, time_delta, canvas_surface, canvas_position, canvas):
         if self.start_filling:
             self.start_filling = False
-            self.start_fill_position = pygame.mouse.get_pos()
-            self.start_fill_position = (self.start_fill_position[0] - canvas_position[0],
-                                        self.start_fill_position[1] - canvas_position[1])
+            # a fill can spread to anywhere on the canvas
+            canvas_surface = canvas.get_image()
+            canvas_point = canvas.screen_to_canvas(self.start_fill_position)
+            self.start_fill_position = (math.floor(canvas_point[0]), math.floor(canvas_point[1]))
             self.start_fill_colour = canvas_surface.get_at(self.start_fill_position)
 
-            self.pre_painting_surface = canvas_surface.copy()
-            self.temp_painting_surface = pygame.Surface(canvas_surface.get_size(),
-                                                        flags=pygame.SRCALPHA,
-                                                        depth=32)
-            self.temp_painting_surface.fill(pygame.Color(self.option_data['palette_colour'].r,
-                                                         self.option_data['palette_colour'].g,
-                                                         self.option_data['palette_colour'].b,
-                                                         0))
-            self.opacity_surface = pygame.Surface(canvas_surface.get_size(),
-                                                  flags=pygame.SRCALPHA,
-                                                  depth=32)
-            self.opacity_surface.fill(pygame.Color(255, 255, 255, self.option_data['opacity']))
-            self.filling_edge_pixels = {self.start_fill_position}
-            self.filling = True
+            if flood_fill.is_available():
+                # Canvas tiles are backed up just before the fill first changes them, so
+                # only the filled area is ever copied for restoring or for undo.
+                self.pre_painting_tiles = TileBuffer(canvas.tiles)
+                self.fill_map = None
+                self.fill_snapshot = None
+                self.filled_threshold = None
+                self.fill_area = None
+                self.fill_undo_record = None
+                # refills keep the colour of the fill they adjust
+                self.fill_colour = pygame.Color(self.option_data['palette_colour'].r,
+                                                self.option_data['palette_colour'].g,
+                                                self.option_data['palette_colour'].b,
+                                                self.option_data['opacity'])
+                self.fill_worker = FillWorker(None, None,
+                                              self.option_data['threshold'] * 195075,
+                                              self.fill_colour,
+                                              canvas_surface=canvas_surface,
+                                              position=self.start_fill_position,
+                                              compression_level=canvas.history.compression_level)
+                self.fill_worker.start()
+            else:
+                self.pre_painting_surface = canvas_surface.copy()
+                self.temp_painting_surface = pygame.Surface(canvas_surface.get_size(),
+                                                            flags=pygame.SRCALPHA,
+                                                            depth=32)
+                self.temp_painting_surface.fill(
+                    pygame.Color(self.option_data['palette_colour'].r,
+                                 self.option_data['palette_colour'].g,
+                                 self.option_data['palette_colour'].b,
+                                 0))
+                self.opacity_surface = pygame.Surface(canvas_surface.get_size(),
+                                                      flags=pygame.SRCALPHA,
+                                                      depth=32)
+                self.opacity_surface.fill(pygame.Color(255, 255, 255,
+                                                       self.option_data['opacity']))
+                self.filling_edge_pixels = {self.start_fill_position}
+                self.filling = True
+
+        if self.fill_worker is not None:
+            self._composite_finished_bands(canvas_surface, canvas)
 
         if self.stop_filling:
             self.stop_filling = False
             self.filling = False
+            # the whole canvas is redrawn with the fill
+            canvas_surface = canvas.get_image()
             canvas_surface.blit(self.pre_painting_surface, (0, 0))
             self.temp_painting_surface.blit(self.opacity_surface, (0, 0),
                                             special_flags=pygame.BLEND_RGBA_MULT)
             canvas_surface.blit(self.temp_painting_surface, (0, 0))
 
-            canvas.set_image(canvas_surface)
+            filled_area = self.temp_painting_surface.get_bounding_rect()
+            if filled_area.width > 0 and filled_area.height > 0:
+                self._push_undo_record(canvas,
+                                       self.pre_painting_surface.subsurface(filled_area).copy(),
+                                       filled_area)
+            canvas.invalidate_rect(filled_area)
             self.temp_painting_surface = None
             self.opacity_surface = None
             self.pre_painting_surface = None
@@ -106,6 +161,99 @@ class FillTool:
         if option_id in self.option_data:
             self.option_data[option_id] = value
 
+            # while a fill worker is running it picks up the new threshold when it finishes
+            if (option_id == 'threshold' and self.fill_worker is None
+                    and self._is_fill_adjustable()):
+                self._refill()
+
+    def _is_fill_adjustable(self):
+        # The last fill can be redone at a new threshold for as long as nothing else has
+        # changed the canvas since, which is when its undo record is still the latest one.
+        return (self.fill_undo_record is not None and
+                self.active_canvas is not None and
+                self.active_canvas.history.get_last_undo() is self.fill_undo_record)
+
+    def _refill(self):
+        self.fill_worker = FillWorker(self.fill_map, self.filled_threshold,
+                                      self.option_data['threshold'] * 195075,
+                                      self.fill_colour,
+                                      snapshot=self.fill_snapshot,
+                                      compression_level=(
+                                          self.active_canvas.history.compression_level))
+        self.fill_worker.start()
+
+    def _push_undo_record(self, canvas, undo_surf, rect):
+        self.fill_undo_record = create_undo_record(undo_surf, canvas.get_image(), rect.copy())
+        canvas.history.add_record(self.fill_undo_record)
+
+    def _store_fill_undo(self, canvas, undo_record):
+        # The worker records the whole fill each time, as a refill can change pixels
+        # without growing the filled area and the record holds the difference from before
+        # the fill.
+        if self.fill_undo_record is None:
+            if undo_record is not None:
+                canvas.history.add_record(undo_record)
+        elif undo_record is None:
+            canvas.history.remove_last_undo()
+        else:
+            canvas.history.replace_last_undo(undo_record)
+        self.fill_undo_record = undo_record
+
+    def _composite_finished_bands(self, canvas_surface, canvas):
+        frame_start_time = time.perf_counter()
+        while time.perf_counter() - frame_start_time < self.band_time_budget:
+            try:
+                finished_band = self.fill_worker.finished_bands.get_nowait()
+            except queue.Empty:
+                return
+
+            if finished_band is None:
+                fill_worker = self.fill_worker
+                if not fill_worker.completed:
+                    self._cancel_fill(canvas_surface, canvas)
+                    return
+                self.fill_worker = None
+                self.fill_map = fill_worker.fill_map
+                self.fill_snapshot = fill_worker.snapshot
+                self.filled_threshold = fill_worker.threshold
+                self._store_fill_undo(canvas, fill_worker.undo_record)
+                if self.option_data['threshold'] * 195075 != self.filled_threshold:
+                    self._refill()
+                return
+
+            band, fill_image = finished_band
+            self._composite_fill(canvas_surface, canvas, band, fill_image)
+
+    def _composite_fill(self, canvas_surface, canvas, area, fill_image):
+        # bands of the fill can be outside of the view
+        canvas.get_image(area)
+        self.pre_painting_tiles.store_from(canvas_surface, area)
+        self.pre_painting_tiles.draw_area(canvas_surface, area)
+        canvas_surface.blit(fill_image, area)
+
+        canvas.invalidate_rect(area)
+        if self.fill_area is None:
+            self.fill_area = area.copy()
+        else:
+            self.fill_area.union_ip(area)
+
+    def _cancel_fill(self, canvas_surface, canvas):
+        self.fill_worker.cancel()
+        self.fill_worker = None
+        self.fill_map = None
+        self.fill_snapshot = None
+
+        if self.fill_area is not None:
+            canvas.get_image(self.fill_area)
+            self.pre_painting_tiles.draw_area(canvas_surface, self.fill_area)
+            canvas.invalidate_rect(self.fill_area)
+            self.fill_area = None
+        if (self.fill_undo_record is not None and
+                canvas.history.get_last_undo() is self.fill_undo_record):
+            canvas.history.remove_last_undo()
+        self.fill_undo_record = None
+        self.pre_painting_tiles = None
+
     def _rect_fill_start(self, canvas_surface, x: int, y: int):
         pixel_array = pygame.PixelArray(self.temp_painting_surface)
         self._fill_colour = self.option_data['palette_colour']
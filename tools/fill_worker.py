@@ -0,0 +1,132 @@
+import queue
+import threading
+
+from typing import Optional, Tuple
+
+import pygame
+
+from document.tile_grid import create_blank_surface
+from tools.flood_fill import FillMap
+from tools.undo_record import PixelDiffUndoRecord
+
+
+class FillWorker(threading.Thread):
+    """
+    Works out a fill on a background thread so the main loop keeps running. Finished
+    horizontal bands of the fill are passed back through a queue as they are ready so they
+    can be shown straight away, followed by None once the worker has stopped. Each band is
+    an image of the fill colour, transparent where the band isn't filled, to blit on to the
+    canvas as it was before the fill.
+
+    Once every band is sent, the worker also makes the compressed undo record of the whole
+    fill, so that none of the full area work happens on the main thread.
+
+    When there is no snapshot of the canvas from an earlier fill, the worker copies the
+    canvas itself. The canvas must not be changed until the worker hands anything back, and
+    the snapshot then belongs to the worker while it is running.
+
+    :param fill_map: The fill map of an earlier fill from the same seed, or None.
+    :param old_threshold: The threshold the fill map was last filled at, or None if
+                          nothing has been filled yet. Only the area that differs between
+                          the two thresholds is sent back.
+    :param threshold: The cheap colour distance threshold to fill at.
+    :param fill_colour: The colour of the fill, with its opacity as the alpha.
+    :param snapshot: The canvas from before the fill, kept from an earlier fill, or None.
+    :param canvas_surface: The canvas to copy a snapshot from, when there isn't one.
+    :param position: The seed position to build a new fill map from.
+    :param compression_level: The zlib compression level for the undo record.
+    """
+    BAND_HEIGHT = 32
+
+    def __init__(self, fill_map: Optional[FillMap],
+                 old_threshold: Optional[float],
+                 threshold: float,
+                 fill_colour: pygame.Color,
+                 snapshot: Optional[pygame.Surface] = None,
+                 canvas_surface: Optional[pygame.Surface] = None,
+                 position: Optional[Tuple[int, int]] = None,
+                 compression_level: int = 1):
+        super().__init__(daemon=True)
+        self.fill_map = fill_map
+        self.old_threshold = old_threshold
+        self.threshold = threshold
+        self.fill_colour = fill_colour
+        self.snapshot = snapshot
+        self.canvas_surface = canvas_surface
+        self.position = position
+        self.compression_level = compression_level
+
+        self.finished_bands = queue.Queue()
+        self.undo_record: Optional[PixelDiffUndoRecord] = None
+        self.completed = False
+        self._cancelled = threading.Event()
+
+    def cancel(self):
+        self._cancelled.set()
+
+    def run(self):
+        try:
+            if self.snapshot is None:
+                self.snapshot = self._copy_canvas()
+                self.canvas_surface = None
+            if self.fill_map is None:
+                self.fill_map = FillMap(self.snapshot, self.position)
+
+            if self._cancelled.is_set():
+                return
+
+            if self.old_threshold is None:
+                area = self.fill_map.get_fill_bounds(self.threshold)
+            else:
+                area = self.fill_map.get_changed_bounds(self.old_threshold, self.threshold)
+
+            if area is not None:
+                for band in self._split_into_bands(area):
+                    if self._cancelled.is_set():
+                        return
+                    self.finished_bands.put((band, self._create_fill_image(band)))
+
+            self.undo_record = self._create_undo_record()
+            self.completed = True
+        finally:
+            self.finished_bands.put(None)
+
+    def _split_into_bands(self, area: pygame.Rect):
+        for band_top in range(area.top, area.bottom, self.BAND_HEIGHT):
+            yield pygame.Rect(area.left, band_top, area.width,
+                              min(self.BAND_HEIGHT, area.bottom - band_top))
+
+    def _copy_canvas(self) -> pygame.Surface:
+        # pygame holds the GIL for the whole of a copy or blit, so large surfaces are worked
+        # on a band at a time to let the main thread keep running in between.
+        snapshot = create_blank_surface(self.canvas_surface.get_size(), self.canvas_surface)
+        for band in self._split_into_bands(snapshot.get_rect()):
+            snapshot.blit(self.canvas_surface, band, band)
+        return snapshot
+
+    def _create_fill_image(self, area: pygame.Rect) -> pygame.Surface:
+        fill_image = pygame.Surface(area.size, flags=pygame.SRCALPHA, depth=32)
+        fill_image.fill(pygame.Color(self.fill_colour.r, self.fill_colour.g,
+                                     self.fill_colour.b, 0))
+        fill_alpha = pygame.surfarray.pixels_alpha(fill_image).transpose()
+        fill_alpha[self.fill_map.get_fill_mask(self.threshold, area)] = self.fill_colour.a
+        del fill_alpha  # unlocks the surface
+        return fill_image
+
+    def _create_undo_record(self) -> Optional[PixelDiffUndoRecord]:
+        # Outside of the current fill the canvas is back as it was in the snapshot, so the
+        # record only needs to cover the fill. The fill is blended on to the snapshot the same
+        # way the bands are blended on to the canvas.
+        fill_rect = self.fill_map.get_fill_bounds(self.threshold)
+        if fill_rect is None:
+            return None
+        after = create_blank_surface(fill_rect.size, self.snapshot)
+        for band in self._split_into_bands(fill_rect):
+            band_position = (0, band.top - fill_rect.top)
+            after.blit(self.snapshot, band_position, band)
+            after.blit(self._create_fill_image(band), band_position)
+        before = self.snapshot.subsurface(fill_rect)
+        undo_record = PixelDiffUndoRecord(before, after, fill_rect,
+                                          after_area=after.get_rect())
+        undo_record.compress(self.compression_level)
+        return undo_record
@@ -0,0 +1,377 @@
+import bisect
+import math
+
+from typing import Optional, Tuple
+
+import pygame
+
+# The canvas is split into horizontal runs of pixels and connectivity is worked out between
+# whole runs, so the per pixel work all happens inside numpy. Without numpy FillTool falls
+# back on its own recursive fill.
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+def is_available() -> bool:
+    return numpy is not None
+
+
+def calc_colour_distance_map(surface: pygame.Surface, colour: pygame.Color):
+    """
+    Calculate the same cheap squared RGB distance as
+    FillTool.calc_cheap_distance_between_colours for every pixel of a surface at once.
+
+    :param surface: The surface to measure.
+    :param colour: The colour to measure the distance from.
+
+    :return: A 2D int32 array of distances, indexed [y, x].
+    """
+    # surfarray views are indexed [x, y] but laid out in memory a row at a time, so work on
+    # the transposed view to walk through memory in order.
+    rgb = pygame.surfarray.pixels3d(surface).transpose(1, 0, 2)
+    distance_map = numpy.zeros(rgb.shape[:2], dtype=numpy.int32)
+    for channel, channel_value in enumerate((colour.r, colour.g, colour.b)):
+        channel_diff = rgb[:, :, channel].astype(numpy.int32)
+        channel_diff -= channel_value
+        channel_diff *= channel_diff
+        distance_map += channel_diff
+    del rgb  # unlocks the surface
+    return distance_map
+
+
+def find_runs(rows):
+    """
+    Split every row of a 2D array into runs of equal values.
+
+    :param rows: A 2D array indexed [y, x].
+
+    :return: A tuple of arrays (run_rows, run_starts, run_ends, run_values) sorted by row and
+             then by start. Run ends are exclusive.
+    """
+    width = rows.shape[1]
+    value_changes = numpy.ones(rows.shape, dtype=bool)
+    numpy.not_equal(rows[:, 1:], rows[:, :-1], out=value_changes[:, 1:])
+    run_rows, run_starts = numpy.nonzero(value_changes)
+
+    run_ends = numpy.empty_like(run_starts)
+    run_ends[:-1] = numpy.where(run_rows[1:] == run_rows[:-1], run_starts[1:], width)
+    run_ends[-1] = width
+    return run_rows, run_starts, run_ends, rows[run_rows, run_starts]
+
+
+def find_vertical_run_neighbours(run_rows, run_starts, run_ends, width: int):
+    """
+    Find every pair of runs that touch each other across neighbouring rows.
+
+    :param run_rows: Row of each run, the runs must be sorted by row then start.
+    :param run_starts: Start of each run.
+    :param run_ends: Exclusive end of each run.
+    :param width: Width of the rows.
+
+    :return: Two arrays of run indices, the lower and upper run of each touching pair.
+    """
+    # Lay every row end to end along one axis so that a single sorted search finds the
+    # range of runs in the row above that overlap each run.
+    stride = width + 1
+    start_keys = run_rows * stride + run_starts
+    end_keys = run_rows * stride + run_ends
+    first_above = numpy.searchsorted(end_keys, start_keys - stride, side='right')
+    last_above = numpy.searchsorted(start_keys, end_keys - stride, side='left')
+
+    counts = numpy.maximum(last_above - first_above, 0)
+    lower_runs = numpy.repeat(numpy.arange(len(run_rows)), counts)
+    offsets = numpy.arange(counts.sum()) - numpy.repeat(numpy.cumsum(counts) - counts, counts)
+    upper_runs = numpy.repeat(first_above, counts) + offsets
+    return lower_runs, upper_runs
+
+
+def label_connected_runs(run_count: int, run_a, run_b):
+    """
+    Label connected groups of runs by repeatedly hooking the larger label of each touching
+    pair on to the smaller one and then flattening the label chains.
+
+    :param run_count: The number of runs.
+    :param run_a: First run of each touching pair.
+    :param run_b: Second run of each touching pair.
+
+    :return: An array with the label of each run's group.
+    """
+    labels = numpy.arange(run_count)
+    while True:
+        labels_a = labels[run_a]
+        labels_b = labels[run_b]
+        unjoined = labels_a != labels_b
+        if not unjoined.any():
+            return labels
+        numpy.minimum.at(labels,
+                         numpy.maximum(labels_a[unjoined], labels_b[unjoined]),
+                         numpy.minimum(labels_a[unjoined], labels_b[unjoined]))
+        while True:
+            flattened_labels = labels[labels]
+            if numpy.array_equal(flattened_labels, labels):
+                break
+            labels = flattened_labels
+
+
+def find_run_at(run_rows, run_starts, run_ends, position: Tuple[int, int]) -> Optional[int]:
+    row_first, row_last = numpy.searchsorted(run_rows, [position[1], position[1] + 1])
+    run_index = row_first + numpy.searchsorted(run_starts[row_first:row_last],
+                                               position[0], side='right') - 1
+    if row_first <= run_index < row_last and run_ends[run_index] > position[0]:
+        return int(run_index)
+    return None
+
+
+def runs_to_mask(shape: Tuple[int, int], run_rows, run_starts, run_ends):
+    """
+    Turn a set of non-overlapping runs back into a boolean mask, indexed [y, x].
+    """
+    height, width = shape
+    run_edges = numpy.zeros((height, width + 1), dtype=numpy.int8)
+    numpy.add.at(run_edges, (run_rows, run_starts), 1)
+    numpy.add.at(run_edges, (run_rows, run_ends), -1)
+    return numpy.cumsum(run_edges[:, :width], axis=1, dtype=numpy.int8) > 0
+
+
+def calc_fill_mask(surface: pygame.Surface, position: Tuple[int, int],
+                   threshold: float):
+    """
+    Find the 4-connected region of pixels around a position whose cheap colour distance
+    from the pixel at that position is below the threshold.
+
+    :param surface: The surface to fill.
+    :param position: The start position of the fill.
+    :param threshold: The cheap colour distance threshold, pixels must be below this value
+                      to be filled.
+
+    :return: A boolean mask of the pixels to fill, indexed [y, x].
+    """
+    distance_map = calc_colour_distance_map(surface, surface.get_at(position))
+    return calc_fill_mask_from_distances(distance_map, position, threshold)
+
+
+def calc_fill_mask_from_distances(distance_map, position: Tuple[int, int],
+                                  threshold: float):
+    """
+    Find the 4-connected region of pixels around a position whose colour distance is below
+    the threshold.
+
+    :param distance_map: The colour distance of every pixel, indexed [y, x].
+    :param position: The start position of the fill.
+    :param threshold: The colour distance threshold.
+
+    :return: A boolean mask of the pixels to fill, indexed [y, x].
+    """
+    return calc_connected_mask(distance_map < threshold, position)
+
+
+def label_inside_runs(inside):
+    """
+    Label the 4-connected groups of set pixels of a boolean mask.
+
+    :param inside: A boolean mask, indexed [y, x].
+
+    :return: A tuple of arrays (run_rows, run_starts, run_ends, labels) for the runs of set
+             pixels, with the label of the group each run is part of.
+    """
+    run_rows, run_starts, run_ends, inside_runs = find_runs(inside)
+    run_rows = run_rows[inside_runs]
+    run_starts = run_starts[inside_runs]
+    run_ends = run_ends[inside_runs]
+    run_a, run_b = find_vertical_run_neighbours(run_rows, run_starts, run_ends,
+                                                inside.shape[1])
+    return run_rows, run_starts, run_ends, label_connected_runs(len(run_rows), run_a, run_b)
+
+
+def calc_connected_mask(inside, position: Tuple[int, int]):
+    """
+    Find the 4-connected region of set pixels of a boolean mask around a position.
+
+    :param inside: A boolean mask, indexed [y, x].
+    :param position: The start position of the region.
+
+    :return: A boolean mask of the region, indexed [y, x].
+    """
+    if not inside[position[1], position[0]]:
+        return numpy.zeros(inside.shape, dtype=bool)
+    run_rows, run_starts, run_ends, labels = label_inside_runs(inside)
+    seed_run = find_run_at(run_rows, run_starts, run_ends, position)
+    filled_runs = labels == labels[seed_run]
+    return runs_to_mask(inside.shape, run_rows[filled_runs],
+                        run_starts[filled_runs], run_ends[filled_runs])
+
+
+def get_mask_bounds(mask) -> Optional[pygame.Rect]:
+    """
+    :param mask: A boolean mask, indexed [y, x].
+
+    :return: The bounding rectangle of the set pixels of the mask, or None if there are none.
+    """
+    rows = numpy.flatnonzero(mask.any(axis=1))
+    if len(rows) == 0:
+        return None
+    columns = numpy.flatnonzero(mask.any(axis=0))
+    return pygame.Rect(int(columns[0]), int(rows[0]),
+                       int(columns[-1]) + 1 - int(columns[0]), int(rows[-1]) + 1 - int(rows[0]))
+
+
+class FillMap:
+    """
+    For a fill started from one seed position, the lowest of the thresholds filled so far at
+    which each pixel is part of the fill. Once a threshold has been filled, filling at it
+    again is a single comparison against the map.
+
+    A threshold that hasn't been filled yet sits between two that have, so only the pixels
+    whose map value is the higher of the two can change. Below the highest threshold filled
+    so far those pixels are labelled again on their own. Above it, the pixels that have come
+    in under the new threshold are joined on to groups of pixels kept from the last time,
+    so a refill only does work for the pixels between the two thresholds.
+
+    :param surface: The canvas to fill, it is only read while the map is made.
+    :param position: The seed position of the fill.
+    """
+    UNFILLED = numpy.iinfo(numpy.int32).max if numpy is not None else None
+
+    # Joining a pixel on to the groups costs about as much as labelling a couple of runs, so
+    # when more pixels come in under a new highest threshold than half the runs last time
+    # they were labelled, the groups are labelled again from the runs instead.
+    RUNS_PER_JOINED_PIXEL = 2
+
+    def __init__(self, surface: pygame.Surface, position: Tuple[int, int]):
+        self.position = position
+        self.distance_map = calc_colour_distance_map(surface, surface.get_at(position))
+        self.shape = self.distance_map.shape
+        self.threshold_map = numpy.full(self.shape, self.UNFILLED, dtype=numpy.int32)
+
+        # Colour distances are whole numbers, so a threshold is kept as the distance limit
+        # that pixels must be below, rounded up to a whole number too.
+        self._filled_limits = []
+
+        # For every pixel below the highest limit filled so far, the index of the first pixel
+        # of the group of pixels below that limit it is connected to. Every other pixel is
+        # its own group.
+        self._groups = None
+        self._grouped_limit = 0
+        self._grouped_run_count = 0
+
+    def get_mask(self, threshold: float):
+        """
+        :param threshold: The cheap colour distance threshold of the fill.
+
+        :return: A boolean mask of the filled pixels, indexed [y, x].
+        """
+        limit = math.ceil(threshold)
+        self._fill_limit(limit)
+        return self.threshold_map <= limit
+
+    def _fill_limit(self, limit: int):
+        if limit <= 0 or limit in self._filled_limits:
+            return
+        higher_limit_index = bisect.bisect(self._filled_limits, limit)
+        if higher_limit_index == len(self._filled_limits):
+            self._join_groups(limit)
+        else:
+            self._split_filled_pixels(limit, self._filled_limits[higher_limit_index])
+        self._filled_limits.insert(higher_limit_index, limit)
+
+    def _split_filled_pixels(self, limit: int, higher_limit: int):
+        # Pixels filled at the next limit down are still filled, so only those first filled
+        # at the next limit up need labelling, and they are all inside that limit's fill.
+        area = get_mask_bounds(self.threshold_map <= higher_limit)
+        area_threshold_map = self.threshold_map[area.top:area.bottom, area.left:area.right]
+        area_distances = self.distance_map[area.top:area.bottom, area.left:area.right]
+        filled = calc_connected_mask((area_threshold_map <= higher_limit) &
+                                     (area_distances < limit),
+                                     (self.position[0] - area.left,
+                                      self.position[1] - area.top))
+        area_threshold_map[filled] = numpy.minimum(area_threshold_map[filled], limit)
+
+    def _join_groups(self, limit: int):
+        flat_distances = self.distance_map.reshape(-1)
+        new_pixels = numpy.flatnonzero((flat_distances >= self._grouped_limit) &
+                                       (flat_distances < limit))
+        if (self._groups is None or
+                len(new_pixels) * self.RUNS_PER_JOINED_PIXEL > self._grouped_run_count):
+            self._label_groups(limit)
+        else:
+            self._join_new_pixels(new_pixels, limit)
+            self._grouped_run_count += len(new_pixels)
+        self._grouped_limit = limit
+
+        flat_threshold_map = self.threshold_map.reshape(-1)
+        seed_group = self._groups[self.position[1] * self.shape[1] + self.position[0]]
+        flat_threshold_map[(self._groups == seed_group) & (flat_threshold_map > limit)] = limit
+
+    def _label_groups(self, limit: int):
+        inside = self.distance_map < limit
+        run_rows, run_starts, run_ends, labels = label_inside_runs(inside)
+        self._grouped_run_count = len(run_rows)
+        # the first run of each group is the one it is labelled with
+        run_first_pixels = (run_rows * self.shape[1] + run_starts).astype(numpy.int32)
+        self._groups = numpy.arange(inside.size, dtype=numpy.int32)
+        self._groups[numpy.flatnonzero(inside)] = numpy.repeat(run_first_pixels[labels],
+                                                               run_ends - run_starts)
+
+    def _join_new_pixels(self, new_pixels, limit: int):
+        width = self.shape[1]
+        size = self.distance_map.size
+        columns = new_pixels % width
+        pixels = numpy.concatenate((new_pixels[columns > 0], new_pixels[columns < width - 1],
+                                    new_pixels[new_pixels >= width],
+                                    new_pixels[new_pixels < size - width]))
+        neighbours = numpy.concatenate((new_pixels[columns > 0] - 1,
+                                        new_pixels[columns < width - 1] + 1,
+                                        new_pixels[new_pixels >= width] - width,
+                                        new_pixels[new_pixels < size - width] + width))
+        below_limit = self.distance_map.reshape(-1)[neighbours] < limit
+        pixels = pixels[below_limit]
+        neighbours = neighbours[below_limit]
+
+        # Every pixel points straight at the first pixel of its group, so the groups that
+        # meet are joined the same way as runs are, and then one look up moves every pixel
+        # on to the first pixel of the group it ended up in.
+        groups = self._groups
+        groups_a = groups[pixels]
+        groups_b = groups[neighbours]
+        meeting_groups = numpy.zeros(size, dtype=bool)
+        meeting_groups[groups_a] = True
+        meeting_groups[groups_b] = True
+        group_firsts = numpy.flatnonzero(meeting_groups)
+        labels = label_connected_runs(len(group_firsts),
+                                      numpy.searchsorted(group_firsts, groups_a),
+                                      numpy.searchsorted(group_firsts, groups_b))
+        groups[group_firsts] = group_firsts[labels]
+        self._groups = groups[groups]
+
+    def get_fill_bounds(self, threshold: float) -> Optional[pygame.Rect]:
+        """
+        :param threshold: The cheap colour distance threshold of the fill.
+
+        :return: The bounding rectangle of the fill, or None if nothing is filled.
+        """
+        return get_mask_bounds(self.get_mask(threshold))
+
+    def get_changed_bounds(self, old_threshold: float,
+                           new_threshold: float) -> Optional[pygame.Rect]:
+        """
+        :return: The bounding rectangle of the pixels that are filled at one of the
+                 thresholds but not the other, or None if the fills are the same.
+        """
+        low_limit, high_limit = sorted((math.ceil(old_threshold), math.ceil(new_threshold)))
+        self._fill_limit(low_limit)
+        self._fill_limit(high_limit)
+        return get_mask_bounds((self.threshold_map > low_limit) &
+                               (self.threshold_map <= high_limit))
+
+    def get_fill_mask(self, threshold: float, area: pygame.Rect):
+        """
+        :param threshold: The cheap colour distance threshold of the fill.
+        :param area: The area of the map to get the mask for.
+
+        :return: A boolean mask of the filled pixels in the area, indexed [y, x].
+        """
+        limit = math.ceil(threshold)
+        self._fill_limit(limit)
+        return self.threshold_map[area.top:area.bottom, area.left:area.right] <= limit
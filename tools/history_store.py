@@ -0,0 +1,42 @@
+class HistoryStore:
+    """
+    Keeps the undo histories of every open canvas inside one shared memory budget. When the
+    records in memory go over the budget, the oldest records of the least recently focused
+    canvases are moved out to their history's temporary file on disk. They are read back in
+    if they are ever needed again.
+
+    :param byte_budget: The most memory, in bytes, the undo records of all canvases may use.
+    """
+    DEFAULT_BYTE_BUDGET = 512 * 1024 * 1024
+
+    def __init__(self, byte_budget: int = DEFAULT_BYTE_BUDGET):
+        self.byte_budget = byte_budget
+
+        # ordered from the least to the most recently focused
+        self.histories = []
+
+    def add_history(self, history):
+        self.histories.append(history)
+
+    def remove_history(self, history):
+        if history in self.histories:
+            self.histories.remove(history)
+
+    def focus_history(self, history):
+        """
+        Mark a history as the most recently focused, so it is the last to be moved to disk.
+
+        :param history: The history of the canvas that has been focused.
+        """
+        self.remove_history(history)
+        self.add_history(history)
+
+    def get_used_bytes(self) -> int:
+        return sum(history.used_bytes for history in self.histories)
+
+    def enforce_budget(self):
+        bytes_over_budget = self.get_used_bytes() - self.byte_budget
+        for history in self.histories:
+            if bytes_over_budget <= 0:
+                break
+            bytes_over_budget -= history.spill(bytes_over_budget)
@@ -0,0 +1,271 @@
+import bisect
+import pickle
+import tempfile
+
+from collections import deque
+from typing import List, Optional, Tuple, Union
+
+import pygame
+
+from tools.history_store import HistoryStore
+from tools.undo_record import UndoRecord, PixelDiffUndoRecord
+
+AnyUndoRecord = Union[UndoRecord, PixelDiffUndoRecord]
+
+
+class SpilledRecord:
+    """
+    Stands in for an undo record that has been moved out to a history's spill file.
+    """
+    def __init__(self, rect: pygame.Rect, offset: int, length: int, size: int, raw_size: int):
+        self.rect = rect
+        self.offset = offset
+        self.length = length
+        self.size = size
+        self.raw_size = raw_size
+
+
+class UndoHistory:
+    """
+    The undo and redo records of a canvas. Records are compressed as they are stored. The
+    memory they use counts towards the budget of a HistoryStore shared by every canvas,
+    which moves the oldest records out to a temporary file when it is exceeded. The space of
+    records read back from the file, or forgotten, is used again for the next ones to be
+    moved out, and the file shrinks again once the end of it is free.
+
+    The history also keeps the record of each change to the canvas, in order, for the
+    autosave journal to take with take_changes(). Swapping pixel diff records on to the canvas
+    as it was before makes the same changes again, other records only tell which area of the
+    canvas changed.
+
+    :param store: The history store this history shares a memory budget with.
+    :param compression_level: The zlib compression level records are stored at.
+    """
+    def __init__(self, store: HistoryStore, compression_level: int = 1):
+        self.store = store
+        self.compression_level = compression_level
+
+        self.undo_records = deque()
+        self.redo_records = deque()
+
+        self.used_bytes = 0
+        self.raw_bytes = 0
+        self.spilled_bytes = 0
+        self.spill_file_size = 0
+
+        self._spill_file = None
+        # the (offset, length) of each free gap in the spill file, in order
+        self._free_spill_space: List[Tuple[int, int]] = []
+
+        # only kept once something has asked for them
+        self._changes: Optional[List[AnyUndoRecord]] = None
+
+        self.store.add_history(self)
+
+    def add_record(self, record: AnyUndoRecord):
+        """
+        Store the undo record of a new change to the canvas, which ends any redo history.
+
+        :param record: The record to store.
+        """
+        while self.redo_records:
+            self._forget(self.redo_records.pop())
+        self.push_undo(record)
+        self._add_change(record)
+
+    def undo(self, surface: pygame.Surface):
+        """
+        Undo the latest change.
+
+        :param surface: The canvas image. It needs to be up to date under the area of the
+                        record from get_last_undo().
+        """
+        undo_record = self.pop_undo()
+        self.push_redo(undo_record.swap(surface))
+        self._add_change(undo_record)
+
+    def redo(self, surface: pygame.Surface):
+        """
+        Redo the latest undone change.
+
+        :param surface: The canvas image. It needs to be up to date under the area of the
+                        record from get_last_redo().
+        """
+        redo_record = self.pop_redo()
+        self.push_undo(redo_record.swap(surface))
+        self._add_change(redo_record)
+
+    def push_undo(self, record: AnyUndoRecord):
+        self._store(record)
+        self.undo_records.append(record)
+        self.store.enforce_budget()
+
+    def push_redo(self, record: AnyUndoRecord):
+        self._store(record)
+        self.redo_records.append(record)
+        self.store.enforce_budget()
+
+    def pop_undo(self) -> Optional[AnyUndoRecord]:
+        if not self.undo_records:
+            return None
+        return self._load(self.undo_records.pop())
+
+    def pop_redo(self) -> Optional[AnyUndoRecord]:
+        if not self.redo_records:
+            return None
+        return self._load(self.redo_records.pop())
+
+    def get_last_undo(self) -> Optional[Union[AnyUndoRecord, SpilledRecord]]:
+        return self.undo_records[-1] if self.undo_records else None
+
+    def get_last_redo(self) -> Optional[Union[AnyUndoRecord, SpilledRecord]]:
+        return self.redo_records[-1] if self.redo_records else None
+
+    def replace_last_undo(self, record: AnyUndoRecord):
+        """
+        Swap the latest undo record for an updated one, for changes that are adjusted after
+        they are first recorded.
+
+        :param record: The record to store in its place.
+        """
+        self._add_change(self.pop_undo())
+        self.push_undo(record)
+        self._add_change(record)
+
+    def remove_last_undo(self):
+        """
+        Drop the latest undo record, for a change that has been taken off the canvas again
+        without being undone.
+        """
+        self._add_change(self.pop_undo())
+
+    def take_changes(self) -> List[AnyUndoRecord]:
+        """
+        Get the records of the changes made since this was last called. Changes are only
+        kept from the first time it is called.
+
+        :return: The records, oldest first. They must not be modified.
+        """
+        changes = self._changes if self._changes is not None else []
+        self._changes = []
+        return changes
+
+    def can_undo(self) -> bool:
+        return bool(self.undo_records)
+
+    def can_redo(self) -> bool:
+        return bool(self.redo_records)
+
+    def focus(self):
+        self.store.focus_history(self)
+
+    def close(self):
+        """
+        Stop sharing the history store's budget and delete the spill file, once the canvas
+        has closed.
+        """
+        self.store.remove_history(self)
+        self.undo_records.clear()
+        self.redo_records.clear()
+        self._changes = None
+        if self._spill_file is not None:
+            self._spill_file.close()
+            self._spill_file = None
+        self.spill_file_size = 0
+        self._free_spill_space = []
+
+    def get_compression_ratio(self) -> float:
+        """
+        :return: The uncompressed size of the records in memory divided by their stored size.
+        """
+        if self.used_bytes == 0:
+            return 1.0
+        return self.raw_bytes / self.used_bytes
+
+    def spill(self, byte_count: int) -> int:
+        """
+        Move the oldest records held in memory out to the spill file. The latest undo record
+        always stays in memory, as tools may still be adjusting it.
+
+        :param byte_count: The number of bytes of memory to try and free.
+
+        :return: The number of bytes of memory freed.
+        """
+        freed_bytes = 0
+        for records, keep_count in ((self.undo_records, 1), (self.redo_records, 0)):
+            for index in range(len(records) - keep_count):
+                if freed_bytes >= byte_count:
+                    return freed_bytes
+                if not isinstance(records[index], SpilledRecord):
+                    freed_bytes += records[index].size
+                    records[index] = self._write_spilled(records[index])
+        return freed_bytes
+
+    def _add_change(self, record: AnyUndoRecord):
+        if self._changes is not None:
+            self._changes.append(record)
+
+    def _store(self, record: AnyUndoRecord):
+        record.compress(self.compression_level)
+        self.used_bytes += record.size
+        self.raw_bytes += record.raw_size
+
+    def _forget(self, record):
+        if isinstance(record, SpilledRecord):
+            self.spilled_bytes -= record.size
+            self._free_spill_file_space(record.offset, record.length)
+        else:
+            self.used_bytes -= record.size
+            self.raw_bytes -= record.raw_size
+
+    def _load(self, record) -> AnyUndoRecord:
+        loaded_record = record
+        if isinstance(record, SpilledRecord):
+            self._spill_file.seek(record.offset)
+            loaded_record = pickle.loads(self._spill_file.read(record.length))
+        self._forget(record)
+        return loaded_record
+
+    def _write_spilled(self, record: AnyUndoRecord) -> SpilledRecord:
+        if self._spill_file is None:
+            self._spill_file = tempfile.TemporaryFile(prefix='pygame_paint_undo_')
+        record_data = pickle.dumps(record, protocol=pickle.HIGHEST_PROTOCOL)
+        spilled_record = SpilledRecord(record.rect, self._allocate_spill_file_space(
+            len(record_data)), len(record_data), record.size, record.raw_size)
+        self._spill_file.seek(spilled_record.offset)
+        self._spill_file.write(record_data)
+
+        self.used_bytes -= record.size
+        self.raw_bytes -= record.raw_size
+        self.spilled_bytes += record.size
+        return spilled_record
+
+    def _allocate_spill_file_space(self, length: int) -> int:
+        # the first gap the record fits in, or else the end of the file
+        for index, (offset, free_length) in enumerate(self._free_spill_space):
+            if free_length >= length:
+                if free_length == length:
+                    del self._free_spill_space[index]
+                else:
+                    self._free_spill_space[index] = (offset + length, free_length - length)
+                return offset
+        offset = self.spill_file_size
+        self.spill_file_size += length
+        return offset
+
+    def _free_spill_file_space(self, offset: int, length: int):
+        # joined up with the gaps either side, so the free space doesn't break up over time
+        index = bisect.bisect(self._free_spill_space, (offset, length))
+        if (index < len(self._free_spill_space) and
+                self._free_spill_space[index][0] == offset + length):
+            length += self._free_spill_space.pop(index)[1]
+        if index > 0 and sum(self._free_spill_space[index - 1]) == offset:
+            offset, previous_length = self._free_spill_space.pop(index - 1)
+            length += previous_length
+            index -= 1
+
+        if offset + length == self.spill_file_size:
+            self.spill_file_size = offset
+            self._spill_file.truncate(offset)
+        else:
+            self._free_spill_space.insert(index, (offset, length))
@@ -1,6 +1,173 @@
+import zlib
+
+from typing import Optional
+
+import pygame
+
+# Without numpy changes are recorded as plain snapshots of the area they cover.
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 
 class UndoRecord:
-    def __init__(self, image, rect):
-        self.image = image
+    """
+    The pixels of an area of the canvas from before a change. Once a record is stored in an
+    UndoHistory its pixels are kept compressed, and only unpacked again when it is used.
+
+    :param image: The pixels of the area.
+    :param rect: The area of the canvas the pixels came from.
+    """
+    def __init__(self, image: pygame.Surface, rect: pygame.Rect):
+        self.rect = rect
+        self.raw_size = rect.width * rect.height * 4
+
+        self._image = image
+        self._compressed_pixels = None
+
+    @property
+    def image(self) -> pygame.Surface:
+        if self._image is None:
+            return pygame.image.frombytes(zlib.decompress(self._compressed_pixels),
+                                          self.rect.size, 'RGBA')
+        return self._image
+
+    @property
+    def size(self) -> int:
+        """
+        :return: The number of bytes used by the pixels of the record.
+        """
+        if self._compressed_pixels is not None:
+            return len(self._compressed_pixels)
+        return self.raw_size
+
+    def compress(self, level: int):
+        if self._image is not None:
+            self._compressed_pixels = zlib.compress(pygame.image.tobytes(self._image, 'RGBA'),
+                                                    level)
+            self._image = None
+
+    def swap(self, surface: pygame.Surface) -> 'UndoRecord':
+        """
+        Put the recorded pixels back on to a canvas sized surface.
+
+        :param surface: The surface to restore the area of.
+
+        :return: A record of the pixels that were replaced, to reverse the swap with.
+        """
+        replaced_surf = pygame.Surface(self.rect.size, flags=pygame.SRCALPHA)
+        replaced_surf.blit(surface, (0, 0), self.rect)
+        # drawing on a fully transparent area copies the pixels exactly, rather than blending
+        surface.fill(pygame.Color(0, 0, 0, 0), self.rect)
+        surface.blit(self.image, self.rect)
+        return UndoRecord(replaced_surf, self.rect.copy())
+
+
+class PixelDiffUndoRecord:
+    """
+    Only the pixels of an area that a change actually modified. The area is split into
+    blocks and each modified block stores a bit mask of its changed pixels along with those
+    pixels XORed between before and after the change. XORing them back in again undoes the
+    change, and doing it a second time redoes it, so no extra pixels are needed to reverse it.
+
+    :param before: The pixels of the area from before the change.
+    :param after_surface: The canvas sized surface after the change.
+    :param rect: The area of the canvas the change covers.
+    :param after_area: The area of after_surface to compare with, when it isn't canvas
+                       sized. Defaults to rect.
+    """
+    BLOCK_SIZE = 64
+
+    def __init__(self, before: pygame.Surface, after_surface: pygame.Surface,
+                 rect: pygame.Rect, after_area: Optional[pygame.Rect] = None):
         self.rect = rect
+        self.raw_size = rect.width * rect.height * 4
+
+        self._blocks = []
+        self._compressed = False
+
+        if before.get_masks() != after_surface.get_masks():
+            before = before.convert(after_surface)
+
+        # Whole pixels are compared as mapped 32 bit values, on the transposed views so
+        # that rows are walked through in memory order.
+        if after_area is None:
+            after_area = rect
+        diff = numpy.bitwise_xor(pygame.surfarray.pixels2d(before).T,
+                                 pygame.surfarray.pixels2d(after_surface).T[
+                                     after_area.top:after_area.bottom,
+                                     after_area.left:after_area.right])
+        changed = diff != 0
+
+        block_size = self.BLOCK_SIZE
+        block_rows = -(-rect.height // block_size)
+        block_columns = -(-rect.width // block_size)
+        padded_changed = numpy.zeros((block_rows * block_size, block_columns * block_size),
+                                     dtype=bool)
+        padded_changed[:rect.height, :rect.width] = changed
+        changed_blocks = padded_changed.reshape(block_rows, block_size,
+                                                block_columns, block_size).any(axis=(1, 3))
+
+        for block_row, block_column in zip(*numpy.nonzero(changed_blocks)):
+            block = (slice(block_row * block_size, (block_row + 1) * block_size),
+                     slice(block_column * block_size, (block_column + 1) * block_size))
+            block_changed = changed[block]
+            block_rect = pygame.Rect(rect.left + block[1].start, rect.top + block[0].start,
+                                     block_changed.shape[1], block_changed.shape[0])
+            self._blocks.append((block_rect,
+                                 numpy.packbits(block_changed).tobytes() +
+                                 diff[block][block_changed].tobytes()))
+
+    @property
+    def size(self) -> int:
+        """
+        :return: The number of bytes used by the changed pixels of the record.
+        """
+        return sum(len(block_data) for _, block_data in self._blocks)
+
+    def compress(self, level: int):
+        if not self._compressed:
+            self._blocks = [(block_rect, zlib.compress(block_data, level))
+                            for block_rect, block_data in self._blocks]
+            self._compressed = True
+
+    def swap(self, surface: pygame.Surface) -> 'PixelDiffUndoRecord':
+        """
+        Undo the change on a canvas sized surface, or redo it if it has already been undone.
+
+        :param surface: The surface to change, it must be the one the record was made from.
+
+        :return: This record, which now reverses the swap.
+        """
+        pixels = pygame.surfarray.pixels2d(surface).T
+        for block_rect, block_data in self._blocks:
+            if self._compressed:
+                block_data = zlib.decompress(block_data)
+            block_area = block_rect.width * block_rect.height
+            mask_length = -(-block_area // 8)
+            block_changed = numpy.unpackbits(numpy.frombuffer(block_data, dtype=numpy.uint8,
+                                                              count=mask_length),
+                                             count=block_area).view(bool)
+            block_changed = block_changed.reshape(block_rect.height, block_rect.width)
+            block_diff = numpy.frombuffer(block_data, dtype=numpy.uint32, offset=mask_length)
+
+            block_pixels = pixels[block_rect.top:block_rect.bottom,
+                                  block_rect.left:block_rect.right]
+            block_pixels[block_changed] ^= block_diff
+        del pixels  # unlocks the surface
+        return self
+
+
+def create_undo_record(before: pygame.Surface, after_surface: pygame.Surface,
+                       rect: pygame.Rect):
+    """
+    Make the most compact undo record available for a change to the canvas.
+
+    :param before: The pixels of the area from before the change.
+    :param after_surface: The canvas sized surface after the change.
+    :param rect: The area of the canvas the change covers.
+    """
+    if numpy is None:
+        return UndoRecord(before, rect)
+    return PixelDiffUndoRecord(before, after_surface, rect)
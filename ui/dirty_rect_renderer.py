@@ -0,0 +1,121 @@
+from typing import List
+
+import pygame
+
+from pygame_gui import UIManager
+
+
+class DirtyRectRenderer:
+    """
+    Draws the UI to the window, redrawing and updating only the parts of the display that
+    have changed since the last frame.
+
+    Changes are found by comparing each UI sprite's image, position and clip with the last
+    frame, along with any elements that have a freshly built image waiting and any areas
+    of the canvases that have been painted on. When nothing has changed the frame isn't
+    drawn at all.
+
+    :param window_surface: The display surface.
+    :param background: The surface drawn behind the UI.
+    :param ui_manager: The UI manager to draw.
+    """
+    MAX_DIRTY_RECTS = 32
+
+    def __init__(self, window_surface: pygame.Surface,
+                 background: pygame.Surface,
+                 ui_manager: UIManager):
+        self.window_surface = window_surface
+        self.background = background
+        self.ui_manager = ui_manager
+
+        self._drawn_sprites = {}
+        self._dirty_rects: List[pygame.Rect] = []
+        self._redraw_all = True
+
+    def redraw_all(self):
+        self._redraw_all = True
+
+    def process_event(self, event: pygame.event.Event):
+        if event.type in (pygame.VIDEOEXPOSE, pygame.WINDOWEXPOSED,
+                          pygame.WINDOWRESTORED, pygame.WINDOWSIZECHANGED):
+            self.redraw_all()
+
+    def find_pending_changes(self):
+        """
+        Find the elements that will swap in a freshly built image on the next UI update.
+        Some elements rebuild their image in place so it can't be spotted afterwards, this
+        should be called between processing events and updating the UI manager.
+        """
+        for sprite in self.ui_manager.get_sprite_group().sprites():
+            drawable_shape = getattr(sprite, 'drawable_shape', None)
+            if drawable_shape is not None and drawable_shape.has_fresh_surface():
+                self._dirty_rects.append(pygame.Rect(sprite.rect))
+
+    def draw(self) -> bool:
+        """
+        Redraw the changed parts of the window and push them to the display.
+
+        :return: True if anything was drawn.
+        """
+        self._find_sprite_changes()
+
+        screen_rect = self.window_surface.get_rect()
+        if self._redraw_all:
+            self._redraw_all = False
+            dirty_rects = [screen_rect]
+        else:
+            dirty_rects = [rect.clip(screen_rect) for rect in self._dirty_rects]
+            dirty_rects = [rect for rect in dirty_rects if rect.width > 0 and rect.height > 0]
+        self._dirty_rects = []
+
+        if not dirty_rects:
+            return False
+
+        redraw_area = dirty_rects[0].unionall(dirty_rects[1:])
+        if len(dirty_rects) > self.MAX_DIRTY_RECTS:
+            dirty_rects = [redraw_area]
+
+        self.window_surface.set_clip(redraw_area)
+        self.window_surface.blit(self.background, redraw_area, redraw_area)
+        self.ui_manager.draw_ui(self.window_surface)
+        self.window_surface.set_clip(None)
+
+        pygame.display.update(dirty_rects)
+        return True
+
+    def _find_sprite_changes(self):
+        drawn_sprites = {}
+        visible_sprites = []
+        for sprite in self.ui_manager.get_sprite_group().sprites():
+            if hasattr(sprite, 'take_changed_display_rects'):
+                self._dirty_rects.extend(sprite.take_changed_display_rects())
+            if sprite.image is not None and sprite.visible:
+                visible_sprites.append(sprite)
+
+        layer_index = 0
+        for sprite in visible_sprites:
+            clip_rect = None
+            if hasattr(sprite, 'get_image_clipping_rect'):
+                clip_rect = sprite.get_image_clipping_rect()
+                if clip_rect is not None:
+                    if clip_rect.width == 0 or clip_rect.height == 0:
+                        # Completely clipped elements draw nothing, but some of them are
+                        # given a new empty image every frame.
+                        continue
+                    clip_rect = tuple(clip_rect)
+            drawn_state = (sprite.image, tuple(sprite.rect), clip_rect, layer_index)
+            layer_index += 1
+            drawn_sprites[sprite] = drawn_state
+
+            last_drawn_state = self._drawn_sprites.pop(sprite, None)
+            if last_drawn_state is None:
+                self._dirty_rects.append(pygame.Rect(sprite.rect))
+            elif (last_drawn_state[0] is not drawn_state[0] or
+                  last_drawn_state[1:] != drawn_state[1:]):
+                self._dirty_rects.append(pygame.Rect(last_drawn_state[1]))
+                self._dirty_rects.append(pygame.Rect(sprite.rect))
+
+        # whatever is left has been hidden or killed since the last frame
+        for last_drawn_state in self._drawn_sprites.values():
+            self._dirty_rects.append(pygame.Rect(last_drawn_state[1]))
+        self._drawn_sprites = drawn_sprites
@@ -3,3 +3,6 @@ from pygame.event import custom_type
 UI_PAINT_CREATE_NEW_CANVAS = custom_type()
 UI_PAINT_COLOUR_DROPPER_CHANGED = custom_type()
 UI_PAINT_PAINTING_TOOL_CHANGED = custom_type()
+UI_PAINT_SAVE_FINISHED = custom_type()
+UI_PAINT_PNG_COMPRESSION_CHANGED = custom_type()
+UI_PAINT_IMAGE_LOADED = custom_type()
@@ -0,0 +1,50 @@
+from typing import List, Tuple
+
+import pygame
+
+
+class FramePacer:
+    """
+    Paces the main loop. While anything is happening - painting, animating or the user
+    interacting - frames run as fast as the frame rate cap allows. Once everything has been
+    quiet for a moment the loop blocks waiting for events instead, waking up a few times a
+    second so the UI's timers, like the text cursor blink, keep running.
+
+    :param clock: The clock used to time frames.
+    :param frame_rate_cap: The highest frame rate while active, or 0 for no cap.
+    """
+    IDLE_DELAY = 0.5
+    IDLE_WAIT_TIME = 0.1
+
+    def __init__(self, clock: pygame.time.Clock, frame_rate_cap: int = 60):
+        self.clock = clock
+        self.frame_rate_cap = frame_rate_cap
+
+        self._quiet_time = 0.0
+
+    def tick(self, active: bool) -> Tuple[float, List[pygame.event.Event]]:
+        """
+        Wait for the next frame and collect its events.
+
+        :param active: True if anything happened in the last frame, other than events.
+
+        :return: The time since the last frame in seconds, and the new events.
+        """
+        if active:
+            self._quiet_time = 0.0
+
+        events = []
+        if self._quiet_time >= self.IDLE_DELAY and not pygame.event.peek():
+            event = pygame.event.wait(int(self.IDLE_WAIT_TIME * 1000))
+            if event.type != pygame.NOEVENT:
+                events.append(event)
+            time_delta = self.clock.tick() / 1000.0
+        else:
+            time_delta = self.clock.tick(self.frame_rate_cap) / 1000.0
+        events.extend(pygame.event.get())
+
+        if events:
+            self._quiet_time = 0.0
+        else:
+            self._quiet_time += time_delta
+        return time_delta, events
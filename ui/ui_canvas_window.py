@@ -2,14 +2,19 @@ import pygame
 import pygame_gui
 
 from ui.ui_editable_canvas import EditableCanvas
+from pygame_gui.elements import UIProgressBar, UILabel
 from pygame_gui.elements.ui_scrolling_container import UIScrollingContainer
 
 
 class CanvasWindow(pygame_gui.elements.UIWindow):
+    # the space around the canvas inside the scrollable area
+    CANVAS_MARGIN = 10
+
     def __init__(self, rect,
                  manager,
                  image_file_name,
-                 image):
+                 image,
+                 history_store):
         super().__init__(rect, manager,
                          window_display_title=image_file_name,
                          object_id='#canvas_window',
@@ -23,18 +28,141 @@ class CanvasWindow(pygame_gui.elements.UIWindow):
                                                         anchors={'left': 'left',
                                                                  'right': 'right',
                                                                  'top': 'top',
-                                                                 'bottom': 'bottom'})
+                                                                 'bottom': 'bottom'},
+                                                        should_grow_automatically=False)
 
-        self.scrolling_container.set_scrollable_area_dimensions((image.get_width() + 20,
-                                                                 image.get_height() + 20))
+        self.scrolling_container.set_scrollable_area_dimensions(
+            (image.get_width() + self.CANVAS_MARGIN * 2,
+             image.get_height() + self.CANVAS_MARGIN * 2))
 
-        self.canvas_ui = EditableCanvas(relative_rect=pygame.Rect((10, 10),
+        self.canvas_ui = EditableCanvas(relative_rect=pygame.Rect((self.CANVAS_MARGIN,
+                                                                   self.CANVAS_MARGIN),
                                                                   (image.get_width(),
                                                                    image.get_height())),
                                         image_surface=image,
                                         manager=manager,
+                                        history_store=history_store,
                                         container=self.scrolling_container,
                                         anchors={'left': 'left',
                                                  'right': 'left',
                                                  'top': 'top',
                                                  'bottom': 'top'})
+
+        self.save_worker = None
+        self.save_progress_bar = None
+
+        self.image_loader = None
+        self.loading_label = None
+
+        # the autosave journal this window's image is being recovered from, if any
+        self.recovered_journal = None
+
+    def start_loading(self, image_loader):
+        """
+        Start loading this window's image in the background, the canvas shows a placeholder
+        until it is done.
+
+        :param image_loader: The image loader to start.
+        """
+        self.image_loader = image_loader
+        self.canvas_ui.loading = True
+        self.loading_label = UILabel(relative_rect=pygame.Rect(10, -34, 160, 24),
+                                     text='Loading...',
+                                     manager=self.ui_manager,
+                                     container=self,
+                                     anchors={'left': 'left',
+                                              'right': 'left',
+                                              'top': 'bottom',
+                                              'bottom': 'bottom'})
+        self.image_loader.start()
+
+    def finish_loading(self, image, tiled_document_reader=None):
+        """
+        Swap in the loaded image for the placeholder.
+
+        :param image: The loaded image.
+        :param tiled_document_reader: The reader of the tiled document the image is from, when
+                                      its tiles are still to be read.
+        """
+        self.image_loader = None
+        if self.loading_label is not None:
+            self.loading_label.kill()
+            self.loading_label = None
+        self.canvas_ui.finish_loading(image, tiled_document_reader)
+        self._update_scrollable_area()
+
+    def set_zoom_level(self, zoom_level: int):
+        """
+        Zoom the canvas, keeping the part of the image in the middle of the view where it is.
+
+        :param zoom_level: The power of two to zoom by, negative to zoom out.
+        """
+        # zoomed out, the middle of the view can be past the edge of the image
+        canvas_center = [min(max(position, 0), image_size) for position, image_size in
+                         zip(self.canvas_ui.screen_to_canvas(self._get_view_rect().center),
+                             self.canvas_ui.canvas_image.get_size())]
+        if not self.canvas_ui.set_zoom_level(zoom_level):
+            return
+        # The scroll bars that are needed depend on where the scrollable area is as well as
+        # its size, so it is sized from the start to find the size of the view.
+        scrollable_area = self.scrolling_container.get_container()
+        scrollable_area.set_relative_position((0, 0))
+        self._update_scrollable_area()
+
+        # scroll so the same part of the image is back in the middle of the view, as far as
+        # the scrollable area goes
+        zoom = self.canvas_ui.get_zoom()
+        view_size = self._get_view_rect().size
+        scroll_position = []
+        for index in (0, 1):
+            scroll_offset = (self.CANVAS_MARGIN + canvas_center[index] * zoom -
+                             view_size[index] / 2)
+            max_scroll_offset = max(0, scrollable_area.get_size()[index] - view_size[index])
+            scroll_position.append(-round(min(max(scroll_offset, 0), max_scroll_offset)))
+        scrollable_area.set_relative_position(scroll_position)
+        # Moves the scroll bars to match. They can only roughly show where the area is, so
+        # they are kept from moving it again on the next update.
+        self._update_scrollable_area()
+        for scroll_bar in (self.scrolling_container.horiz_scroll_bar,
+                           self.scrolling_container.vert_scroll_bar):
+            if scroll_bar is not None:
+                scroll_bar.has_moved_recently = False
+
+    def start_save(self, save_worker):
+        """
+        Start a background save of this window's canvas and show its progress.
+
+        :param save_worker: The save worker to start.
+        """
+        self.save_worker = save_worker
+        self.save_progress_bar = UIProgressBar(relative_rect=pygame.Rect(10, -34, 160, 24),
+                                               manager=self.ui_manager,
+                                               container=self,
+                                               anchors={'left': 'left',
+                                                        'right': 'left',
+                                                        'top': 'bottom',
+                                                        'bottom': 'bottom'})
+        self.save_worker.start()
+
+    def finish_save(self):
+        self.save_worker = None
+        if self.save_progress_bar is not None:
+            self.save_progress_bar.kill()
+            self.save_progress_bar = None
+
+    def _update_scrollable_area(self):
+        display_width, display_height = self.canvas_ui.rect.size
+        self.scrolling_container.set_scrollable_area_dimensions(
+            (display_width + self.CANVAS_MARGIN * 2, display_height + self.CANVAS_MARGIN * 2))
+
+    def _get_view_rect(self) -> pygame.Rect:
+        # the part of the scrolling container that isn't covered by its scroll bars
+        view_rect = self.scrolling_container.rect.copy()
+        view_rect.width -= self.scrolling_container.scroll_bar_width
+        view_rect.height -= self.scrolling_container.scroll_bar_height
+        return view_rect
+
+    def update(self, time_delta: float):
+        super().update(time_delta)
+        if self.save_progress_bar is not None:
+            self.save_progress_bar.set_current_progress(self.save_worker.progress * 100)
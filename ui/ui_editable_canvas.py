@@ -1,22 +1,53 @@
-from typing import List, Optional
+from typing import List, Optional, Tuple
 from pathlib import Path
 
 import pygame
 import pygame_gui
 
-from tools.undo_record import UndoRecord
+from document.mip_pyramid import MipPyramid
+from document.tile_grid import TileGrid, TileSnapshot
+from document.tiled_document import TiledDocumentReader
+from tools.history_store import HistoryStore
+from tools.undo_history import UndoHistory
 from ui.event_types import UI_PAINT_PAINTING_TOOL_CHANGED
 
 
 class EditableCanvas(pygame_gui.core.ui_element.UIElement):
+    """
+    Shows a canvas image for editing, at a zoom of a power of two. Zoomed out, the canvas
+    shows a level of a mip pyramid of the image and zoomed in, a scaled up copy of the part
+    of it in view. Both are kept up to date a modified area at a time by invalidate_rect().
+
+    Only the part of the canvas inside the scrolling view is ever drawn, so the cost of
+    drawing the canvas depends on the size of the window rather than of the image.
+
+    Tools draw on the full size image from get_image(), and use screen_to_canvas() to find
+    where the mouse is on it.
+
+    A canvas opened from a tiled document reads in the document's tiles as they come into
+    view, or as get_image() is asked for the areas they cover. In the same way, snapshots of
+    the canvas still being copied in the background copy the tiles get_image() is asked for
+    before they can be changed.
+    """
+    MIN_ZOOM_LEVEL = -4
+    MAX_ZOOM_LEVEL = 3
+
     def __init__(self, relative_rect,
                  image_surface,
                  manager,
+                 history_store: HistoryStore,
                  container=None,
                  parent=None,
                  object_id=None,
                  anchors=None):
 
+        # the base class may clip the image while it is set up, before there is one to show
+        self.canvas_image: Optional[pygame.Surface] = None
+        # the document the image is being read from, until all of it has been read
+        self.tiled_document_reader: Optional[TiledDocumentReader] = None
+        # snapshots of the image that are still being copied
+        self._snapshots: List[TileSnapshot] = []
+
         super().__init__(relative_rect=relative_rect,
                          manager=manager,
                          container=container,
@@ -29,13 +60,40 @@ class EditableCanvas(pygame_gui.core.ui_element.UIElement):
                                object_id=object_id,
                                element_id='editable_canvas')
 
+        # the canvas is zoomed by 2 ** zoom_level
+        self.zoom_level = 0
+        self.mip_pyramid: Optional[MipPyramid] = None
+
+        # zoomed in, the scaled up copy of the part of the canvas image in view
+        self._zoomed_in_image: Optional[pygame.Surface] = None
+        self._zoomed_in_canvas_rect: Optional[pygame.Rect] = None
+
+        # areas of the window the canvas has changed, waiting to be pushed to the display
+        self._changed_display_rects = []
+
+        self.tiles = self._create_tiles(image_surface.get_size())
+
         self.set_image(image_surface)
 
+        # The tiled document the canvas was last loaded from or saved to, which is up to
+        # date apart from the 'tiled_document' dirty tiles.
+        self.tiled_document_path: Optional[Path] = None
+
+        # while an image is loading the canvas shows a placeholder and can't be edited
+        self.loading = False
+
         self.active_tool = None
         self.save_file_path: Optional[Path] = None
 
-        self.undo_stack: List[Optional[UndoRecord]] = []
-        self.redo_stack: List[Optional[UndoRecord]] = []
+        self.history = UndoHistory(history_store)
+
+    @staticmethod
+    def _create_tiles(size) -> TileGrid:
+        tiles = TileGrid(size)
+        tiles.add_dirty_channel('save')
+        tiles.add_dirty_channel('tiled_document')
+        tiles.add_dirty_channel('autosave')
+        return tiles
 
     def set_save_file_path(self, path):
         self.save_file_path = path
@@ -43,8 +101,118 @@ class EditableCanvas(pygame_gui.core.ui_element.UIElement):
     def set_active_tool(self, tool):
         self.active_tool = tool
 
+    def invalidate_rect(self, rect: pygame.Rect):
+        """
+        Record that an area of the canvas image has been modified and push just that area
+        to the displayed image.
+
+        :param rect: The modified area, in canvas coordinates.
+        """
+        self.tiles.mark_dirty(rect)
+
+        # changes out of view are picked up when they are scrolled into view
+        area = self._get_display_rect(rect).clip(self._get_visible_rect())
+        if area.width == 0 or area.height == 0:
+            return
+        if self.zoom_level < 0:
+            # brings the shown level of the pyramid up to date
+            self.mip_pyramid.get_level(-self.zoom_level)
+        elif self.zoom_level > 0 and self._zoomed_in_canvas_rect is not None:
+            canvas_area = rect.clip(self._zoomed_in_canvas_rect)
+            if canvas_area.width > 0 and canvas_area.height > 0:
+                view_area = self._get_display_rect(
+                    canvas_area.move(-self._zoomed_in_canvas_rect.left,
+                                     -self._zoomed_in_canvas_rect.top))
+                pygame.transform.scale(self.canvas_image.subsurface(canvas_area),
+                                       view_area.size,
+                                       self._zoomed_in_image.subsurface(view_area))
+        self._changed_display_rects.append(area.move(self.rect.topleft))
+
+    def take_changed_display_rects(self) -> List[pygame.Rect]:
+        """
+        Get the areas of the window that show changes to the canvas since this was last
+        called.
+
+        :return: A list of rectangles in screen coordinates.
+        """
+        changed_display_rects = self._changed_display_rects
+        self._changed_display_rects = []
+        return changed_display_rects
+
+    def finish_loading(self, image: pygame.Surface,
+                       tiled_document_reader: Optional[TiledDocumentReader] = None):
+        """
+        Swap the loading placeholder for the loaded image and allow editing.
+
+        :param image: The loaded image.
+        :param tiled_document_reader: The reader of the tiled document the image is from, when
+                                      its tiles are still to be read. The canvas takes it over.
+        """
+        if image.get_size() != self.tiles.size:
+            self.tiles = self._create_tiles(image.get_size())
+        self.set_image(image, tiled_document_reader)
+        self.loading = False
+
+    def has_unsaved_changes(self) -> bool:
+        return bool(self.tiles.get_dirty_tiles('save'))
+
+    def take_unsaved_tiles(self, channels=('save',)):
+        """
+        Get the tiles changed since the last save and mark them as saved, for when a save
+        of the current image starts.
+
+        :param channels: The dirty channels the save covers.
+
+        :return: A dictionary of dirty channel -> the tiles taken from it.
+        """
+        return {channel: self.tiles.take_dirty_tiles(channel) for channel in channels}
+
+    def restore_unsaved_tiles(self, taken_tiles):
+        """
+        Mark tiles as unsaved again, after a save that covered them has failed.
+
+        :param taken_tiles: The tiles from take_unsaved_tiles().
+        """
+        for channel, tiles in taken_tiles.items():
+            self.tiles.get_dirty_tiles(channel).update(tiles)
+
     def get_colour_at(self, pos):
-        return self.image.get_at(pos)
+        return self.get_image(pygame.Rect(pos, (1, 1))).get_at(pos)
+
+    def get_zoom(self) -> float:
+        return 2.0 ** self.zoom_level
+
+    def can_zoom_to(self, zoom_level: int) -> bool:
+        return self.MIN_ZOOM_LEVEL <= zoom_level <= self.MAX_ZOOM_LEVEL
+
+    def set_zoom_level(self, zoom_level: int) -> bool:
+        """
+        Zoom the canvas.
+
+        :param zoom_level: The power of two to zoom by, negative to zoom out.
+
+        :return: True if the zoom changed.
+        """
+        if zoom_level == self.zoom_level or not self.can_zoom_to(zoom_level):
+            return False
+        self.zoom_level = zoom_level
+        self._rebuild_display()
+        return True
+
+    def screen_to_canvas(self, screen_point) -> Tuple[float, float]:
+        """
+        :param screen_point: A position on the screen.
+
+        :return: The same position on the full size canvas image, in fractions of a pixel.
+        """
+        zoom = self.get_zoom()
+        return ((screen_point[0] - self.rect.left) / zoom,
+                (screen_point[1] - self.rect.top) / zoom)
+
+    def canvas_to_screen(self, canvas_point) -> Tuple[float, float]:
+        zoom = self.get_zoom()
+        return (self.rect.left + canvas_point[0] * zoom,
+                self.rect.top + canvas_point[1] * zoom)
 
     def process_event(self, event: pygame.event.Event) -> bool:
         consumed_event = False
@@ -52,7 +220,7 @@ class EditableCanvas(pygame_gui.core.ui_element.UIElement):
         if event.type == UI_PAINT_PAINTING_TOOL_CHANGED:
             self.set_active_tool(event.tool)
 
-        if (self.active_tool is not None and
+        if (self.active_tool is not None and not self.loading and
                 self.active_tool.process_canvas_event(event,
                                                       self,
                                                       self.ui_manager.get_mouse_position())):
@@ -63,19 +231,177 @@ class EditableCanvas(pygame_gui.core.ui_element.UIElement):
 
     def update(self, time_delta: float):
         super().update(time_delta)
+        self._drop_finished_snapshots()
+
+    def kill(self):
+        self.history.close()
+        self._close_tiled_document()
+        super().kill()
+
+    def get_image(self, area: Optional[pygame.Rect] = None) -> pygame.Surface:
+        """
+        :param area: The area of the image about to be used. Any of it still to be read from
+                     the tiled document the canvas was opened from is read first. If None,
+                     the whole image is.
+
+        :return: The full size canvas image, without any zoom or clipping.
+        """
+        if area is None:
+            area = self.canvas_image.get_rect()
+        self._read_tiled_document(area)
+        if self._snapshots:
+            for snapshot in self._snapshots:
+                snapshot.copy_tiles_in_rect(area)
+            self._drop_finished_snapshots()
+        return self.canvas_image
+
+    def take_snapshot(self, tiles=None) -> TileSnapshot:
+        """
+        Take a snapshot of the image as it is now, for a background thread to copy. Any of the
+        image still to be read from a tiled document is read in first.
 
-    def get_image(self) -> pygame.Surface:
+        :param tiles: The tiles to copy, or None to copy all of them.
+
+        :return: The snapshot, its copy_all_tiles() finishes the copy.
+        """
+        self._read_tiled_document(self.canvas_image.get_rect())
+        snapshot = TileSnapshot(self.tiles, self.canvas_image, tiles)
+        self._snapshots.append(snapshot)
+        return snapshot
+
+    def get_visible_canvas_rect(self) -> pygame.Rect:
         """
-        :return: The complete image Surface without any clipping.
+        :return: The area of the full size canvas image inside the scrolling view.
         """
-        if self.get_image_clipping_rect() is not None:
-            return self._pre_clipped_image
+        visible_rect = self._get_visible_rect()
+        if self.zoom_level > 0:
+            canvas_rect = MipPyramid.get_level_rect(visible_rect, self.zoom_level)
         else:
-            return self.image
+            scale = -self.zoom_level
+            canvas_rect = pygame.Rect(visible_rect.left << scale, visible_rect.top << scale,
+                                      visible_rect.width << scale, visible_rect.height << scale)
+        return canvas_rect.clip(self.canvas_image.get_rect())
 
-    def set_image(self, new_image: Optional[pygame.surface.Surface]) -> None:
+    def set_image(self, new_image: pygame.surface.Surface,
+                  tiled_document_reader: Optional[TiledDocumentReader] = None) -> None:
         """
+        :param new_image: The new canvas image. The canvas takes it over rather than making
+                          a copy.
+        :param tiled_document_reader: The reader of a tiled document to read the image from
+                                      as it is needed. The canvas takes it over.
+        """
+        self._close_tiled_document()
+        self.tiled_document_reader = tiled_document_reader
+        # the old image is no longer changed, so snapshots of it can be copied as it is
+        self._snapshots = []
+        self.canvas_image = new_image
+        self.mip_pyramid = MipPyramid(new_image, self.tiles)
+        if not self.can_zoom_to(self.zoom_level):
+            self.zoom_level = 0
+        self._rebuild_display()
+
+    def _drop_finished_snapshots(self):
+        # once copied, a snapshot's pixels belong to whoever took it
+        if self._snapshots:
+            self._snapshots = [snapshot for snapshot in self._snapshots
+                               if not snapshot.is_complete()]
+
+    def _read_tiled_document(self, area: pygame.Rect):
+        if self.tiled_document_reader is None:
+            return
+        # tools back up whole canvas tiles, so they are always read in whole
+        area = self.tiles.get_tiles_bounding_rect(self.tiles.get_tiles_in_rect(area))
+        if area is None:
+            return
+        read_rect = self.tiled_document_reader.read_tiles(self.canvas_image, area)
+        if read_rect is not None:
+            # reading a tile isn't a change to the image, so only the display needs updating
+            self.tiles.mark_dirty(read_rect, 'mip')
+        if self.tiled_document_reader.is_finished():
+            self._close_tiled_document()
+
+    def _close_tiled_document(self):
+        if self.tiled_document_reader is not None:
+            self.tiled_document_reader.close()
+            self.tiled_document_reader = None
+
+    def _rebuild_display(self):
+        if self.zoom_level < 0:
+            display_size = MipPyramid.get_level_size(self.canvas_image.get_size(),
+                                                     -self.zoom_level)
+        else:
+            display_size = (self.canvas_image.get_width() << self.zoom_level,
+                            self.canvas_image.get_height() << self.zoom_level)
+        self._zoomed_in_image = None
+        self._zoomed_in_canvas_rect = None
 
-        :param new_image: the new image surface to use in the UIImage element.
+        if display_size != self.rect.size:
+            self.set_dimensions(display_size)
+        self._refresh_image()
+
+    def _get_display_rect(self, rect: pygame.Rect) -> pygame.Rect:
+        # the area of the zoomed canvas covering an area of the full size image
+        if self.zoom_level < 0:
+            area = MipPyramid.get_level_rect(rect, -self.zoom_level)
+        else:
+            area = pygame.Rect(rect.left << self.zoom_level, rect.top << self.zoom_level,
+                               rect.width << self.zoom_level, rect.height << self.zoom_level)
+        return area.clip(pygame.Rect((0, 0), self.rect.size))
+
+    def _get_visible_rect(self) -> pygame.Rect:
+        # the area of the zoomed canvas inside the scrolling view
+        clip_rect = self.get_image_clipping_rect()
+        if clip_rect is None:
+            return pygame.Rect((0, 0), self.rect.size)
+        return clip_rect
+
+    def _set_image_clip(self, rect: Optional[pygame.Rect]):
+        # The base class keeps a full size copy of the image to clip. The canvas shows just
+        # the visible part of its image instead. This is called whenever the canvas moves.
+        if rect is not None:
+            rect.width = max(rect.width, 0)
+            rect.height = max(rect.height, 0)
+        self._image_clip = rect
+        if self.canvas_image is not None:
+            self._refresh_image()
+
+    def _refresh_image(self):
         """
-        self._set_image(new_image)
+        Point the element at the image to show for the visible part of the canvas, scaling
+        it up first if zoomed in.
+        """
+        # tiles still to be read from a tiled document are read as they come into view
+        self._read_tiled_document(self.get_visible_canvas_rect())
+        visible_rect = self._get_visible_rect()
+        if visible_rect.width == 0 or visible_rect.height == 0:
+            self.image = self.ui_manager.get_universal_empty_surface()
+            source_area = pygame.Rect(0, 0, 0, 0)
+        elif self.zoom_level > 0:
+            # a zoomed out rect of the view is the area of the canvas image it shows
+            canvas_rect = MipPyramid.get_level_rect(visible_rect, self.zoom_level)
+            canvas_rect = canvas_rect.clip(self.canvas_image.get_rect())
+            if canvas_rect != self._zoomed_in_canvas_rect:
+                self._scale_up_view(canvas_rect)
+            self.image = self._zoomed_in_image
+            source_area = visible_rect.move(-(canvas_rect.left << self.zoom_level),
+                                            -(canvas_rect.top << self.zoom_level))
+        elif self.zoom_level < 0:
+            self.image = self.mip_pyramid.get_level(-self.zoom_level)
+            source_area = visible_rect
+        else:
+            self.image = self.canvas_image
+            source_area = visible_rect
+
+        # The sprite group blits each element's image using its blit data, so pointing that
+        # at the visible area draws it without copying or clipping the rest of the image.
+        self.blit_data[1] = visible_rect.move(self.rect.topleft)
+        self.blit_data[2] = source_area
+
+    def _scale_up_view(self, canvas_rect: pygame.Rect):
+        view_size = (canvas_rect.width << self.zoom_level,
+                     canvas_rect.height << self.zoom_level)
+        if self._zoomed_in_image is None or self._zoomed_in_image.get_size() != view_size:
+            self._zoomed_in_image = pygame.Surface(view_size, flags=pygame.SRCALPHA, depth=32)
+        pygame.transform.scale(self.canvas_image.subsurface(canvas_rect), view_size,
+                               self._zoomed_in_image)
+        self._zoomed_in_canvas_rect = canvas_rect
@@ -0,0 +1,82 @@
+import pygame
+
+from pygame_gui.elements import UIWindow, UILabel, UIHorizontalSlider, UIButton
+from pygame_gui import UI_BUTTON_PRESSED, UI_HORIZONTAL_SLIDER_MOVED
+
+from ui.event_types import UI_PAINT_PNG_COMPRESSION_CHANGED
+
+
+class UIPNGOptionsDialog(UIWindow):
+    def __init__(self, rect,
+                 manager,
+                 compression_level):
+        super().__init__(rect, manager,
+                         window_display_title='PNG Options',
+                         object_id='#png_options_dialog',
+                         resizable=False)
+
+        UILabel(relative_rect=pygame.Rect(10, 20, 160, 30),
+                text='Compression level',
+                manager=self.ui_manager,
+                container=self,
+                object_id='#small_header_label')
+
+        self.compression_level = compression_level
+
+        self.level_slider = UIHorizontalSlider(pygame.Rect(20, 60, 200, 20),
+                                               value_range=(0, 9),
+                                               start_value=self.compression_level,
+                                               manager=self.ui_manager,
+                                               container=self,
+                                               object_id='#compression_level_slider')
+
+        self.level_label = UILabel(relative_rect=pygame.Rect(230, 55, 40, 30),
+                                   text=str(self.compression_level),
+                                   manager=self.ui_manager,
+                                   container=self)
+
+        UILabel(relative_rect=pygame.Rect(20, 85, 200, 20),
+                text='Faster          Smaller',
+                manager=self.ui_manager,
+                container=self)
+
+        self.ok_button = UIButton(relative_rect=pygame.Rect(-220, -40, 100, 30),
+                                  text='OK',
+                                  manager=self.ui_manager,
+                                  container=self,
+                                  object_id='#ok_button',
+                                  anchors={'left': 'right',
+                                           'right': 'right',
+                                           'top': 'bottom',
+                                           'bottom': 'bottom'})
+
+        self.cancel_button = UIButton(relative_rect=pygame.Rect(-110, -40, 100, 30),
+                                      text='Cancel',
+                                      manager=self.ui_manager,
+                                      container=self,
+                                      object_id='#cancel_button',
+                                      anchors={'left': 'right',
+                                               'right': 'right',
+                                               'top': 'bottom',
+                                               'bottom': 'bottom'})
+
+    def process_event(self, event: pygame.event.Event) -> bool:
+        consumed_event = super().process_event(event)
+        if (event.type == UI_BUTTON_PRESSED and
+                event.ui_element == self.cancel_button):
+            self.kill()
+
+        if (event.type == UI_BUTTON_PRESSED and
+                event.ui_element == self.ok_button):
+            event_data = {'compression_level': self.compression_level,
+                          'ui_element': self,
+                          'ui_object_id': self.most_specific_combined_id}
+            pygame.event.post(pygame.event.Event(UI_PAINT_PNG_COMPRESSION_CHANGED, event_data))
+            self.kill()
+
+        if (event.type == UI_HORIZONTAL_SLIDER_MOVED and
+                event.ui_element == self.level_slider):
+            self.compression_level = int(event.value)
+            self.level_label.set_text(str(self.compression_level))
+
+        return consumed_event
@@ -4,6 +4,7 @@ import pygame_gui
 from pygame_gui.elements import UIHorizontalSlider, UIButton, UILabel
 
 from tools.brush_tool import BrushTool
+from tools.brush_stamp_cache import BrushStampCache
 from tools.fill_tool import FillTool
 from tools.dropper_tool import DropperTool
 
@@ -59,11 +60,16 @@ class ToolBarWindow(pygame_gui.elements.UIWindow):
         # tool options params
         self.palette_colour = pygame.Color(255, 255, 255, 255)
         self.brush_size = 16
+        self.brush_spacing = 10
         self.opacity = 255
         self.threshold = 0.1
 
+        # brush stamps are kept between brush tools, so switching tools doesn't lose them
+        self.brush_stamp_cache = BrushStampCache()
+
         # starting tool
-        self.active_tool = BrushTool(self.palette_colour, self.opacity, self.brush_size)
+        self.active_tool = BrushTool(self.palette_colour, self.opacity, self.brush_size,
+                                     self.brush_spacing, self.brush_stamp_cache)
 
         self.palette_button = UIButton(pygame.Rect(52, -264, 64, 64),
                                        text='',
@@ -86,8 +92,13 @@ class ToolBarWindow(pygame_gui.elements.UIWindow):
         self.refresh_tool_options_ui()
 
     def set_active_tool(self, tool_name):
+        if self.active_tool is not None and self.active_tool.is_busy():
+            # let the current tool finish, or be cancelled, before switching
+            return
+
         if tool_name == 'brush':
-            self.active_tool = BrushTool(self.palette_colour, self.opacity, self.brush_size)
+            self.active_tool = BrushTool(self.palette_colour, self.opacity, self.brush_size,
+                                         self.brush_spacing, self.brush_stamp_cache)
         elif tool_name == 'dropper':
             self.active_tool = DropperTool()
         elif tool_name == 'fill':
@@ -166,6 +177,29 @@ class ToolBarWindow(pygame_gui.elements.UIWindow):
                                  'top': 'bottom',
                                  'bottom': 'bottom'})
                     current_y += 25
+                elif option_data == 'brush_spacing':
+                    self.tool_options_ui_dict['brush_spacing_label'] = UILabel(
+                        pygame.Rect(10, current_y, 148, 20),
+                        "Brush spacing (%):",
+                        manager=self.ui_manager,
+                        container=self,
+                        anchors={'left': 'left',
+                                 'right': 'left',
+                                 'top': 'bottom',
+                                 'bottom': 'bottom'})
+                    current_y += 20
+                    self.tool_options_ui_dict['brush_spacing'] = UIHorizontalSlider(
+                        pygame.Rect(10, current_y, 148, 20),
+                        value_range=(1, 100),
+                        start_value=self.brush_spacing,
+                        manager=self.ui_manager,
+                        container=self,
+                        object_id='#brush_spacing_slider',
+                        anchors={'left': 'left',
+                                 'right': 'left',
+                                 'top': 'bottom',
+                                 'bottom': 'bottom'})
+                    current_y += 25
                 elif option_data == 'threshold':
                     self.tool_options_ui_dict['threshold_label'] = UILabel(
                         pygame.Rect(10, current_y,
@@ -242,6 +276,11 @@ class ToolBarWindow(pygame_gui.elements.UIWindow):
             self.brush_size = int(event.value)
             self.active_tool.set_option('brush_size', self.brush_size)
 
+        if (event.type == pygame_gui.UI_HORIZONTAL_SLIDER_MOVED and
+                event.ui_object_id == '#tool_bar_window.#brush_spacing_slider'):
+            self.brush_spacing = int(event.value)
+            self.active_tool.set_option('brush_spacing', self.brush_spacing)
+
         if (event.type == pygame_gui.UI_HORIZONTAL_SLIDER_MOVED and
                 event.ui_object_id == '#tool_bar_window.#opacity_slider'):
             self.opacity = int(event.value)
@@ -262,14 +301,12 @@ class ToolBarWindow(pygame_gui.elements.UIWindow):
 
         if self.active_tool is not None and self.active_tool.active_canvas is not None:
             mouse_pos = self.ui_manager.get_mouse_position()
-            if self.active_tool.active_canvas.hover_point(mouse_pos[0], mouse_pos[1]):
-                if self.active_tool.active_canvas.get_image_clipping_rect() is not None:
-                    self.active_tool.update(time_delta=time_delta,
-                                            canvas_surface=self.active_tool.active_canvas._pre_clipped_image,
-                                            canvas_position=self.active_tool.active_canvas.rect.topleft,
-                                            canvas=self.active_tool.active_canvas)
-                else:
-                    self.active_tool.update(time_delta=time_delta,
-                                            canvas_surface=self.active_tool.active_canvas.image,
-                                            canvas_position=self.active_tool.active_canvas.rect.topleft,
-                                            canvas=self.active_tool.active_canvas)
+            if (self.active_tool.active_canvas.hover_point(mouse_pos[0], mouse_pos[1]) or
+                    self.active_tool.is_busy()):
+                # tools start where the mouse is, inside the view of the canvas
+                active_canvas = self.active_tool.active_canvas
+                self.active_tool.update(time_delta=time_delta,
+                                        canvas_surface=active_canvas.get_image(
+                                            active_canvas.get_visible_canvas_rect()),
+                                        canvas_position=active_canvas.rect.topleft,
+                                        canvas=active_canvas)